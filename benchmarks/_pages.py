@@ -0,0 +1,25 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+A4_300DPI = (2480, 3508)
+
+
+def synthetic_page(size=A4_300DPI, angle: float = 0.0, lines: int = 60, seed: int = 0) -> Image.Image:
+    """Render a text-like RGB page (rows of word blobs) rotated by `angle` degrees."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    page = np.full((h, w), 255, dtype=np.uint8)
+    margin = w // 10
+    line_gap = (h - 2 * margin) // lines
+    for i in range(lines):
+        y = margin + i * line_gap
+        x = margin
+        while x < w - margin:
+            word = ''.join(chr(c) for c in rng.integers(97, 123, size=int(rng.integers(2, 9))))
+            cv2.putText(page, word, (x, y), cv2.FONT_HERSHEY_SIMPLEX, line_gap / 45, 0, max(1, line_gap // 20))
+            x += int(len(word) * line_gap * 0.45) + line_gap // 2
+    if angle:
+        M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+        page = cv2.warpAffine(page, M, (w, h), flags=cv2.INTER_CUBIC, borderValue=255)
+    return Image.fromarray(page).convert("RGB")
@@ -0,0 +1,45 @@
+"""Decode + preprocess time of a large phone-photo JPEG at full size vs. text-size normalized.
+
+Usage: python benchmarks/bench_normalize.py [repeats]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+
+from services import preprocess
+from benchmarks._pages import synthetic_page
+
+
+def measure(name, fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<28} {best * 1000:8.1f} ms")
+    return out
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    # An A4 page photographed at ~48 MP: text about 2.4x larger than needed.
+    page = synthetic_page()
+    photo = page.resize((page.width * 24 // 10, page.height * 24 // 10), Image.Resampling.BICUBIC)
+    path = os.path.join(tempfile.mkdtemp(), 'photo.jpg')
+    photo.save(path, quality=90)
+    print(f"photo: {photo.size[0]}x{photo.size[1]} JPEG")
+
+    full = measure("full decode", lambda: Image.open(path).convert("RGB"), repeats)
+    measure("  + preprocess", lambda: preprocess.preprocess_for_ocr(full), repeats)
+    small = measure("open_for_ocr", lambda: preprocess.open_for_ocr(path), repeats)
+    measure("  + preprocess", lambda: preprocess.preprocess_for_ocr(small), repeats)
+    print(f"pixels for OCR: {full.width * full.height / 1e6:.1f} MP -> {small.width * small.height / 1e6:.1f} MP")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Compare the sampled projection-profile skew estimator with the old minAreaRect one.
+
+Usage: python benchmarks/bench_skew.py [repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cv2
+import numpy as np
+
+from services.preprocess import estimate_skew, to_gray
+from benchmarks._pages import synthetic_page
+
+ANGLES = [-20.0, -5.0, -1.5, -0.4, 0.0, 0.8, 3.0, 12.0]
+
+
+def min_area_rect_skew(ink):
+    """The previous `deskew` estimator: minAreaRect over every ink pixel."""
+    coords = np.column_stack(np.where(ink > 0))
+    if coords.size == 0:
+        return 0.0
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle < -45:
+        return -(90 + angle)
+    return -angle
+
+
+def best_time(fn, arg, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"{'angle':>7} {'old est':>8} {'old ms':>8} {'new est':>8} {'new ms':>8}")
+    totals = [0.0, 0.0]
+    for angle in ANGLES:
+        gray = to_gray(synthetic_page(angle=angle))
+        ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+        old, old_t = best_time(min_area_rect_skew, ink, repeats)
+        new, new_t = best_time(estimate_skew, ink, repeats)
+        totals[0] += old_t
+        totals[1] += new_t
+        print(f"{angle:7.1f} {old:8.2f} {old_t * 1000:8.1f} {new:8.2f} {new_t * 1000:8.1f}")
+    print(f"total: old {totals[0] * 1000:.0f} ms, new {totals[1] * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
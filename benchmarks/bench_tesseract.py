@@ -0,0 +1,49 @@
+"""Compare the old two-call Tesseract path with the single-pass adapter.
+
+Usage: python benchmarks/bench_tesseract.py [image] [repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+import pytesseract
+
+from services.tesseract_adapter import TesseractAdapter
+
+CONFIG = "-l eng --oem 1 --psm 3"
+
+
+def two_call(image):
+    data = pytesseract.image_to_data(image, config=CONFIG, output_type=pytesseract.Output.DICT)
+    text = pytesseract.image_to_string(image, config=CONFIG)
+    return text, data
+
+
+def timed(fn, image, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(image)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'input.jpg'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    image = Image.open(path)
+    image.load()
+    adapter = TesseractAdapter()
+
+    old = timed(two_call, image, repeats)
+    new = timed(lambda img: adapter.ocr(img, langs=['eng']), image, repeats)
+    print(f"two-call (image_to_data + image_to_string): {old * 1000:.1f} ms")
+    print(f"single-pass (image_to_data only):           {new * 1000:.1f} ms")
+    print(f"speedup: {old / new:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Load test for the upload handler: latency under concurrent uploads.
+
+Drives `handlers.files.handle_document` with simulated Telegram uploads
+against fakeredis (or a real Redis when REDIS_URL is set) and reports p50/p99
+handler latency plus the worst event-loop stall. `--inline` runs the
+blocking work on the event loop, as the handlers did before it was
+offloaded, for comparison. fakeredis executes commands (and Lua) on the
+event loop itself, so stall figures are only representative against a real
+Redis.
+
+Usage: python benchmarks/load_handlers.py [--uploads N] [--concurrency C]
+                                          [--size-kb KB] [--enqueue-ms MS] [--inline]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fakeredis
+
+from handlers import files
+from storage.cache import AsyncCache
+from storage.dedupe import AsyncUploadIndex
+from storage.rate_limiter import AsyncRateLimiter
+from storage.result_store import RedisResultStore
+
+
+class Message:
+    def __init__(self, chat_id, document):
+        self.chat_id = chat_id
+        self.document = document
+
+    async def reply_text(self, text):
+        await asyncio.sleep(0.002)  # Bot API round trip
+
+    async def reply_document(self, document, filename, caption=None):
+        await asyncio.sleep(0.002)
+
+
+class Upload:
+    mime_type = "application/pdf"
+
+    def __init__(self, n, payload_path, size):
+        self.file_id = f"f{n}"
+        self.file_unique_id = f"u{n}"
+        self.file_size = size
+        self.file_name = f"scan{n}.pdf"
+        self.payload_path = payload_path
+
+    async def get_file(self):
+        await asyncio.sleep(0.005)  # getFile round trip
+        # served from disk, as with a local Bot API server
+        return SimpleNamespace(file_path=self.payload_path)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+async def watch_loop(stop, interval=0.001):
+    """Return the longest delay between scheduled wake-ups (event-loop stall)."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(args):
+    if os.environ.get("REDIS_URL"):
+        from storage.redis_pool import get_async_redis, get_redis
+        aconn, sync_conn = get_async_redis(), get_redis()
+    else:
+        server = fakeredis.FakeServer()
+        aconn, sync_conn = fakeredis.FakeAsyncRedis(server=server), fakeredis.FakeRedis(server=server)
+    files._rate_limiter = AsyncRateLimiter(max_per_minute=10 ** 6, conn=aconn)
+    files._cache = AsyncCache(conn=aconn)
+    files._upload_index = AsyncUploadIndex(conn=aconn)
+    files._result_store = RedisResultStore(sync_conn)
+
+    import tasks.queue_manager as qm
+
+    def enqueue_job(*a, **kw):
+        time.sleep(args.enqueue_ms / 1000.0)  # RQ enqueue round trips
+        return SimpleNamespace(id="job")
+    qm.enqueue_ocr_job = enqueue_job
+
+    if args.inline:
+        async def inline(fn, *a, **kw):
+            return fn(*a, **kw)
+        files._offload = inline
+
+    payload_path = os.path.join(tempfile.mkdtemp(), "payload")
+    with open(payload_path, "wb") as fh:
+        fh.write(os.urandom(args.size_kb * 1024))
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(n):
+        upload = Upload(n, payload_path, args.size_kb * 1024)
+        update = SimpleNamespace(message=Message(n % 1000, upload))
+        async with sem:
+            start = time.perf_counter()
+            await files.handle_document(update, SimpleNamespace(user_data={}))
+            latencies.append(time.perf_counter() - start)
+
+    await one(-1)  # warm up lazy imports and pools
+    latencies.clear()
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(args.uploads)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    stall = await watcher
+
+    mode = "inline" if args.inline else "offloaded"
+    print(f"{mode}: {args.uploads} uploads, concurrency {args.concurrency}, {args.size_kb} KiB each")
+    print(f"  throughput {args.uploads / elapsed:.0f} uploads/s")
+    print(f"  latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms")
+    print(f"  worst event-loop stall {stall * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--enqueue-ms", type=float, default=5.0)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+    tempfile.tempdir = tempfile.mkdtemp(prefix="tgocr-load-")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -43,10 +43,11 @@ async def toggle_cloud(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def health(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from tasks.queue_manager import redis_conn
+    from tasks.queue_manager import queue_status, redis_conn
     try:
         info = redis_conn.info()
-        qlen = redis_conn.llen('rq:queue:default')
-        await update.message.reply_text(f"OK. Redis connected. Queue length: {qlen}")
+        status = ", ".join(f"ocr-{name} {queued} queued/{pending} pending"
+                           for name, (queued, pending) in queue_status().items())
+        await update.message.reply_text(f"OK. Redis connected. Queues: {status}")
     except Exception as e:
         await update.message.reply_text(f"Health check failed: {e}")
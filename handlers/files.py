@@ -1,8 +1,12 @@
 import asyncio
+import functools
 import logging
+import math
 import mimetypes
 import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 from telegram import Update
 from telegram.ext import ContextTypes
@@ -11,124 +15,231 @@ from telegram.ext import ContextTypes
 
 logger = logging.getLogger(__name__)
 
-
-async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = update.message
-    doc = message.document
-
-    # Download file to a temp path that persists until worker completes
-    tmpdir = tempfile.mkdtemp()
-    file_path = os.path.join(tmpdir, doc.file_name or "file")
-    try:
-        file_obj = await doc.get_file()
-        await file_obj.download_to_drive(custom_path=file_path)
-    except Exception as e:
-        logger.exception("Failed to download document")
-        await message.reply_text("Sorry, failed to download your file.")
+IN_FLIGHT_TEXT = "This file is already being processed; you'll get the result when it's ready."
+FAILED_TEXT = "Sorry, processing this file failed. Please send it again."
+# Files served by a local Bot API server are copied in chunks of this size.
+DOWNLOAD_CHUNK = 64 * 1024
+
+# Shared per-process instances. Redis lookups use asyncio clients on the bot's
+# event loop; blocking work (disk, hashing, RQ enqueue) goes to `_io_executor`.
+_rate_limiter = None
+_cache = None
+_upload_index = None
+_result_store = None
+_flight = None
+_io_executor = None
+
+
+def _get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        from storage.rate_limiter import AsyncRateLimiter
+        _rate_limiter = AsyncRateLimiter()
+    return _rate_limiter
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        from storage.cache import AsyncCache
+        _cache = AsyncCache()
+    return _cache
+
+
+def _get_upload_index():
+    global _upload_index
+    if _upload_index is None:
+        from storage.dedupe import AsyncUploadIndex
+        _upload_index = AsyncUploadIndex(conn=_get_cache().conn)
+    return _upload_index
+
+
+def _get_flight():
+    global _flight
+    if _flight is None:
+        from storage.singleflight import AsyncSingleFlight
+        _flight = AsyncSingleFlight(conn=_get_cache().conn)
+    return _flight
+
+
+def _get_result_store():
+    global _result_store
+    if _result_store is None:
+        from storage.result_store import get_result_store
+        _result_store = get_result_store()
+    return _result_store
+
+
+def _get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        workers = int(os.environ.get("HANDLER_IO_WORKERS", "8"))
+        _io_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler-io")
+    return _io_executor
+
+
+async def _offload(fn, *args, **kwargs):
+    """Run blocking `fn` on the bounded handler executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_io_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def _write_and_hash(file_path: str, data=None, source: str = None) -> str:
+    """Write `data`, or copy the file at `source`, to `file_path` and return its SHA-256.
+
+    The bytes are hashed as they are written, so the upload is never re-read
+    from disk.
+    """
+    from utils.hashing import HashingWriter
+    with open(file_path, 'wb') as fh:
+        writer = HashingWriter(fh)
+        if source is None:
+            writer.write(data)
+        else:
+            with open(source, 'rb') as src:
+                for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK), b''):
+                    writer.write(chunk)
+    return writer.hexdigest()
+
+
+async def _download_and_hash(file_obj, file_path: str) -> str:
+    """Download a Telegram `File` to `file_path` and return its content hash.
+
+    Remote files are fetched with `File.download_as_bytearray`, i.e. through
+    the bot's own request object with its proxy, timeouts and file URL (the
+    Bot API serves at most 20 MB, so the body fits in memory). With a local
+    Bot API server `file_path` is a path on disk and is copied in chunks.
+    Disk writes and hashing run on the I/O executor.
+    """
+    if urlsplit(file_obj.file_path or '').scheme in ('http', 'https'):
+        data = await file_obj.download_as_bytearray()
+        return await _offload(_write_and_hash, file_path, data)
+    return await _offload(_write_and_hash, file_path, source=file_obj.file_path)
+
+
+def _cleanup(file_path: str):
+    """Remove a download and the temp directory `_handle_upload` created for it."""
+    for remove, path in ((os.remove, file_path), (os.rmdir, os.path.dirname(file_path))):
         try:
-            os.remove(file_path)
+            remove(path)
         except Exception:
             pass
-        return
 
-    # Rate limiting
-    from storage.rate_limiter import RateLimiter
-    rl = RateLimiter()
-    if not rl.allow(message.chat_id):
-        remaining = rl.remaining(message.chat_id)
-        await message.reply_text(
-            f"Rate limit exceeded. Try again in {60} seconds. Remaining this minute: {remaining}"
-        )
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
-        return
 
-    # Check cache by file hash
-    from storage.cache import Cache
-    from utils.hashing import sha256_file
-    cache = Cache()
-    file_hash = sha256_file(file_path)
-    if cache.exists(file_hash):
-        payload = cache.get(file_hash)
-        await message.reply_text("Found cached result; sending...")
-        from tasks.worker_rq import send_file, send_message
-        send_message(message.chat_id, "Sending cached OCR result")
-        send_file(message.chat_id, payload['txt_path'], caption="Cached OCR result")
+async def _serve_cached(message, file_hash: str, opts: dict) -> bool:
+    from storage.cache import cache_key
+    payload = await _get_cache().get(cache_key(file_hash, opts))
+    if not payload:
+        return False
+    text = await _offload(_get_result_store().get, payload.get("result_key", ""))
+    if text is None:
+        return False
+    from storage.result_store import result_filename
+    await message.reply_text("Found cached result; sending...")
+    await message.reply_document(document=text.encode("utf-8"), filename=result_filename(file_hash),
+                                 caption="Cached OCR result")
+    return True
+
+
+async def _abandon_flight(context, key: str, flight_token: str):
+    """Release a lease no job will settle, telling uploads that joined it in the meantime."""
+    try:
+        subscribers = await _get_flight().release(key, flight_token)
+    except Exception:
+        logger.exception("Failed to release single-flight lease for %s", key)
+        return
+    for chat_id in set(subscribers):
         try:
-            os.remove(file_path)
-        except Exception:
-            pass
+            await context.bot.send_message(chat_id=chat_id, text=FAILED_TEXT)
+        except Exception as e:
+            logger.warning("Failed to notify chat %s: %s", chat_id, e)
+
+
+async def _handle_upload(message, context, tg_file, filename: str, mime_type: str, received_text: str,
+                         download_error: str):
+    """Admit, dedupe, download and enqueue one upload.
+
+    Rate limiting and the `file_unique_id` dedupe lookup run before any bytes
+    are downloaded (or a temp directory is created for them); when a download
+    is needed the file is saved as `filename` in a fresh temp directory and
+    hashed while it is written on the I/O executor. Uploads
+    whose content and options are already being processed subscribe to that
+    job instead of enqueuing another one; if the enqueue fails, the lease is
+    released at once so those uploads are not left waiting on a job that
+    does not exist.
+    """
+    limit = await _get_rate_limiter().check(message.chat_id)
+    if not limit.allowed:
+        await message.reply_text(
+            f"Rate limit exceeded. Try again in {math.ceil(limit.retry_after)} seconds."
+        )
         return
 
-    await message.reply_text(f"Received {doc.file_name}. Queued for processing.")
-
-    # Enqueue job in Redis RQ
-    from tasks.queue_manager import enqueue_job
     opts = {
         'langs': context.user_data.get('langs'),
         'cloud_ocr': context.user_data.get('cloud_ocr', True)
     }
-    job = enqueue_job('tasks.worker_rq.process_file_job_rq', file_path, doc.mime_type, message.chat_id, opts)
-    await message.reply_text(f"Job queued (id={job.id}).")
-
-
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = update.message
-    photo = message.photo[-1]  # highest resolution
+    index = _get_upload_index()
+    file_unique_id = getattr(tg_file, 'file_unique_id', None)
+    file_size = getattr(tg_file, 'file_size', None)
+    known_hash = await index.lookup(file_unique_id, file_size)
+    if known_hash and await _serve_cached(message, known_hash, opts):
+        return
+    from storage.cache import cache_key
+    if known_hash and await _get_flight().join(cache_key(known_hash, opts), message.chat_id):
+        await message.reply_text(IN_FLIGHT_TEXT)
+        return
 
-    tmpdir = tempfile.mkdtemp()
-    file_path = os.path.join(tmpdir, f"photo_{photo.file_id}.jpg")
+    # Download file to a temp path that persists until worker completes
+    file_path = os.path.join(tempfile.mkdtemp(), filename)
     try:
-        file_obj = await photo.get_file()
-        await file_obj.download_to_drive(custom_path=file_path)
-    except Exception as e:
-        logger.exception("Failed to download photo")
-        await message.reply_text("Sorry, failed to download your photo.")
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
+        file_obj = await tg_file.get_file()
+        file_hash = await _download_and_hash(file_obj, file_path)
+    except Exception:
+        logger.exception("Failed to download %s", file_path)
+        await message.reply_text(download_error)
+        _cleanup(file_path)
         return
 
-    # Rate limiting for photo
-    from storage.rate_limiter import RateLimiter
-    rl = RateLimiter()
-    if not rl.allow(message.chat_id):
-        remaining = rl.remaining(message.chat_id)
-        await message.reply_text(
-            f"Rate limit exceeded. Try again in {60} seconds. Remaining this minute: {remaining}"
-        )
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
+    await index.remember(file_unique_id, file_size, file_hash)
+    if await _serve_cached(message, file_hash, opts):
+        _cleanup(file_path)
         return
 
-    # Check cache
-    from storage.cache import Cache
-    from utils.hashing import sha256_file
-    cache = Cache()
-    file_hash = sha256_file(file_path)
-    if cache.exists(file_hash):
-        payload = cache.get(file_hash)
-        await message.reply_text("Found cached result; sending...")
-        from tasks.worker_rq import send_file, send_message
-        send_message(message.chat_id, "Sending cached OCR result")
-        send_file(message.chat_id, payload['txt_path'], caption="Cached OCR result")
-        try:
-            os.remove(file_path)
-        except Exception:
-            pass
+    # Single-flight: only the first upload of this content and options runs a job
+    flight_token = await _get_flight().acquire(cache_key(file_hash, opts), message.chat_id)
+    if flight_token is None:
+        _cleanup(file_path)
+        await message.reply_text(IN_FLIGHT_TEXT)
         return
 
-    await message.reply_text("Received photo. Queued for OCR.")
+    await message.reply_text(received_text)
 
-    from tasks.queue_manager import enqueue_job
-    opts = {
-        'langs': context.user_data.get('langs'),
-        'cloud_ocr': context.user_data.get('cloud_ocr', True)
-    }
-    job = enqueue_job('tasks.worker_rq.process_file_job_rq', file_path, 'image/jpeg', message.chat_id, opts)
+    # Route by estimated cost and enqueue in Redis RQ
+    from tasks.queue_manager import enqueue_ocr_job
+    try:
+        job = await _offload(enqueue_ocr_job, file_path, mime_type, message.chat_id, opts,
+                             file_hash=file_hash, flight_token=flight_token)
+    except Exception:
+        logger.exception("Failed to enqueue %s", file_path)
+        _cleanup(file_path)
+        await message.reply_text(FAILED_TEXT)
+        await _abandon_flight(context, cache_key(file_hash, opts), flight_token)
+        return
     await message.reply_text(f"Job queued (id={job.id}).")
+
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    doc = message.document
+    await _handle_upload(message, context, doc, doc.file_name or "file", doc.mime_type,
+                         f"Received {doc.file_name}. Queued for processing.",
+                         "Sorry, failed to download your file.")
+
+
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    photo = message.photo[-1]  # highest resolution
+    await _handle_upload(message, context, photo, f"photo_{photo.file_id}.jpg", 'image/jpeg',
+                         "Received photo. Queued for OCR.",
+                         "Sorry, failed to download your photo.")
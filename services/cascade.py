@@ -0,0 +1,54 @@
+import os
+from typing import Dict, List, Optional
+
+from utils.langdet import tesseract_langs
+
+# Tesseract page confidence (0-100) below which a page is re-read by the cloud engine.
+DEFAULT_CLOUD_THRESHOLD = 65.0
+# Confidence reported for a page skipped as blank: no engine read it, so it is not a score.
+BLANK_PAGE = -1.0
+
+
+def parse_thresholds(spec: str) -> Dict[str, float]:
+    """Parse "rus=75,uzb=60" into {"rus": 75.0, "uzb": 60.0}."""
+    thresholds = {}
+    for item in (spec or "").split(","):
+        lang, sep, value = item.partition("=")
+        if sep and lang.strip():
+            thresholds[lang.strip()] = float(value)
+    return thresholds
+
+
+class CascadePolicy:
+    """Decides which Tesseract pages are worth a cloud OCR call.
+
+    Tesseract reads every page first; a page is escalated when its confidence
+    is below the threshold for the job's languages, which is the strictest
+    per-language threshold (OCR_CLOUD_THRESHOLDS, e.g. "rus=75,uzb=60") among
+    the requested languages, else OCR_CLOUD_THRESHOLD. Pages Tesseract failed
+    on are always escalated. Pages skipped as blank (confidence `BLANK_PAGE`)
+    are only a heuristic's guess and are escalated too, unless
+    OCR_CLOUD_BLANK_PAGES=0.
+    """
+
+    def __init__(self, threshold: float = None, per_language: Dict[str, float] = None,
+                 escalate_blank: bool = None):
+        if threshold is None:
+            threshold = float(os.environ.get("OCR_CLOUD_THRESHOLD", DEFAULT_CLOUD_THRESHOLD))
+        self.threshold = threshold
+        if per_language is None:
+            per_language = parse_thresholds(os.environ.get("OCR_CLOUD_THRESHOLDS", ""))
+        # keys and requested languages may be user codes ("ru") or model names ("rus")
+        self.per_language = {tesseract_langs([lang])[0]: value for lang, value in per_language.items()}
+        if escalate_blank is None:
+            escalate_blank = os.environ.get("OCR_CLOUD_BLANK_PAGES", "1") not in ("0", "false", "no")
+        self.escalate_blank = escalate_blank
+
+    def threshold_for(self, langs: Optional[List[str]]) -> float:
+        specific = [self.per_language[lang] for lang in tesseract_langs(langs) if lang in self.per_language]
+        return max(specific) if specific else self.threshold
+
+    def escalate(self, conf: Optional[float], langs: Optional[List[str]] = None) -> bool:
+        if conf == BLANK_PAGE:
+            return self.escalate_blank
+        return conf is None or conf < self.threshold_for(langs)
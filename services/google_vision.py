@@ -1,35 +1,171 @@
+import io
 import logging
-from typing import List, Tuple
+import os
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Vision accepts at most 16 images per images:annotate request.
+MAX_BATCH = 16
+DEFAULT_ENDPOINT = "https://vision.googleapis.com/v1"
+
+
+class VisionResult(NamedTuple):
+    text: str
+    confidence: float
+    error: Optional[str]
+
+
+def encode_image(image: Image.Image, quality: int = 90) -> bytes:
+    """Encode a page as JPEG in memory for upload."""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _avg_word_confidence(pages) -> float:
+    # confidence aggregation (pages -> blocks -> paragraphs -> words)
+    confs = []
+    for page in pages:
+        for block in _get(page, "blocks"):
+            for par in _get(block, "paragraphs"):
+                for word in _get(par, "words"):
+                    conf = _get(word, "confidence", None)
+                    if conf is not None:
+                        confs.append(conf)
+    return float(sum(confs)) / len(confs) if confs else 0.0
+
+
+def _get(obj, name, default=()):
+    # REST responses are dicts, client-library responses are proto-plus messages
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _parse_response(resp) -> VisionResult:
+    error = _get(resp, "error", None)
+    message = _get(error, "message", "") if error else ""
+    if message:
+        return VisionResult("", 0.0, message)
+    annotation = _get(resp, "fullTextAnnotation", None) if isinstance(resp, dict) \
+        else _get(resp, "full_text_annotation", None)
+    if not annotation:
+        return VisionResult("", 0.0, None)
+    return VisionResult(_get(annotation, "text", ""), _avg_word_confidence(_get(annotation, "pages")), None)
+
 
 class GoogleVisionAdapter:
-    def __init__(self, credentials_json: str = None):
+    """Document text detection through Google Cloud Vision, batching several pages per request.
+
+    Uses the REST `images:annotate` endpoint when GOOGLE_VISION_API_KEY or
+    GOOGLE_VISION_ENDPOINT is set (the latter also lets tests point it at a
+    local fake), else the google-cloud-vision client library. A `client`
+    exposing `batch_annotate_images(requests=...)` can be injected instead.
+    The adapter holds one long-lived client or HTTP session; share it with
+    `shared_adapter()`.
+    """
+
+    def __init__(self, credentials_json: str = None, client=None, endpoint: str = None, api_key: str = None,
+                 batch_size: int = None, timeout: float = 60.0):
+        self.batch_size = max(1, min(MAX_BATCH, batch_size or int(os.environ.get("VISION_BATCH_SIZE", MAX_BATCH))))
+        self.endpoint = endpoint or os.environ.get("GOOGLE_VISION_ENDPOINT")
+        self.api_key = api_key or os.environ.get("GOOGLE_VISION_API_KEY")
+        self.client = client
+        self._http = None
+        if client is not None:
+            return
+        if self.endpoint or self.api_key:
+            import httpx
+            self.endpoint = (self.endpoint or DEFAULT_ENDPOINT).rstrip("/")
+            self._http = httpx.Client(timeout=timeout)
+            return
         try:
             from google.cloud import vision
-            self.client = vision.ImageAnnotatorClient()
+            if credentials_json:
+                self.client = vision.ImageAnnotatorClient.from_service_account_json(credentials_json)
+            else:
+                self.client = vision.ImageAnnotatorClient()
         except Exception as e:
             logger.warning("Google Vision client not available: %s", e)
             self.client = None
 
+    @property
+    def available(self) -> bool:
+        return self.client is not None or self._http is not None
+
     def ocr(self, image_bytes: bytes, languages: List[str] = None) -> Tuple[str, float]:
-        """Return (text, avg_confidence). Requires google-cloud-vision installed and credentials set."""
-        if not self.client:
+        """Return (text, avg_confidence) for one encoded image."""
+        result = self.ocr_batch([image_bytes], languages=languages)[0]
+        if result.error:
+            raise RuntimeError(result.error)
+        return result.text, result.confidence
+
+    def ocr_batch(self, images: Iterable[bytes], languages: List[str] = None) -> List[VisionResult]:
+        """OCR encoded images, `batch_size` per request; results (or per-image errors) keep input order."""
+        if not self.available:
             raise RuntimeError("Google Vision client not configured")
+        images = list(images)
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start + self.batch_size]
+            try:
+                responses = self._annotate(batch, languages)
+                if len(responses) != len(batch):
+                    raise RuntimeError(f"Vision returned {len(responses)} responses for {len(batch)} images")
+                results.extend(_parse_response(r) for r in responses)
+            except Exception as e:
+                logger.warning("Vision batch request failed: %s", e)
+                results.extend(VisionResult("", 0.0, str(e)) for _ in batch)
+        return results
+
+    def _annotate(self, batch: List[bytes], languages: Optional[List[str]]) -> list:
+        if self._http is not None:
+            return self._annotate_rest(batch, languages)
         from google.cloud import vision
-        img = vision.Image(content=image_bytes)
-        response = self.client.document_text_detection(image=img)
-        if response.error.message:
-            raise RuntimeError(response.error.message)
-        text = response.full_text_annotation.text
-        # confidence aggregation (pages -> blocks -> paragraphs -> words)
-        confs = []
-        for page in response.full_text_annotation.pages:
-            for block in page.blocks:
-                for par in block.paragraphs:
-                    for word in par.words:
-                        if word.confidence is not None:
-                            confs.append(word.confidence)
-        avg_conf = float(sum(confs)) / len(confs) if confs else 0.0
-        return text, avg_conf
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=content),
+                features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+                image_context=vision.ImageContext(language_hints=languages or []),
+            )
+            for content in batch
+        ]
+        return list(self.client.batch_annotate_images(requests=requests).responses)
+
+    def _annotate_rest(self, batch: List[bytes], languages: Optional[List[str]]) -> list:
+        import base64
+        body = {"requests": [
+            {
+                "image": {"content": base64.b64encode(content).decode("ascii")},
+                "features": [{"type": "DOCUMENT_TEXT_DETECTION"}],
+                "imageContext": {"languageHints": languages or []},
+            }
+            for content in batch
+        ]}
+        params = {"key": self.api_key} if self.api_key else None
+        resp = self._http.post(f"{self.endpoint}/images:annotate", json=body, params=params)
+        resp.raise_for_status()
+        return resp.json().get("responses", [])
+
+    def close(self):
+        if self._http is not None:
+            self._http.close()
+
+
+_shared: Optional[GoogleVisionAdapter] = None
+_shared_lock = threading.Lock()
+
+
+def shared_adapter() -> GoogleVisionAdapter:
+    """Process-wide adapter, created on first use (i.e. inside the worker process)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = GoogleVisionAdapter()
+        return _shared
@@ -1,35 +1,87 @@
+import functools
 import logging
+import os
 from typing import Callable, Iterable, List, Tuple
 
+from services.cascade import BLANK_PAGE
 from services.tesseract_adapter import TesseractAdapter
+from services.page_executor import PageExecutor
 from services.pdf_service import PDFService
-from services.preprocess import auto_rotate, deskew, binarize
+from services.preprocess import crop, preprocess_for_ocr, recognition_regions
 
 logger = logging.getLogger(__name__)
 
 
+def _make_tesseract(engine: str):
+    """Pick the Tesseract backend: `pytesseract` (subprocess) or `tesserocr` (in-process pool)."""
+    if engine == "tesserocr":
+        from services.tesseract_engine import shared_engine
+        pooled = shared_engine()
+        if pooled.available:
+            return pooled
+        logger.warning("OCR engine 'tesserocr' requested but unavailable; falling back to pytesseract")
+    return TesseractAdapter()
+
+
+def merge_regions(results: List[Tuple[str, float]]) -> Tuple[str, float]:
+    """Join per-region (text, conf) results in reading order; confidence is weighted by word count."""
+    parts = [(text.strip(), conf) for text, conf in results if text and text.strip()]
+    if not parts:
+        return "", 0.0
+    words = [len(text.split()) for text, _ in parts]
+    conf = sum(c * n for (_, c), n in zip(parts, words)) / float(sum(words))
+    return "\n\n".join(text for text, _ in parts), conf
+
+
 class OCRService:
     def __init__(self, config=None):
-        self.tesseract = TesseractAdapter()
+        config = config or {}
+        engine = config.get("engine") or os.environ.get("OCR_ENGINE", "pytesseract")
+        self.tesseract = _make_tesseract(engine)
         self.pdf = PDFService()
 
     def ocr_image(self, image, langs: List[str] = None) -> Tuple[str, float]:
-        # Preprocess
-        image = auto_rotate(image)
-        image = deskew(image)
-        image = binarize(image)
-        text, conf = self.tesseract.ocr(image, langs=langs)
-        return text, conf
+        # Preprocess into a single binarized grayscale array
+        image = preprocess_for_ocr(image)
+        regions = recognition_regions(image)
+        if not regions:
+            # Almost certainly nothing to read; the cascade decides whether the cloud gets a look.
+            logger.debug("Blank page, skipping OCR")
+            return "", BLANK_PAGE
+        if len(regions) == 1:
+            return self.tesseract.ocr(crop(image, regions[0]), langs=langs)
+        return merge_regions([self.tesseract.ocr(crop(image, box), langs=langs) for box in regions])
 
     def ocr_pdf(self, pdf_path: str, langs: List[str] = None, progress_callback: Callable[[int, int], None] = None) -> Tuple[str, float]:
-        if self.pdf.has_text_layer(pdf_path):
-            text = self.pdf.extract_text_layer(pdf_path)
-            return text, 100.0
-
-        pages = []
-        for page_num, image in self.pdf.render_all_pages(pdf_path):
-            if progress_callback:
-                progress_callback(page_num, None)
-            t, conf = self.ocr_image(image, langs=langs)
-            pages.append(f"--- Page {page_num} ---\n" + t)
-        return "\n".join(pages), 0.0
+        doc = self.pdf.open_document(pdf_path)
+        try:
+            layout = self.pdf.analyze(doc)
+            pages = list(layout.page_texts)
+            if layout.kind != "text":
+                executor = PageExecutor()
+                if executor.use_processes:
+                    fn = functools.partial(ocr_page_task, langs=langs)
+                else:
+                    fn = functools.partial(self.ocr_image, langs=langs)
+
+                total_pages = len(pages)
+                for result in executor.map(fn, self.pdf.render_pages(doc, layout.scanned_pages)):
+                    if progress_callback:
+                        progress_callback(result.page_num, total_pages)
+                    t = result.value[0] if result.error is None else "[OCR failed for this page]"
+                    pages[result.page_num - 1] = t
+            text = "\n".join(f"--- Page {i} ---\n" + t for i, t in enumerate(pages, start=1))
+            return text, 100.0 if layout.kind == "text" else 0.0
+        finally:
+            doc.close()
+
+
+_process_service = None
+
+
+def ocr_page_task(image, langs: List[str] = None) -> Tuple[str, float]:
+    """Picklable page task for process pools; keeps one OCRService per worker process."""
+    global _process_service
+    if _process_service is None:
+        _process_service = OCRService()
+    return _process_service.ocr_image(image, langs=langs)
@@ -0,0 +1,60 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PageResult(NamedTuple):
+    page_num: int
+    value: Any
+    error: Optional[BaseException]
+
+
+def default_workers() -> int:
+    return int(os.environ.get("OCR_PAGE_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+class PageExecutor:
+    """Run a per-page function on a bounded pool and yield results in page order.
+
+    Pages are pulled lazily from the input iterator, so producing the next page
+    (e.g. rendering) overlaps with OCR of the pages already submitted. At most
+    `max_in_flight` pages are held at once, which bounds memory on long
+    documents. An exception on one page is returned in its `PageResult` rather
+    than aborting the remaining pages.
+
+    With `use_processes=True` the function and page payloads must be picklable.
+    """
+
+    def __init__(self, max_workers: int = None, max_in_flight: int = None, use_processes: bool = None):
+        self.max_workers = max(1, max_workers or default_workers())
+        self.max_in_flight = max(1, max_in_flight or int(os.environ.get("OCR_PAGE_IN_FLIGHT", 2 * self.max_workers)))
+        if use_processes is None:
+            use_processes = os.environ.get("OCR_PAGE_EXECUTOR", "thread") == "process"
+        self.use_processes = use_processes
+
+    def _make_pool(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ocr-page")
+
+    def map(self, fn: Callable[[Any], Any], pages: Iterable[Tuple[int, Any]]) -> Iterator[PageResult]:
+        with self._make_pool() as pool:
+            pending = deque()
+            for page_num, payload in pages:
+                pending.append((page_num, pool.submit(fn, payload)))
+                if len(pending) >= self.max_in_flight:
+                    yield self._collect(*pending.popleft())
+            while pending:
+                yield self._collect(*pending.popleft())
+
+    @staticmethod
+    def _collect(page_num, future) -> PageResult:
+        try:
+            return PageResult(page_num, future.result(), None)
+        except Exception as e:
+            logger.warning("Page %s failed: %s", page_num, e)
+            return PageResult(page_num, None, e)
@@ -1,47 +1,224 @@
+import io
 import logging
-from typing import List
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 
 from PIL import Image
 import fitz  # PyMuPDF
 
+from services.preprocess import TARGET_TEXT_HEIGHT, estimate_text_height, open_for_ocr, text_scale
+
 logger = logging.getLogger(__name__)
 
+PDFSource = Union[str, "fitz.Document"]
+
+# Share of the page an image must cover to be taken as the page's scan.
+FULL_PAGE_COVERAGE = 0.95
+_ROTATIONS = {90: Image.Transpose.ROTATE_270, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_90}
+
+# Resolution used when a page's text size cannot be measured.
+DEFAULT_RENDER_DPI = 300
+MIN_RENDER_DPI = 100
+MAX_RENDER_DPI = 400
+# Resolution of the preview a rendered page's text size is measured on.
+PROBE_DPI = 72
+
+
+@dataclass
+class PDFLayout:
+    """Result of a single pass over a PDF's text layer.
+
+    `kind` is "text" when every page has selectable text, "scanned" when none
+    does and "mixed" otherwise. `page_kinds` classifies each page the same way
+    ("mixed" being a text page that also carries images) and `page_texts`
+    holds the extracted text per page (None for pages that need OCR).
+    """
+    kind: str
+    page_kinds: List[str]
+    page_texts: List[Optional[str]]
+
+    @property
+    def scanned_pages(self) -> List[int]:
+        """0-based indices of pages without a text layer."""
+        return [i for i, t in enumerate(self.page_texts) if t is None]
+
 
 class PDFService:
-    def __init__(self, render_dpi: int = 300):
+    """PDF analysis and page rasterization.
+
+    By default the resolution adapts per page: text size is measured on a
+    72 DPI preview and the page is rendered at the DPI (within 100-400) that
+    puts its text at `preprocess.TARGET_TEXT_HEIGHT`. Passing `render_dpi`
+    (or setting PDF_RENDER_DPI) fixes the resolution instead.
+
+    With `extract_images` (env PDF_EXTRACT_IMAGES, on by default) a page that
+    is nothing but one upright full-page image is decoded straight from the
+    image stream instead of being rendered, so a 200 DPI scan is neither
+    re-rasterized nor upscaled; it is only downscaled, when its text is larger
+    than needed or its resolution is above a fixed `render_dpi`. Pages with
+    text, vector drawings, several images, masks or skewed placements are
+    rendered.
+    """
+
+    def __init__(self, render_dpi: int = None, extract_images: bool = None):
+        if render_dpi is None and os.environ.get("PDF_RENDER_DPI"):
+            render_dpi = int(os.environ["PDF_RENDER_DPI"])
         self.render_dpi = render_dpi
+        if extract_images is None:
+            extract_images = os.environ.get("PDF_EXTRACT_IMAGES", "1") not in ("0", "false", "no")
+        self.extract_images = extract_images
+
+    def open_document(self, pdf_path: str) -> "fitz.Document":
+        """Open a PDF once so a job can reuse the handle for counting, analysis and rendering."""
+        return fitz.open(pdf_path)
+
+    def open_bytes(self, data: bytes) -> "fitz.Document":
+        """Open a PDF held in memory (e.g. fetched from a shared input store)."""
+        return fitz.open(stream=data, filetype="pdf")
+
+    @contextmanager
+    def _document(self, source: PDFSource):
+        # Accept either a path or an already-open document; only close what we opened.
+        if isinstance(source, fitz.Document):
+            yield source
+            return
+        doc = fitz.open(source)
+        try:
+            yield doc
+        finally:
+            doc.close()
+
+    def page_count(self, source: PDFSource) -> int:
+        with self._document(source) as doc:
+            return doc.page_count
+
+    def analyze(self, source: PDFSource) -> PDFLayout:
+        """Classify the document and extract its text layer in one pass."""
+        with self._document(source) as doc:
+            page_kinds = []
+            page_texts = []
+            for page in doc:
+                text = page.get_text("text")
+                if text and text.strip():
+                    page_kinds.append("mixed" if page.get_images() else "text")
+                    page_texts.append(text)
+                else:
+                    page_kinds.append("scanned")
+                    page_texts.append(None)
+        with_text = sum(1 for t in page_texts if t is not None)
+        if page_texts and with_text == len(page_texts):
+            kind = "text"
+        elif with_text == 0:
+            kind = "scanned"
+        else:
+            kind = "mixed"
+        return PDFLayout(kind=kind, page_kinds=page_kinds, page_texts=page_texts)
 
-    def has_text_layer(self, pdf_path: str) -> bool:
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            text = page.get_text("text")
-            if text and text.strip():
-                return True
-        return False
-
-    def extract_text_layer(self, pdf_path: str) -> str:
-        doc = fitz.open(pdf_path)
-        texts = []
-        for i, page in enumerate(doc, start=1):
-            txt = page.get_text("text")
-            texts.append(f"--- Page {i} ---\n" + txt)
-        return "\n".join(texts)
-
-    def render_page(self, pdf_path: str, page_number: int) -> Image.Image:
-        doc = fitz.open(pdf_path)
-        page = doc[page_number]
-        zoom = self.render_dpi / 72
+    def has_text_layer(self, source: PDFSource) -> bool:
+        return self.analyze(source).kind != "scanned"
+
+    def extract_text_layer(self, source: PDFSource) -> str:
+        layout = self.analyze(source)
+        return "\n".join(f"--- Page {i} ---\n" + (t or "") for i, t in enumerate(layout.page_texts, start=1))
+
+    def _embedded_image(self, page: "fitz.Page") -> Optional[Image.Image]:
+        """Decode the page's single full-page image, or None if the page has to be rendered."""
+        images = page.get_images(full=True)
+        if len(images) != 1:
+            return None
+        placements = page.get_image_info(xrefs=True)
+        if len(placements) != 1:
+            return None
+        info = placements[0]
+        a, b, c, d, _, _ = info["transform"]
+        if b or c or a <= 0 or d <= 0 or info["has-mask"]:
+            return None
+        # image placements are reported in unrotated page coordinates
+        area = page.rect * page.derotation_matrix
+        bbox = fitz.Rect(info["bbox"]) & area
+        if bbox.is_empty or bbox.get_area() < FULL_PAGE_COVERAGE * area.get_area():
+            return None
+        if page.get_text("text").strip() or page.get_drawings():
+            return None
+
+        native_dpi = info["width"] * 72.0 / bbox.width
+        img = self._decode_image(page.parent, info["xref"], images[0][8], native_dpi)
+        if page.rotation in _ROTATIONS:
+            img = img.transpose(_ROTATIONS[page.rotation])
+        return img
+
+    def _decode_image(self, doc: "fitz.Document", xref: int, filter_name: str, native_dpi: float) -> Image.Image:
+        fixed_scale = min(1.0, self.render_dpi / native_dpi) if self.render_dpi else None
+        if filter_name == "DCTDecode":
+            # Baseline JPEG scans decode fastest (and at reduced scale) through
+            # libjpeg; CMYK, often Adobe-inverted, goes through MuPDF instead.
+            data = doc.xref_stream_raw(xref)
+            img = Image.open(io.BytesIO(data))
+            if img.mode in ("L", "RGB"):
+                if fixed_scale is None:
+                    return open_for_ocr(data, max_scale=1.0, exif_transpose=False)
+                size = (max(1, round(img.width * fixed_scale)), max(1, round(img.height * fixed_scale)))
+                img.draft(img.mode, size)
+                return _resized(img, size)
+        pix = fitz.Pixmap(doc, xref)
+        if pix.alpha or pix.colorspace is None or pix.colorspace.n not in (1, 3):
+            pix = fitz.Pixmap(fitz.csRGB, pix, 0)
+        mode = "L" if pix.n == 1 else "RGB"
+        img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+        scale = fixed_scale if fixed_scale is not None else text_scale(estimate_text_height(img), max_scale=1.0)
+        return _resized(img, (max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+
+    def page_dpi(self, page: "fitz.Page") -> float:
+        """Render resolution for `page`: the fixed `render_dpi`, or one fitted to its text size."""
+        if self.render_dpi:
+            return self.render_dpi
+        pix = page.get_pixmap(matrix=fitz.Matrix(PROBE_DPI / 72, PROBE_DPI / 72), colorspace=fitz.csGRAY,
+                              alpha=False)
+        height = estimate_text_height(Image.frombytes("L", [pix.width, pix.height], pix.samples))
+        if height is None:
+            return DEFAULT_RENDER_DPI
+        return min(max(PROBE_DPI * TARGET_TEXT_HEIGHT / height, MIN_RENDER_DPI), MAX_RENDER_DPI)
+
+    def _render(self, page: "fitz.Page") -> Image.Image:
+        if self.extract_images:
+            try:
+                img = self._embedded_image(page)
+            except Exception as e:
+                logger.debug("Falling back to rendering page %s: %s", page.number + 1, e)
+                img = None
+            if img is not None:
+                return img
+        zoom = self.page_dpi(page) / 72
         mat = fitz.Matrix(zoom, zoom)
         pix = page.get_pixmap(matrix=mat, alpha=False)
         mode = "RGB" if pix.n < 4 else "RGBA"
-        img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-        return img
+        return Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+
+    def render_page(self, source: PDFSource, page_number: int) -> Image.Image:
+        with self._document(source) as doc:
+            return self._render(doc[page_number])
+
+    def render_pages(self, source: PDFSource, page_numbers: Iterable[int]) -> Iterator[Tuple[int, Image.Image]]:
+        """Lazily render the given 0-based pages, yielding (1-based page number, image)."""
+        with self._document(source) as doc:
+            for i in page_numbers:
+                yield i + 1, self._render(doc[i])
 
-    def render_all_pages(self, pdf_path: str, callback=None):
-        doc = fitz.open(pdf_path)
-        for i, page in enumerate(doc):
-            img = self.render_page(pdf_path, i)
-            if callback:
-                callback(i + 1, len(doc), img)
-            else:
-                yield i + 1, img
+    def render_all_pages(self, source: PDFSource, callback=None):
+        with self._document(source) as doc:
+            total = doc.page_count
+            for i in range(total):
+                img = self._render(doc[i])
+                if callback:
+                    callback(i + 1, total, img)
+                else:
+                    yield i + 1, img
+
+
+def _resized(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    if img.size == size:
+        img.load()
+        return img
+    return img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
@@ -1,6 +1,42 @@
+import io
+from typing import List, Optional, Sequence, Tuple, Union
+
 import cv2
 import numpy as np
-from PIL import Image, ExifTags
+from PIL import Image, ExifTags, ImageOps
+
+# Bump whenever preprocessing changes OCR output; it is part of the cache key.
+PREPROCESS_VERSION = 4
+
+# Median glyph height (px) Tesseract is fed at, about the x-height of 10pt text at 300 DPI.
+TARGET_TEXT_HEIGHT = 24
+# Text size is measured on a thumbnail with at most this many pixels per side.
+THUMB_SIDE = 2048
+# Bounds on the resampling factor chosen for an image (1/8 is the smallest JPEG draft scale).
+MIN_TEXT_SCALE = 1 / 8
+MAX_TEXT_SCALE = 2.0
+# Scales this close to 1 are not worth a resampling pass.
+SCALE_TOLERANCE = 0.15
+
+# Text regions are detected on a copy of the page with at most this many pixels per side.
+REGION_SIDE = 1024
+# Otsu's classes must have means this many pooled standard deviations apart to be
+# ink and paper; splitting one noisy paper tone in two gives about 1.9.
+MIN_INK_SEPARATION = 2.5
+# Otherwise ink is what is darker than the paper by this many noise deviations,
+# and by at least MIN_INK_CONTRAST grey levels.
+NOISE_SIGMAS = 5.0
+MIN_INK_CONTRAST = 16
+# Pages with less ink than this share of their area are blank.
+BLANK_INK_RATIO = 0.0001
+# Pages with ink but fewer glyph-sized components (lettering too large to tell
+# from a picture, a photographed sign) are recognised as a whole.
+MIN_PAGE_GLYPHS = 3
+# Crop to separate blocks only while they are few and small; otherwise one box around all text.
+MAX_REGIONS = 8
+MAX_REGION_COVERAGE = 0.6
+
+Box = Tuple[int, int, int, int]   # x, y, width, height
 
 
 def pil_to_cv(image: Image.Image) -> np.ndarray:
@@ -32,26 +68,151 @@ def auto_rotate(image: Image.Image) -> Image.Image:
     return image
 
 
+def to_gray(image) -> np.ndarray:
+    """Return a single-channel uint8 array, converting colour only once."""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    if image.mode != "L":
+        image = image.convert("L")
+    return np.asarray(image)
+
+
+def estimate_text_height(image, max_side: int = THUMB_SIDE, min_glyphs: int = 10) -> Optional[float]:
+    """Median height, in pixels of `image`, of glyph-sized ink blobs; None if no text is measurable.
+
+    Runs Otsu plus connected components on a copy downscaled to `max_side`.
+    Blobs under 3 px in the thumbnail are noise (or text too small to measure
+    there), blobs taller than a tenth of the page or wider than half of it are
+    rules, frames and pictures.
+    """
+    gray = to_gray(image)
+    h, w = gray.shape[:2]
+    factor = min(1.0, max_side / float(max(h, w)))
+    if factor < 1.0:
+        gray = cv2.resize(gray, (max(1, int(w * factor)), max(1, int(h * factor))), interpolation=cv2.INTER_AREA)
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    glyphs = heights[(heights >= 3) & (heights <= gray.shape[0] // 10) & (widths <= gray.shape[1] // 2)]
+    if len(glyphs) < min_glyphs:
+        return None
+    return float(np.median(glyphs)) / factor
+
+
+def text_scale(text_height: Optional[float], max_scale: float = MAX_TEXT_SCALE) -> float:
+    """Resampling factor that brings text of `text_height` px to TARGET_TEXT_HEIGHT."""
+    if not text_height:
+        return 1.0
+    scale = min(max(TARGET_TEXT_HEIGHT / text_height, MIN_TEXT_SCALE), max_scale)
+    return 1.0 if abs(scale - 1.0) < SCALE_TOLERANCE else scale
+
+
+def open_for_ocr(source: Union[str, bytes], max_scale: float = MAX_TEXT_SCALE,
+                 exif_transpose: bool = True) -> Image.Image:
+    """Decode an image file (path or bytes) as grayscale, sized so its text is at TARGET_TEXT_HEIGHT.
+
+    Text height is measured on a thumbnail, which for JPEGs comes straight
+    from a reduced (draft mode) decode; the full image is then decoded at the
+    nearest JPEG draft scale above the target and resized the rest of the
+    way, so a 48 MP phone photo is never decoded at full size.
+    """
+    def _open():
+        return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    image = _open()
+    size = image.size
+    drafted = image.draft("L", (THUMB_SIDE, THUMB_SIDE))
+    height = estimate_text_height(image)
+    if height is not None:
+        height *= size[0] / float(image.size[0])
+    scale = text_scale(height, max_scale)
+    target = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    if drafted and image.size != size:
+        # the probe was decoded at thumbnail scale; decode again nearer the target
+        image.close()
+        image = _open()
+        image.draft("L", target)
+    gray = to_gray(image)
+    if gray.shape[::-1] != target:
+        # INTER_AREA only pays off for large reductions; after a draft decode
+        # the remaining factor is at most 2 and bilinear is several times faster.
+        if gray.shape[1] > 2 * target[0]:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR if scale < 1 else cv2.INTER_CUBIC
+        gray = cv2.resize(gray, target, interpolation=interpolation)
+    out = Image.fromarray(gray)
+    if exif_transpose:
+        out.info["exif"] = image.info.get("exif", b"")
+        out = ImageOps.exif_transpose(out)
+    return out
+
+
+def _profile_sharpness(xs: np.ndarray, ys: np.ndarray, angle: float) -> float:
+    # Project points onto the axis perpendicular to text lines tilted by `angle`;
+    # aligned lines give a peaky row histogram, i.e. a large sum of squares.
+    t = np.deg2rad(angle)
+    proj = ys * np.cos(t) + xs * np.sin(t)
+    proj -= proj.min()
+    hist = np.bincount(proj.astype(np.int32))
+    return float(np.dot(hist, hist))
+
+
+def estimate_skew(ink: np.ndarray, max_side: int = 1024, max_points: int = 20000,
+                  max_angle: float = 45.0) -> float:
+    """Angle (degrees) that straightens the ink mask.
+
+    Works on a downscaled copy and a strided sample of at most `max_points` ink
+    pixels, scoring projection profiles with a coarse 1-degree search refined
+    to 0.1 degree.
+    """
+    h, w = ink.shape[:2]
+    scale = min(1.0, max_side / float(max(h, w)))
+    if scale < 1.0:
+        ink = cv2.resize(ink, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    pts = cv2.findNonZero(ink)
+    if pts is None:
+        return 0.0
+    pts = pts.reshape(-1, 2)
+    if len(pts) > max_points:
+        pts = pts[::len(pts) // max_points + 1]
+    # Sub-pixel jitter stops lattice points from aliasing into spiky profiles
+    # at diagonal angles.
+    jitter = np.random.default_rng(0).random(pts.shape, dtype=np.float32)
+    xs = pts[:, 0] + jitter[:, 0]
+    ys = pts[:, 1] + jitter[:, 1]
+
+    best = 0.0
+    for step, span in ((1.0, max_angle), (0.1, 1.0)):
+        candidates = np.arange(best - span, best + span + step / 2, step)
+        best = float(max(candidates, key=lambda a: _profile_sharpness(xs, ys, a)))
+    return -round(best, 1)
+
+
+# Pages skewed less than this are left untouched; warping costs more than it helps.
+MIN_DESKEW_ANGLE = 0.3
+
+
+def _rotate(img: np.ndarray, angle: float) -> np.ndarray:
+    (h, w) = img.shape[:2]
+    center = (w // 2, h // 2)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
 def deskew(image: Image.Image) -> Image.Image:
     cv = pil_to_cv(image)
     gray = cv2.cvtColor(cv, cv2.COLOR_BGR2GRAY)
     gray = cv2.bitwise_not(gray)
     thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
 
-    coords = np.column_stack(np.where(thresh > 0))
-    if coords.size == 0:
+    angle = estimate_skew(thresh)
+    if abs(angle) < MIN_DESKEW_ANGLE:
         return image
-    angle = cv2.minAreaRect(coords)[-1]
-    if angle < -45:
-        angle = -(90 + angle)
-    else:
-        angle = -angle
-
-    (h, w) = cv.shape[:2]
-    center = (w // 2, h // 2)
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    rotated = cv2.warpAffine(cv, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-    return cv_to_pil(rotated)
+    return cv_to_pil(_rotate(cv, angle))
 
 
 def binarize(image: Image.Image) -> Image.Image:
@@ -59,3 +220,205 @@ def binarize(image: Image.Image) -> Image.Image:
     gray = cv2.cvtColor(cv, cv2.COLOR_BGR2GRAY)
     _, th = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
     return cv_to_pil(cv2.cvtColor(th, cv2.COLOR_GRAY2BGR))
+
+
+def _splits_ink(hist: np.ndarray, level: int) -> bool:
+    # True if Otsu's split of the histogram at `level` separates two tones rather than one tone's noise.
+    tones = np.arange(256, dtype=np.float64)
+    ink, paper = hist[:level + 1], hist[level + 1:]
+    if not ink.sum() or not paper.sum():
+        return True   # a single grey level: nothing to re-threshold
+    m0 = (ink * tones[:level + 1]).sum() / ink.sum()
+    m1 = (paper * tones[level + 1:]).sum() / paper.sum()
+    v0 = (ink * (tones[:level + 1] - m0) ** 2).sum() / ink.sum()
+    v1 = (paper * (tones[level + 1:] - m1) ** 2).sum() / paper.sum()
+    return m1 - m0 >= MIN_INK_SEPARATION * np.sqrt(v0 + v1)
+
+
+def _sparse_ink_level(hist: np.ndarray) -> float:
+    # Threshold for pages with little or no ink: below the paper tone and its noise,
+    # and no higher than halfway to the ink found there, so strokes are not fattened.
+    tones = np.arange(256)
+    cdf = np.cumsum(hist)
+    paper = int(np.searchsorted(cdf, cdf[-1] / 2))
+    spread = np.bincount(np.abs(tones - paper), weights=hist, minlength=256)
+    mad = int(np.searchsorted(np.cumsum(spread), cdf[-1] / 2))
+    level = paper - max(MIN_INK_CONTRAST, NOISE_SIGMAS * 1.4826 * mad)
+    ink = hist[:max(0, int(level)) + 1]
+    if ink.sum():
+        level = min(level, (paper + (ink * tones[:len(ink)]).sum() / ink.sum()) / 2)
+    return level
+
+
+def preprocess_for_ocr(image) -> np.ndarray:
+    """Fused auto_rotate -> deskew -> binarize on a single grayscale array.
+
+    The image is converted to grayscale once, Otsu's threshold is computed once
+    and shared between skew estimation and binarization, and the result is a
+    2-D uint8 array (black text on white) that Tesseract accepts directly.
+    When Otsu's two classes are not distinct tones (a blank or nearly blank
+    page, where it splits the paper's own noise), only pixels darker than the
+    paper by several times its noise are ink. Faint but real ink, such as a
+    faded page, still forms its own class and keeps Otsu's threshold.
+    """
+    if isinstance(image, Image.Image):
+        image = auto_rotate(image)
+    gray = to_gray(image)
+    level, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    if not _splits_ink(hist, int(level)):
+        level, binary = cv2.threshold(gray, _sparse_ink_level(hist), 255, cv2.THRESH_BINARY)
+    ink = cv2.bitwise_not(binary)
+    if not ink.any():
+        return binary
+
+    angle = estimate_skew(ink)
+    if abs(angle) < MIN_DESKEW_ANGLE:
+        return binary
+    # Rotate the grayscale page and re-apply the same threshold level rather than
+    # warping the binary mask, which would leave jagged stroke edges.
+    rotated = _rotate(gray, angle)
+    cv2.threshold(rotated, level, 255, cv2.THRESH_BINARY, dst=rotated)
+    return rotated
+
+
+def _split(boxes: Sequence[Box], axis: int) -> List[List[Box]]:
+    # Group boxes whose extents along `axis` (0: x, 1: y) overlap; groups are separated by whitespace.
+    boxes = sorted(boxes, key=lambda b: b[axis])
+    groups = [[boxes[0]]]
+    end = boxes[0][axis] + boxes[0][axis + 2]
+    for box in boxes[1:]:
+        box_end = box[axis] + box[axis + 2]
+        if box[axis] >= end:
+            groups.append([box])
+            end = box_end
+        else:
+            groups[-1].append(box)
+            end = max(end, box_end)
+    return groups
+
+
+def _merge_overlapping(boxes: List[Box]) -> List[Box]:
+    # Union boxes that intersect (padding can make neighbouring blocks touch) until none do.
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                ax, ay, aw, ah = boxes[i]
+                bx, by, bw, bh = boxes[j]
+                if ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah:
+                    x0, y0 = min(ax, bx), min(ay, by)
+                    x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+                    boxes[i] = (x0, y0, x1 - x0, y1 - y0)
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def reading_order(boxes: Sequence[Box], axis: int = 1) -> List[Box]:
+    """Order boxes by recursive XY-cut: bands top to bottom, columns left to right within a band."""
+    if len(boxes) <= 1:
+        return list(boxes)
+    for ax in (axis, 1 - axis):
+        groups = _split(boxes, ax)
+        if len(groups) > 1:
+            return [box for group in groups for box in reading_order(group, 1 - ax)]
+    return sorted(boxes, key=lambda b: (b[1], b[0]))
+
+
+def detect_text_regions(binary: np.ndarray, max_side: int = REGION_SIDE) -> List[Box]:
+    """Boxes of the text blocks on a binarized page (black text on white), in reading order.
+
+    Works on a copy downscaled to `max_side`: an almost inkless page is blank
+    straight away; otherwise glyph-sized connected components are kept
+    (specks, rules, frames and pictures are dropped), smeared into blocks by a
+    kernel sized to the median glyph height and ordered by XY-cut. Returns []
+    only for a blank page; a page with ink but too few glyph-sized components
+    is one full-page region.
+    """
+    h, w = binary.shape[:2]
+    factor = min(1.0, max_side / float(max(h, w)))
+    ink = cv2.bitwise_not(binary)
+    if factor < 1.0:
+        ink = cv2.resize(ink, (max(1, int(w * factor)), max(1, int(h * factor))), interpolation=cv2.INTER_AREA)
+    # Area averaging fades isolated specks below the threshold while strokes survive.
+    _, ink = cv2.threshold(ink, 63, 255, cv2.THRESH_BINARY)
+    sh, sw = ink.shape
+    if cv2.countNonZero(ink) < BLANK_INK_RATIO * sh * sw:
+        return []
+
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    areas = stats[:, cv2.CC_STAT_AREA]
+    keep = (heights >= 2) & (heights <= sh // 8) & (widths <= sw // 4) & (areas >= 3)
+    keep[0] = False
+    # Large, solid components are pictures; the specks around and inside them are not text.
+    # (Frames and table rules are large too, but sparse.)
+    large = (heights > sh // 8) | (widths > sw // 4)
+    large[0] = False
+    left, top = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    for px, py, pw, ph, parea in stats[large]:
+        if parea >= 0.25 * pw * ph:
+            keep &= ~((left >= px) & (top >= py) & (left + widths <= px + pw) & (top + heights <= py + ph))
+    if keep.sum() < MIN_PAGE_GLYPHS:
+        return [(0, 0, w, h)]
+
+    glyph = int(np.median(heights[keep]))
+    mask = keep[labels].astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * glyph + 1, glyph + 1))
+    nblocks, blocks = cv2.connectedComponents(cv2.dilate(mask, kernel), connectivity=8)
+
+    # Bounding box of the glyph pixels (not the dilated blob) of each block.
+    ys, xs = np.nonzero(mask)
+    ids = blocks[ys, xs]
+    x0 = np.full(nblocks, sw)
+    y0 = np.full(nblocks, sh)
+    x1 = np.zeros(nblocks, dtype=np.int64)
+    y1 = np.zeros(nblocks, dtype=np.int64)
+    np.minimum.at(x0, ids, xs)
+    np.minimum.at(y0, ids, ys)
+    np.maximum.at(x1, ids, xs + 1)
+    np.maximum.at(y1, ids, ys + 1)
+
+    pad = max(1, glyph // 2)
+    boxes = []
+    for bx0, by0, bx1, by1 in zip(x0[1:], y0[1:], x1[1:], y1[1:]):
+        if bx1 <= bx0:
+            continue
+        left = int(max(0, bx0 - pad) / factor)
+        top = int(max(0, by0 - pad) / factor)
+        right = min(w, int(np.ceil(min(sw, bx1 + pad) / factor)))
+        bottom = min(h, int(np.ceil(min(sh, by1 + pad) / factor)))
+        boxes.append((left, top, right - left, bottom - top))
+    return reading_order(_merge_overlapping(boxes))
+
+
+def recognition_regions(binary: np.ndarray) -> List[Box]:
+    """Regions to run OCR on, in reading order; [] means the page is blank and can be skipped.
+
+    A few small text blocks (a label, a paragraph in a wide margin) are
+    recognised separately; many or large blocks become one box around all
+    text, which still trims empty margins.
+    """
+    boxes = detect_text_regions(binary)
+    if not boxes:
+        return []
+    h, w = binary.shape[:2]
+    if len(boxes) <= MAX_REGIONS and sum(bw * bh for _, _, bw, bh in boxes) <= MAX_REGION_COVERAGE * w * h:
+        return boxes
+    x0 = min(b[0] for b in boxes)
+    y0 = min(b[1] for b in boxes)
+    x1 = max(b[0] + b[2] for b in boxes)
+    y1 = max(b[1] + b[3] for b in boxes)
+    return [(x0, y0, x1 - x0, y1 - y0)]
+
+
+def crop(image: np.ndarray, box: Box) -> np.ndarray:
+    x, y, w, h = box
+    return np.ascontiguousarray(image[y:y + h, x:x + w])
@@ -1,27 +1,94 @@
 import logging
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 from PIL import Image
 import pytesseract
 
+from utils.langdet import tesseract_langs
+
 logger = logging.getLogger(__name__)
 
 
+def _parse_conf(value) -> float:
+    """Tesseract reports confidences as ints, floats or strings depending on the pytesseract version."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return -1.0
+
+
+def text_from_data(data: Dict[str, list]) -> str:
+    """Rebuild plain text from `image_to_data` output.
+
+    Words are joined by spaces within a line, lines by newlines and
+    paragraphs/blocks by a blank line, mirroring `image_to_string`.
+    """
+    blocks = []
+    current_par = None
+    current_line = None
+    lines = []
+    words = []
+    for i, word in enumerate(data.get("text", [])):
+        if data["level"][i] != 5:
+            continue
+        word = str(word).strip()
+        if not word:
+            continue
+        par = (data["page_num"][i], data["block_num"][i], data["par_num"][i])
+        line = par + (data["line_num"][i],)
+        if line != current_line and words:
+            lines.append(" ".join(words))
+            words = []
+        if par != current_par and lines:
+            blocks.append("\n".join(lines))
+            lines = []
+        current_par, current_line = par, line
+        words.append(word)
+    if words:
+        lines.append(" ".join(words))
+    if lines:
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def words_from_data(data: Dict[str, list]) -> List[dict]:
+    """Return recognised words with their confidence and (left, top, width, height) box."""
+    words = []
+    for i, word in enumerate(data.get("text", [])):
+        word = str(word).strip()
+        conf = _parse_conf(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        box = (data["left"][i], data["top"][i], data["width"][i], data["height"][i])
+        words.append({"text": word, "conf": conf, "box": box})
+    return words
+
+
 class TesseractAdapter:
     def __init__(self, tesseract_cmd: str = None, tessdata_dir: str = None):
         if tesseract_cmd:
             pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
         self.tessdata_dir = tessdata_dir
 
-    def ocr(self, image: Image.Image, langs: List[str] = None) -> Tuple[str, float]:
-        """Run Tesseract OCR and return (text, avg_confidence)"""
-        lang = "+".join(langs) if langs else "eng"
-        config = f"-l {lang} --oem 1 --psm 3"
-        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
-        text = pytesseract.image_to_string(image, config=config)
-
-        # compute average confidence from data['conf'] (strings, -1 ignored)
-        confs = [int(c) for c in data.get("conf", []) if c and c.isdigit() and int(c) >= 0]
-        avg_conf = float(sum(confs)) / len(confs) if confs else 0.0
+    def _config(self, langs: List[str] = None, psm: int = 3, oem: int = 1) -> Tuple[str, str]:
+        lang = "+".join(tesseract_langs(langs)) or "eng"
+        return lang, f"--oem {oem} --psm {psm}"
+
+    def ocr_detailed(self, image: Image.Image, langs: List[str] = None, psm: int = 3,
+                     oem: int = 1) -> Tuple[str, float, List[dict]]:
+        """Run a single Tesseract pass and return (text, avg_confidence, words).
+
+        Text is rebuilt from the TSV output so recognition only happens once.
+        """
+        lang, config = self._config(langs, psm=psm, oem=oem)
+        data = pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+        words = words_from_data(data)
+        text = text_from_data(data)
+        avg_conf = float(sum(w["conf"] for w in words)) / len(words) if words else 0.0
         logger.debug("Tesseract OCR done, avg_conf=%s", avg_conf)
+        return text, avg_conf, words
+
+    def ocr(self, image: Image.Image, langs: List[str] = None, psm: int = 3, oem: int = 1) -> Tuple[str, float]:
+        """Run Tesseract OCR and return (text, avg_confidence)"""
+        text, avg_conf, _ = self.ocr_detailed(image, langs=langs, psm=psm, oem=oem)
         return text, avg_conf
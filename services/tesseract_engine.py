@@ -0,0 +1,123 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.page_executor import default_workers
+from utils.langdet import tesseract_langs
+
+logger = logging.getLogger(__name__)
+
+
+class TesseractEngine:
+    """In-process Tesseract backed by tesserocr (libtesseract).
+
+    Initialised `PyTessBaseAPI`s are kept in a process-wide pool keyed by
+    (languages, psm, oem): a call checks one out, or creates it if none is
+    idle, and returns it afterwards, so traineddata is loaded once per
+    process rather than once per page thread or document. At most `max_idle`
+    (env TESSERACT_POOL_SIZE, default `OCR_PAGE_WORKERS`) idle APIs are kept;
+    beyond that the least recently used language set's are ended. APIs only
+    survive across jobs in a worker process that runs them itself, e.g.
+    `rq worker --worker-class rq.SimpleWorker`. Exposes the same
+    `ocr(image, langs) -> (text, avg_confidence)` contract as `TesseractAdapter`.
+    """
+
+    def __init__(self, tessdata_dir: str = None, max_idle: int = None):
+        try:
+            import tesserocr
+            self._tesserocr = tesserocr
+        except Exception as e:
+            logger.warning("tesserocr not available: %s", e)
+            self._tesserocr = None
+        self.tessdata_dir = tessdata_dir
+        if max_idle is None:
+            max_idle = int(os.environ.get("TESSERACT_POOL_SIZE", default_workers()))
+        self.max_idle = max(1, max_idle)
+        self._lock = threading.Lock()
+        # (lang, psm, oem) -> idle APIs, least recently returned key first
+        self._idle: "OrderedDict[tuple, List[object]]" = OrderedDict()
+
+    @property
+    def available(self) -> bool:
+        return self._tesserocr is not None
+
+    def _checkout(self, key: tuple):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        lang, psm, oem = key
+        kwargs = {"lang": lang, "psm": psm, "oem": oem}
+        if self.tessdata_dir:
+            kwargs["path"] = self.tessdata_dir
+        logger.debug("Initialising tesseract engine lang=%s psm=%s oem=%s", lang, psm, oem)
+        return self._tesserocr.PyTessBaseAPI(**kwargs)
+
+    def _return(self, key: tuple, api):
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(key, []).append(api)
+            self._idle.move_to_end(key)
+            while sum(len(apis) for apis in self._idle.values()) > self.max_idle:
+                oldest, apis = next(iter(self._idle.items()))
+                evicted.append(apis.pop(0))
+                if not apis:
+                    del self._idle[oldest]
+        _end(evicted)
+
+    def idle_count(self) -> int:
+        with self._lock:
+            return sum(len(apis) for apis in self._idle.values())
+
+    def ocr(self, image: Image.Image, langs: List[str] = None, psm: int = 3, oem: int = 1) -> Tuple[str, float]:
+        """Run Tesseract OCR in-process and return (text, avg_confidence)"""
+        if not self.available:
+            raise RuntimeError("tesserocr is not installed")
+        key = ("+".join(tesseract_langs(langs)) or "eng", psm, oem)
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        api = self._checkout(key)
+        try:
+            api.SetImage(image)
+            text = api.GetUTF8Text()
+            confs = [c for c in api.AllWordConfidences() if c >= 0]
+            api.Clear()
+        except Exception:
+            # an API that failed mid-page is not trusted with the next one
+            _end([api])
+            raise
+        self._return(key, api)
+        avg_conf = float(sum(confs)) / len(confs) if confs else 0.0
+        logger.debug("Tesseract engine OCR done, avg_conf=%s", avg_conf)
+        return text, avg_conf
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+        _end([api for apis in idle.values() for api in apis])
+
+
+def _end(apis):
+    for api in apis:
+        try:
+            api.End()
+        except Exception:
+            pass
+
+
+_shared_engine = None
+_shared_lock = threading.Lock()
+
+
+def shared_engine() -> TesseractEngine:
+    """Return the process-wide engine pool so jobs reuse initialised APIs."""
+    global _shared_engine
+    with _shared_lock:
+        if _shared_engine is None:
+            _shared_engine = TesseractEngine(tessdata_dir=os.environ.get("TESSDATA_PREFIX"))
+        return _shared_engine
@@ -1,44 +1,166 @@
-import hashlib
+import asyncio
 import logging
-import pickle
-from typing import Any
+import threading
+import time
+from typing import Any, Dict
 
-import redis
+from storage import codec
+from storage.redis_pool import get_async_redis, get_redis
 
 logger = logging.getLogger(__name__)
 
+# Bump when the key layout or the value encoding changes; old entries simply miss.
+CACHE_SCHEMA_VERSION = 1
+STATS_KEY = "tgocr:cache:stats"
+STATS_FLUSH_INTERVAL = 5.0
+
+
+def cache_key(file_hash: str, opts: dict = None) -> str:
+    """Versioned cache key: schema, file hash, engine, languages and preprocessing version."""
+    from services.preprocess import PREPROCESS_VERSION
+
+    opts = opts or {}
+    engine = "cloud" if opts.get("cloud_ocr") else "tesseract"
+    langs = "+".join(sorted(opts.get("langs") or [])) or "default"
+    return f"v{CACHE_SCHEMA_VERSION}:{file_hash}:{engine}:{langs}:pp{PREPROCESS_VERSION}"
+
+
+def key_file_hash(key: str) -> str:
+    """The file hash a `cache_key` was built from."""
+    return key.split(":")[1]
+
 
 class Cache:
-    def __init__(self, redis_url: str = "redis://localhost:6379/0", conn=None):
+    def __init__(self, redis_url: str = None, conn=None):
         """Cache wrapper around a redis connection.
 
         Parameters
-        - redis_url: URL used to create a redis client if `conn` is not provided
+        - redis_url: URL of the shared connection pool used if `conn` is not provided
+          (REDIS_URL by default)
         - conn: optional redis connection instance (useful for tests)
+
+        Values are JSON, compressed with zstd (or zlib when zstandard is not
+        installed). Hit/miss/byte counters are kept locally and flushed to the
+        `tgocr:cache:stats` hash every few seconds.
         """
         if conn is not None:
             self.conn = conn
         else:
-            self.conn = redis.from_url(redis_url)
+            self.conn = get_redis(redis_url)
+        self._stats_lock = threading.Lock()
+        self._pending_stats: Dict[str, int] = {}
+        self._last_flush = time.monotonic()
 
     def _key(self, key: str) -> str:
         return f"tgocr:cache:{key}"
 
+    def _count(self, **fields: int):
+        with self._stats_lock:
+            for name, n in fields.items():
+                self._pending_stats[name] = self._pending_stats.get(name, 0) + n
+            if time.monotonic() - self._last_flush < STATS_FLUSH_INTERVAL:
+                return
+            pending, self._pending_stats = self._pending_stats, {}
+            self._last_flush = time.monotonic()
+        self._flush(pending)
+
+    def _flush(self, pending: Dict[str, int]):
+        try:
+            pipe = self.conn.pipeline(transaction=False)
+            for name, n in pending.items():
+                pipe.hincrby(STATS_KEY, name, n)
+            pipe.execute()
+        except Exception as e:
+            logger.debug("Failed to flush cache stats: %s", e)
+
+    def flush_stats(self):
+        with self._stats_lock:
+            pending, self._pending_stats = self._pending_stats, {}
+            self._last_flush = time.monotonic()
+        if pending:
+            self._flush(pending)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters across all processes: hits, misses, bytes_read, bytes_written."""
+        self.flush_stats()
+        raw = self.conn.hgetall(STATS_KEY) or {}
+        return {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
+
     def get(self, key: str):
         val = self.conn.get(self._key(key))
         if val is None:
+            self._count(misses=1)
             return None
         try:
-            return pickle.loads(val)
+            value = codec.loads(val)
         except Exception:
+            # undecodable (e.g. legacy pickle) entries are treated as misses
+            self._count(misses=1)
             return None
+        self._count(hits=1, bytes_read=len(val))
+        return value
 
     def set(self, key: str, value: Any, ttl: int = 3600):
-        val = pickle.dumps(value)
+        val = codec.dumps(value)
         self.conn.set(self._key(key), val, ex=ttl)
+        self._count(bytes_written=len(val))
 
     def exists(self, key: str) -> bool:
         return self.conn.exists(self._key(key)) == 1
 
     def delete(self, key: str):
         self.conn.delete(self._key(key))
+
+
+class AsyncCache(Cache):
+    """asyncio variant of `Cache` for the bot's event loop (redis.asyncio client)."""
+
+    def __init__(self, redis_url: str = None, conn=None):
+        super().__init__(conn=conn if conn is not None else get_async_redis(redis_url))
+        self._flush_tasks = set()
+
+    def _flush(self, pending: Dict[str, int]):
+        task = asyncio.get_running_loop().create_task(self._aflush(pending))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _aflush(self, pending: Dict[str, int]):
+        try:
+            pipe = self.conn.pipeline(transaction=False)
+            for name, n in pending.items():
+                pipe.hincrby(STATS_KEY, name, n)
+            await pipe.execute()
+        except Exception as e:
+            logger.debug("Failed to flush cache stats: %s", e)
+
+    async def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            pending, self._pending_stats = self._pending_stats, {}
+        if pending:
+            await self._aflush(pending)
+        raw = await self.conn.hgetall(STATS_KEY) or {}
+        return {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
+
+    async def get(self, key: str):
+        val = await self.conn.get(self._key(key))
+        if val is None:
+            self._count(misses=1)
+            return None
+        try:
+            value = codec.loads(val)
+        except Exception:
+            self._count(misses=1)
+            return None
+        self._count(hits=1, bytes_read=len(val))
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int = 3600):
+        val = codec.dumps(value)
+        await self.conn.set(self._key(key), val, ex=ttl)
+        self._count(bytes_written=len(val))
+
+    async def exists(self, key: str) -> bool:
+        return await self.conn.exists(self._key(key)) == 1
+
+    async def delete(self, key: str):
+        await self.conn.delete(self._key(key))
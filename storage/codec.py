@@ -0,0 +1,42 @@
+import json
+import zlib
+from typing import Any
+
+try:
+    import zstandard
+except ImportError:  # optional; fall back to zlib
+    zstandard = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compress(data: bytes, level: int = 3) -> bytes:
+    """Compress with zstd when available, else zlib. `decompress` detects either."""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, 6)
+
+
+def compressor(level: int = 3):
+    """Incremental compressor (`compress(chunk)`, `flush()`) producing the same formats as `compress`."""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(6)
+
+
+def decompress(blob: bytes) -> bytes:
+    if blob[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed value but zstandard is not installed")
+        # streamed frames carry no content size, which one-shot decompress() requires
+        return zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+    return zlib.decompress(blob)
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a JSON-compatible value compactly and compress it."""
+    return compress(json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def loads(blob: bytes) -> Any:
+    return json.loads(decompress(blob).decode("utf-8"))
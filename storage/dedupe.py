@@ -0,0 +1,49 @@
+import logging
+from typing import Optional
+
+from storage.redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class UploadIndex:
+    """Maps Telegram's `file_unique_id` (plus size) to the content hash of the upload.
+
+    Lets handlers resolve cache hits for files seen before without downloading them.
+    """
+
+    def __init__(self, conn=None, ttl: int = 24 * 3600):
+        self.conn = conn if conn is not None else get_redis()
+        self.ttl = ttl
+
+    def _key(self, file_unique_id: str, size: Optional[int]) -> str:
+        return f"tgocr:upload:{file_unique_id}:{size or 0}"
+
+    def lookup(self, file_unique_id: str, size: Optional[int]) -> Optional[str]:
+        if not file_unique_id:
+            return None
+        val = self.conn.get(self._key(file_unique_id, size))
+        return val.decode() if isinstance(val, bytes) else val
+
+    def remember(self, file_unique_id: str, size: Optional[int], file_hash: str):
+        if not file_unique_id:
+            return
+        self.conn.set(self._key(file_unique_id, size), file_hash, ex=self.ttl)
+
+
+class AsyncUploadIndex(UploadIndex):
+    """asyncio variant of `UploadIndex` (redis.asyncio client)."""
+
+    def __init__(self, conn=None, ttl: int = 24 * 3600):
+        super().__init__(conn=conn if conn is not None else get_async_redis(), ttl=ttl)
+
+    async def lookup(self, file_unique_id: str, size: Optional[int]) -> Optional[str]:
+        if not file_unique_id:
+            return None
+        val = await self.conn.get(self._key(file_unique_id, size))
+        return val.decode() if isinstance(val, bytes) else val
+
+    async def remember(self, file_unique_id: str, size: Optional[int], file_hash: str):
+        if not file_unique_id:
+            return
+        await self.conn.set(self._key(file_unique_id, size), file_hash, ex=self.ttl)
@@ -1,29 +1,166 @@
 import os
+import threading
 import time
-import redis
+from typing import Dict, NamedTuple
+
+from storage.redis_pool import get_async_redis, get_redis
+
+# Sliding-window log: one sorted-set member per accepted request, scored by time (ms).
+# ARGV: now_ms, window_ms, limit, cost (0 = peek), member
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+if count + cost <= limit then
+  if cost > 0 then
+    redis.call('ZADD', key, now, ARGV[5])
+    redis.call('PEXPIRE', key, window)
+  end
+  return {1, limit - count - cost, 0}
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+local retry = window
+if oldest[2] then
+  retry = tonumber(oldest[2]) + window - now
+end
+return {0, 0, retry}
+"""
+
+# Token bucket refilling `limit` tokens per window, stored as a hash {tokens, ts}.
+# ARGV: now_ms, window_ms, limit, cost (0 = peek)
+TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local rate = capacity / window
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+if tokens < cost then
+  return {0, math.floor(tokens), math.ceil((cost - tokens) / rate)}
+end
+if cost > 0 then
+  tokens = tokens - cost
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+  redis.call('PEXPIRE', key, window)
+end
+return {1, math.floor(tokens), 0}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until the next request would be allowed
 
 
 class RateLimiter:
-    def __init__(self, redis_url: str = None, max_per_minute: int = 15):
-        redis_url = redis_url or os.environ.get("REDIS_URL", "redis://localhost:6379/0")
-        self.conn = redis.from_url(redis_url)
+    """Per-user rate limiter evaluated atomically in Redis with a single script call.
+
+    `mode` is "sliding" (sliding-window log, the default) or "token_bucket"; it
+    can also be set with RATE_LIMIT_MODE. Users denied recently are rejected
+    from an in-process table until their retry-after passes, without a Redis
+    round trip.
+    """
+
+    def __init__(self, redis_url: str = None, max_per_minute: int = 15, conn=None, mode: str = None,
+                 window: float = 60.0):
+        self.conn = conn if conn is not None else get_redis(redis_url)
         self.max_per_minute = max_per_minute
+        self.mode = mode or os.environ.get("RATE_LIMIT_MODE", "sliding")
+        if self.mode not in ("sliding", "token_bucket"):
+            raise ValueError(f"Unknown rate limit mode: {self.mode}")
+        self.window_ms = int(window * 1000)
+        lua = SLIDING_WINDOW_LUA if self.mode == "sliding" else TOKEN_BUCKET_LUA
+        self._script = self.conn.register_script(lua)
+        self._blocked_until: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, user_id: int) -> str:
+        return f"tgocr:rate:{self.mode}:{user_id}"
+
+    def _local_block(self, user_id: int, now: float):
+        with self._lock:
+            until = self._blocked_until.get(user_id)
+            if until is None:
+                return None
+            if until <= now:
+                del self._blocked_until[user_id]
+                return None
+            return until
+
+    def _remember_block(self, user_id: int, until: float):
+        with self._lock:
+            if len(self._blocked_until) > 10000:
+                now = time.time()
+                self._blocked_until = {u: t for u, t in self._blocked_until.items() if t > now}
+            self._blocked_until[user_id] = until
+
+    def _script_args(self, cost: int, now: float) -> list:
+        now_ms = int(now * 1000)
+        args = [now_ms, self.window_ms, self.max_per_minute, cost]
+        if self.mode == "sliding":
+            args.append(f"{now_ms}:{os.urandom(4).hex()}")
+        return args
+
+    @staticmethod
+    def _result(reply) -> RateLimitResult:
+        allowed, remaining, retry_ms = reply
+        return RateLimitResult(bool(allowed), int(remaining), max(0.0, int(retry_ms) / 1000.0))
+
+    def _run(self, user_id: int, cost: int, now: float) -> RateLimitResult:
+        reply = self._script(keys=[self._key(user_id)], args=self._script_args(cost, now))
+        return self._result(reply)
+
+    def check(self, user_id: int) -> RateLimitResult:
+        """Consume one request for `user_id` and report allow/remaining/retry-after."""
+        now = time.time()
+        until = self._local_block(user_id, now)
+        if until is not None:
+            return RateLimitResult(False, 0, until - now)
+        result = self._run(user_id, 1, now)
+        if not result.allowed:
+            self._remember_block(user_id, now + result.retry_after)
+        return result
 
     def allow(self, user_id: int) -> bool:
-        key = f"tgocr:rate:{user_id}:{int(time.time() // 60)}"
-        val = self.conn.incr(key)
-        if val == 1:
-            # set expire for the current minute
-            self.conn.expire(key, 61)
-        return val <= self.max_per_minute
+        return self.check(user_id).allowed
 
     def remaining(self, user_id: int) -> int:
-        key = f"tgocr:rate:{user_id}:{int(time.time() // 60)}"
-        val = self.conn.get(key)
-        if not val:
-            return self.max_per_minute
-        try:
-            used = int(val)
-        except Exception:
-            used = 0
-        return max(0, self.max_per_minute - used)
+        return self._run(user_id, 0, time.time()).remaining
+
+
+class AsyncRateLimiter(RateLimiter):
+    """asyncio variant of `RateLimiter` for the bot's event loop (redis.asyncio client)."""
+
+    def __init__(self, redis_url: str = None, max_per_minute: int = 15, conn=None, mode: str = None,
+                 window: float = 60.0):
+        conn = conn if conn is not None else get_async_redis(redis_url)
+        super().__init__(max_per_minute=max_per_minute, conn=conn, mode=mode, window=window)
+
+    async def _run(self, user_id: int, cost: int, now: float) -> RateLimitResult:
+        reply = await self._script(keys=[self._key(user_id)], args=self._script_args(cost, now))
+        return self._result(reply)
+
+    async def check(self, user_id: int) -> RateLimitResult:
+        now = time.time()
+        until = self._local_block(user_id, now)
+        if until is not None:
+            return RateLimitResult(False, 0, until - now)
+        result = await self._run(user_id, 1, now)
+        if not result.allowed:
+            self._remember_block(user_id, now + result.retry_after)
+        return result
+
+    async def allow(self, user_id: int) -> bool:
+        return (await self.check(user_id)).allowed
+
+    async def remaining(self, user_id: int) -> int:
+        return (await self._run(user_id, 0, time.time())).remaining
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, List
+
+import redis
+import redis.asyncio
+
+_pools: Dict[str, redis.ConnectionPool] = {}
+_async_pools: Dict[str, "redis.asyncio.ConnectionPool"] = {}
+_lock = threading.Lock()
+_closing = set()   # disconnect tasks scheduled by `reset_pools`, referenced until done
+
+logger = logging.getLogger(__name__)
+
+
+def default_url() -> str:
+    return os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+
+def pool_options() -> dict:
+    """Pool settings, configurable through the environment."""
+    return {
+        "max_connections": int(os.environ.get("REDIS_POOL_SIZE", 50)),
+        "timeout": float(os.environ.get("REDIS_POOL_TIMEOUT", 5)),
+        "health_check_interval": int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+        "socket_timeout": float(os.environ.get("REDIS_SOCKET_TIMEOUT", 10)),
+        "socket_connect_timeout": float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 5)),
+        "socket_keepalive": True,
+    }
+
+
+def get_pool(url: str = None) -> redis.ConnectionPool:
+    """Return the process-wide connection pool for `url` (REDIS_URL by default).
+
+    A blocking pool caps the number of sockets; callers wait up to
+    REDIS_POOL_TIMEOUT seconds for a free connection instead of opening more.
+    """
+    url = url or default_url()
+    with _lock:
+        pool = _pools.get(url)
+        if pool is None:
+            pool = redis.BlockingConnectionPool.from_url(url, **pool_options())
+            _pools[url] = pool
+        return pool
+
+
+def get_redis(url: str = None) -> redis.Redis:
+    """A client backed by the shared pool; cheap to create, no new TCP connection."""
+    return redis.Redis(connection_pool=get_pool(url))
+
+
+def get_async_redis(url: str = None) -> "redis.asyncio.Redis":
+    """asyncio client backed by a shared pool, for code running on the bot's event loop.
+
+    Async connections belong to the loop that opened them, so use this from a
+    single long-lived loop (the bot application's).
+    """
+    url = url or default_url()
+    with _lock:
+        pool = _async_pools.get(url)
+        if pool is None:
+            pool = redis.asyncio.BlockingConnectionPool.from_url(url, **pool_options())
+            _async_pools[url] = pool
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+async def _disconnect_async(pools: List["redis.asyncio.ConnectionPool"]):
+    results = await asyncio.gather(*(pool.disconnect() for pool in pools), return_exceptions=True)
+    for e in results:
+        if isinstance(e, BaseException):
+            logger.debug("Failed to disconnect an asyncio Redis pool: %s", e)
+
+
+async def close_async_pools():
+    """Disconnect and forget the asyncio pools; await on the loop that used them (e.g. at bot shutdown)."""
+    with _lock:
+        pools = list(_async_pools.values())
+        _async_pools.clear()
+    await _disconnect_async(pools)
+
+
+def reset_pools():
+    """Disconnect and forget all pools (e.g. after fork in a worker process).
+
+    Async connections can only be closed on their event loop: called from a
+    running loop, the asyncio pools are disconnected in a task on it; from
+    synchronous code they are disconnected on a temporary loop, which cannot
+    close sockets of a loop that is already closed (use `close_async_pools`
+    before closing it).
+    """
+    with _lock:
+        pools = list(_pools.values())
+        async_pools = list(_async_pools.values())
+        _pools.clear()
+        _async_pools.clear()
+    for pool in pools:
+        pool.disconnect()
+    if not async_pools:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        try:
+            asyncio.run(_disconnect_async(async_pools))
+        except Exception as e:
+            logger.debug("Failed to disconnect asyncio Redis pools: %s", e)
+        return
+    task = loop.create_task(_disconnect_async(async_pools))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
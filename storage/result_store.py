@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Dict, Iterator, Optional
+
+from storage import codec
+from storage.cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def result_key(file_hash: str, opts: dict = None) -> str:
+    """Content address for an OCR result: the versioned cache key (hash + OCR options)."""
+    return cache_key(file_hash, opts)
+
+
+def result_filename(file_hash: str) -> str:
+    """Name of the .txt document a result is delivered as."""
+    return f"ocr_result_{file_hash[:16]}.txt"
+
+
+def _compress(text: str) -> bytes:
+    return codec.compress(text.encode("utf-8"))
+
+
+def _decompress(blob: bytes) -> str:
+    return codec.decompress(blob).decode("utf-8")
+
+
+def _compressed_chunks(path: str, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    """Compress a UTF-8 text file incrementally, never holding it whole in memory."""
+    comp = codec.compressor()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            out = comp.compress(chunk)
+            if out:
+                yield out
+    yield comp.flush()
+
+
+class LocalResultStore:
+    """Compressed results on a local (or shared) filesystem, sharded by key prefix."""
+
+    def __init__(self, root: str = None):
+        self.root = root or os.environ.get("RESULT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "tgocr-results")
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + ".txt.z")
+
+    def put(self, key: str, text: str, ttl: int = None):
+        # ttl is accepted for interface parity; local files are expired by the host's cleanup
+        self._write(key, [_compress(text)])
+
+    def put_file(self, key: str, text_path: str, ttl: int = None):
+        """Store a UTF-8 text file, compressing it as it is read."""
+        self._write(key, _compressed_chunks(text_path))
+
+    def _write(self, key: str, chunks):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+            raise
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), "rb") as fh:
+                return _decompress(fh.read())
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Corrupt result entry %s", key)
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class RedisResultStore:
+    """Compressed results stored directly in Redis so any node can serve them."""
+
+    def __init__(self, conn, ttl: int = 24 * 3600):
+        self.conn = conn
+        self.ttl = ttl
+
+    def _key(self, key: str) -> str:
+        return f"tgocr:result:{key}"
+
+    def put(self, key: str, text: str, ttl: int = None):
+        self.conn.set(self._key(key), _compress(text), ex=ttl or self.ttl)
+
+    def put_file(self, key: str, text_path: str, ttl: int = None):
+        """Store a UTF-8 text file; only the compressed form is held in memory."""
+        self.conn.set(self._key(key), b"".join(_compressed_chunks(text_path)), ex=ttl or self.ttl)
+
+    def get(self, key: str) -> Optional[str]:
+        blob = self.conn.get(self._key(key))
+        if blob is None:
+            return None
+        try:
+            return _decompress(blob)
+        except Exception:
+            logger.warning("Corrupt result entry %s", key)
+            return None
+
+    def exists(self, key: str) -> bool:
+        return self.conn.exists(self._key(key)) == 1
+
+    def delete(self, key: str):
+        self.conn.delete(self._key(key))
+
+
+class PageStreamWriter:
+    """Streams page texts to a temporary .txt file in page order as they finish.
+
+    Pages may arrive out of order; each is written as soon as every page
+    before it has been, so only out-of-order pages are held in memory. The
+    output matches joining "--- Page N ---" sections with newlines, and
+    written pages can be read back with `read` while writing continues.
+    """
+
+    def __init__(self, total_pages: int, first_page: int = 1, dir: str = None):
+        self.total_pages = total_pages
+        self._fh = tempfile.NamedTemporaryFile("w+b", suffix=".txt", dir=dir, delete=False)
+        self.path = self._fh.name
+        self._next = first_page
+        self._first = first_page
+        self._pending: Dict[int, str] = {}
+        self._spans: Dict[int, tuple] = {}  # page -> (start, end) byte offsets
+
+    @property
+    def pages_written(self) -> int:
+        """Number of leading pages written so far."""
+        return self._next - self._first
+
+    @property
+    def last_page(self) -> int:
+        return self._next - 1
+
+    def add(self, page_num: int, text: Optional[str]):
+        """Queue a page (None to skip it) and write every page that is now contiguous."""
+        self._pending[page_num] = text
+        while self._next in self._pending:
+            text = self._pending.pop(self._next)
+            if text is not None:
+                if self._fh.tell():
+                    self._fh.write(b"\n")
+                start = self._fh.tell()
+                self._fh.write(f"--- Page {self._next} ---\n{text}".encode("utf-8"))
+                self._spans[self._next] = (start, self._fh.tell())
+            else:
+                self._spans[self._next] = (self._fh.tell(), self._fh.tell())
+            self._next += 1
+        self._fh.flush()
+
+    def read(self, first_page: int, last_page: int, limit: int = None) -> str:
+        """Text of written pages `first_page`..`last_page`, up to `limit` bytes."""
+        start = self._spans[first_page][0]
+        end = self._spans[last_page][1]
+        size = end - start if limit is None else min(limit, end - start)
+        with open(self.path, "rb") as fh:
+            fh.seek(start)
+            return fh.read(size).decode("utf-8", errors="ignore")
+
+    def close(self):
+        if not self._fh.closed:
+            self._fh.close()
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def get_result_store(conn=None):
+    """Build the result store selected by RESULT_STORE ("redis" or "local")."""
+    backend = os.environ.get("RESULT_STORE", "redis")
+    if backend == "local":
+        return LocalResultStore()
+    if conn is None:
+        from storage.redis_pool import get_redis
+        conn = get_redis()
+    return RedisResultStore(conn)
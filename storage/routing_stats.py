@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from storage.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "tgocr:ocr:routing"
+STATS_FLUSH_INTERVAL = 5.0
+
+
+class RoutingStats:
+    """Per-page OCR routing counters, shared by all workers in the `tgocr:ocr:routing` hash.
+
+    Each page counts under the route that produced its text: `local` when
+    Tesseract was confident enough, `cloud` when it was escalated and Vision's
+    result was used, `cloud_failed` when it was escalated but Vision failed or
+    found nothing. Time spent per engine accumulates in `local_ms` and
+    `cloud_ms`, and `conf_<n>` buckets Tesseract's page confidence by tens,
+    so the number of pages a different threshold would escalate can be read
+    straight off the histogram. Counts are buffered and flushed every few
+    seconds, like the cache statistics.
+    """
+
+    def __init__(self, conn=None):
+        self.conn = conn if conn is not None else get_redis()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, route: str, local_conf: Optional[float], local_s: float = 0.0, cloud_s: float = 0.0):
+        fields = {f"pages_{route}": 1, "local_ms": int(local_s * 1000), "cloud_ms": int(cloud_s * 1000)}
+        if local_conf is not None:
+            fields[f"conf_{min(9, max(0, int(local_conf // 10)))}"] = 1
+        with self._lock:
+            for name, n in fields.items():
+                self._pending[name] = self._pending.get(name, 0) + n
+            if time.monotonic() - self._last_flush < STATS_FLUSH_INTERVAL:
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        self._flush(pending)
+
+    def _flush(self, pending: Dict[str, int]):
+        try:
+            pipe = self.conn.pipeline(transaction=False)
+            for name, n in pending.items():
+                pipe.hincrby(STATS_KEY, name, n)
+            pipe.execute()
+        except Exception as e:
+            logger.debug("Failed to flush routing stats: %s", e)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if pending:
+            self._flush(pending)
+
+    def stats(self) -> Dict[str, int]:
+        self.flush()
+        raw = self.conn.hgetall(STATS_KEY) or {}
+        return {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
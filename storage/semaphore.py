@@ -0,0 +1,250 @@
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from storage import codec
+from storage.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Users with parked jobs, for the periodic `reap`.
+WAITING_KEY = "tgocr:sem:waiting"
+
+# Hand free slots to parked jobs in FIFO order and record them as queued
+# until they start. Expects now, ttl, limit locals and KEYS: slots zset,
+# pending list, token sequence, waiting set, queued zset, queued specs hash;
+# appends to `out`.
+_PROMOTE = """
+while redis.call('ZCARD', KEYS[1]) < limit do
+  local spec = redis.call('LPOP', KEYS[2])
+  if not spec then break end
+  local token = 'slot:' .. redis.call('INCR', KEYS[3])
+  redis.call('ZADD', KEYS[1], now + ttl, token)
+  redis.call('ZADD', KEYS[5], now, token)
+  redis.call('HSET', KEYS[6], token, spec)
+  table.insert(out, spec)
+  table.insert(out, token)
+end
+"""
+
+_EXPIRE = """
+redis.call('PEXPIRE', KEYS[1], ttl * 2)
+redis.call('PEXPIRE', KEYS[2], 86400000)
+redis.call('PEXPIRE', KEYS[3], 86400000)
+redis.call('PEXPIRE', KEYS[5], 86400000)
+redis.call('PEXPIRE', KEYS[6], 86400000)
+"""
+
+# Forget that the slot `token` is waiting for its job to start.
+_STARTED = """
+redis.call('ZREM', KEYS[5], token)
+redis.call('HDEL', KEYS[6], token)
+"""
+
+# ARGV: now_ms, ttl_ms, limit, spec, user
+# Returns {admitted, token, promoted spec, promoted token, ...}
+ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local out = {0, ''}
+""" + _PROMOTE + """
+if redis.call('ZCARD', KEYS[1]) < limit then
+  local token = 'slot:' .. redis.call('INCR', KEYS[3])
+  redis.call('ZADD', KEYS[1], now + ttl, token)
+  out[1] = 1
+  out[2] = token
+else
+  redis.call('RPUSH', KEYS[2], ARGV[4])
+  redis.call('SADD', KEYS[4], ARGV[5])
+end
+""" + _EXPIRE + """
+return out
+"""
+
+# ARGV: now_ms, ttl_ms, token
+HEARTBEAT_LUA = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local token = ARGV[3]
+local expires = redis.call('ZSCORE', KEYS[1], token)
+if not expires or tonumber(expires) < now then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, token)
+""" + _STARTED + _EXPIRE + """
+return 1
+"""
+
+# ARGV: now_ms, ttl_ms, limit, token
+# Returns {promoted spec, promoted token, ...}
+RELEASE_LUA = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local token = ARGV[4]
+redis.call('ZREM', KEYS[1], token)
+""" + _STARTED + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local out = {}
+""" + _PROMOTE + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+""" + _EXPIRE + """
+end
+return out
+"""
+
+# Renews the slots of promoted jobs still waiting in a queue (for at most
+# max_queued_ms after promotion), then frees expired slots and promotes.
+# ARGV: now_ms, ttl_ms, limit, user, max_queued_ms
+# Returns {promoted spec, promoted token, ...}
+REAP_LUA = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local oldest = now - tonumber(ARGV[5])
+for _, token in ipairs(redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', '(' .. oldest)) do
+  """ + _STARTED + """
+end
+for _, token in ipairs(redis.call('ZRANGE', KEYS[5], 0, -1)) do
+  if redis.call('ZSCORE', KEYS[1], token) then
+    redis.call('ZADD', KEYS[1], now + ttl, token)
+  else
+    """ + _STARTED + """
+  end
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local out = {}
+""" + _PROMOTE + """
+if redis.call('LLEN', KEYS[2]) == 0 and redis.call('ZCARD', KEYS[5]) == 0 then
+  redis.call('SREM', KEYS[4], ARGV[4])
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+""" + _EXPIRE + """
+end
+return out
+"""
+
+Promoted = List[Tuple[dict, str]]
+
+
+def _promoted(flat) -> Promoted:
+    return [(codec.loads(flat[i]), flat[i + 1].decode() if isinstance(flat[i + 1], bytes) else flat[i + 1])
+            for i in range(0, len(flat), 2)]
+
+
+class UserSemaphore:
+    """Per-user concurrency slots held as leases in Redis.
+
+    A slot is a member of the user's sorted set scored by its lease expiry, so
+    a crashed worker's slot frees itself after `lease_ttl` seconds unless a
+    heartbeat extends it. Jobs over the limit are parked (as an opaque spec)
+    in a per-user FIFO list; whenever a slot frees up, on `release` or when a
+    later `acquire` finds expired leases, parked jobs are handed the slot and
+    returned to the caller to be enqueued again. `reap`, run periodically,
+    does the same for users with parked jobs who submit nothing new, so a
+    leaked or crashed job's slot never strands them.
+
+    A promoted job's slot is queued until the job's first `heartbeat` (or a
+    `release`): `reap` keeps renewing it while the job waits behind a queue
+    backlog, for at most `max_queued` seconds (env JOB_SLOT_MAX_QUEUED).
+    """
+
+    def __init__(self, conn=None, limit: int = None, lease_ttl: float = None, max_queued: float = None):
+        self.conn = conn if conn is not None else get_redis()
+        self.limit = limit or int(os.environ.get("MAX_CONCURRENT_JOBS", "3"))
+        self.lease_ms = int((lease_ttl or float(os.environ.get("JOB_SLOT_TTL", "120"))) * 1000)
+        self.max_queued_ms = int((max_queued or float(os.environ.get("JOB_SLOT_MAX_QUEUED", 4 * 3600))) * 1000)
+        self._acquire = self.conn.register_script(ACQUIRE_LUA)
+        self._heartbeat = self.conn.register_script(HEARTBEAT_LUA)
+        self._release = self.conn.register_script(RELEASE_LUA)
+        self._reap = self.conn.register_script(REAP_LUA)
+
+    def _keys(self, user_id: int) -> List[str]:
+        base = f"tgocr:sem:{user_id}"
+        return [f"{base}:slots", f"{base}:pending", f"{base}:seq", WAITING_KEY, f"{base}:queued",
+                f"{base}:queued:specs"]
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
+
+    def acquire(self, user_id: int, spec: dict) -> Tuple[Optional[str], Promoted]:
+        """Take a slot for the job described by `spec`, or park it.
+
+        Returns (slot token or None if parked, parked jobs promoted into free slots).
+        """
+        out = self._acquire(keys=self._keys(user_id),
+                            args=[self._now_ms(), self.lease_ms, self.limit, codec.dumps(spec), user_id])
+        token = out[1].decode() if isinstance(out[1], bytes) else out[1]
+        return (token if int(out[0]) else None), _promoted(out[2:])
+
+    def heartbeat(self, user_id: int, token: str) -> bool:
+        """Extend a slot lease (and mark a promoted job started); False if it has already expired."""
+        return bool(self._heartbeat(keys=self._keys(user_id), args=[self._now_ms(), self.lease_ms, token]))
+
+    def release(self, user_id: int, token: str) -> Promoted:
+        """Free a slot and return parked jobs that now hold one."""
+        out = self._release(keys=self._keys(user_id), args=[self._now_ms(), self.lease_ms, self.limit, token])
+        return _promoted(out)
+
+    def reap(self) -> List[Tuple[int, Promoted]]:
+        """Renew queued slots and drop expired leases of users with waiting jobs.
+
+        Returns (user, promoted jobs) pairs.
+        """
+        reaped = []
+        for member in self.conn.smembers(WAITING_KEY):
+            user_id = int(member)
+            out = self._reap(keys=self._keys(user_id),
+                             args=[self._now_ms(), self.lease_ms, self.limit, user_id, self.max_queued_ms])
+            if out:
+                reaped.append((user_id, _promoted(out)))
+        return reaped
+
+    def waiting(self) -> List[dict]:
+        """Specs of all parked jobs, and of promoted jobs that have not started yet."""
+        specs = []
+        for member in self.conn.smembers(WAITING_KEY):
+            keys = self._keys(int(member))
+            specs += [codec.loads(spec) for spec in self.conn.lrange(keys[1], 0, -1)]
+            specs += [codec.loads(spec) for spec in self.conn.hvals(keys[5])]
+        return specs
+
+    def pending(self, user_id: int) -> int:
+        return self.conn.llen(self._keys(user_id)[1])
+
+
+class Heartbeat:
+    """Calls `beat` every `interval` seconds on a daemon thread until stopped."""
+
+    def __init__(self, beat, interval: float):
+        self._beat = beat
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self._beat()
+            except Exception as e:
+                logger.warning("Lease heartbeat failed: %s", e)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(self._interval + 1)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
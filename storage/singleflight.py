@@ -0,0 +1,167 @@
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from storage.redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Running flights scored by lease expiry (ms), for the periodic `reap`.
+INDEX_KEY = "tgocr:flight:leases"
+
+# Take the lease, or join the running flight as a subscriber.
+# KEYS: lease, subscribers, index  ARGV: token, lease_ms, subscriber, now_ms, key
+ACQUIRE_LUA = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+  redis.call('PEXPIRE', KEYS[2], ARGV[2] * 2)
+  redis.call('ZADD', KEYS[3], ARGV[4] + ARGV[2], ARGV[5])
+  return 1
+end
+redis.call('RPUSH', KEYS[2], ARGV[3])
+redis.call('PEXPIRE', KEYS[2], ARGV[2] * 2)
+return 0
+"""
+
+# Subscribe only if a flight is running.
+# KEYS: lease, subscribers, index  ARGV: subscriber
+JOIN_LUA = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl < 0 then
+  return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ttl * 2)
+return 1
+"""
+
+# Extend the lease if we still hold it.
+# KEYS: lease, subscribers, index  ARGV: token, lease_ms, now_ms, key
+RENEW_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+redis.call('PEXPIRE', KEYS[2], ARGV[2] * 2)
+redis.call('ZADD', KEYS[3], ARGV[3] + ARGV[2], ARGV[4])
+return 1
+"""
+
+# Drop the lease and hand back the subscribers, if we still hold it.
+# KEYS: lease, subscribers, index  ARGV: token, key
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+  return {}
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[3], ARGV[2])
+local subs = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return subs
+"""
+
+# Hand back the subscribers of a flight whose lease expired unreleased; a
+# flight that is still (or again) leased just gets its index entry updated.
+# KEYS: lease, subscribers, index  ARGV: now_ms, key
+REAP_LUA = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+  redis.call('ZADD', KEYS[3], ARGV[1] + ttl, ARGV[2])
+  return {}
+end
+redis.call('ZREM', KEYS[3], ARGV[2])
+local subs = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return subs
+"""
+
+
+def default_lease_ttl() -> float:
+    return float(os.environ.get("FLIGHT_LEASE_TTL", "600"))
+
+
+class SingleFlight:
+    """Coalesces concurrent work on the same key through a Redis lease.
+
+    The first caller to `acquire` a key gets a lease token and does the work;
+    callers arriving while the lease is held are recorded as subscribers
+    (chat ids) and handed back to the leader by `release`. The lease expires
+    after `lease_ttl` seconds unless renewed, so a crashed leader only blocks
+    the key until then. Its subscribers are served by the next leader, or
+    handed to `reap`, run periodically, if nobody takes the key over.
+    """
+
+    def __init__(self, conn=None, lease_ttl: float = None):
+        self.conn = conn if conn is not None else get_redis()
+        self.lease_ms = int((lease_ttl or default_lease_ttl()) * 1000)
+        self._acquire = self.conn.register_script(ACQUIRE_LUA)
+        self._join = self.conn.register_script(JOIN_LUA)
+        self._renew = self.conn.register_script(RENEW_LUA)
+        self._release = self.conn.register_script(RELEASE_LUA)
+        self._reap = self.conn.register_script(REAP_LUA)
+
+    def _keys(self, key: str) -> List[str]:
+        return [f"tgocr:flight:{key}", f"tgocr:flight:{key}:subs", INDEX_KEY]
+
+    @staticmethod
+    def new_token() -> str:
+        return os.urandom(16).hex()
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
+
+    def _acquire_args(self, key: str, token: str, subscriber: int) -> list:
+        return [token, self.lease_ms, subscriber, self._now_ms(), key]
+
+    def _renew_args(self, key: str, token: str) -> list:
+        return [token, self.lease_ms, self._now_ms(), key]
+
+    def acquire(self, key: str, subscriber: int) -> Optional[str]:
+        """Return a lease token if the caller leads, else None (subscribed)."""
+        token = self.new_token()
+        led = self._acquire(keys=self._keys(key), args=self._acquire_args(key, token, subscriber))
+        return token if led else None
+
+    def join(self, key: str, subscriber: int) -> bool:
+        """Subscribe to a running flight; False if nothing is in flight."""
+        return bool(self._join(keys=self._keys(key), args=[subscriber]))
+
+    def renew(self, key: str, token: str) -> bool:
+        return bool(self._renew(keys=self._keys(key), args=self._renew_args(key, token)))
+
+    def release(self, key: str, token: str) -> List[int]:
+        """End the flight and return its subscribers ([] if the lease was lost)."""
+        return [int(s) for s in self._release(keys=self._keys(key), args=[token, key])]
+
+    def reap(self) -> List[Tuple[str, List[int]]]:
+        """End flights whose leader vanished; return (key, stranded subscribers) pairs."""
+        now = self._now_ms()
+        reaped = []
+        for member in self.conn.zrangebyscore(INDEX_KEY, '-inf', now):
+            key = member.decode() if isinstance(member, bytes) else member
+            subscribers = self._reap(keys=self._keys(key), args=[now, key])
+            if subscribers:
+                reaped.append((key, [int(s) for s in subscribers]))
+        return reaped
+
+
+class AsyncSingleFlight(SingleFlight):
+    """asyncio variant of `SingleFlight` (redis.asyncio client)."""
+
+    def __init__(self, conn=None, lease_ttl: float = None):
+        super().__init__(conn=conn if conn is not None else get_async_redis(), lease_ttl=lease_ttl)
+
+    async def acquire(self, key: str, subscriber: int) -> Optional[str]:
+        token = self.new_token()
+        led = await self._acquire(keys=self._keys(key), args=self._acquire_args(key, token, subscriber))
+        return token if led else None
+
+    async def join(self, key: str, subscriber: int) -> bool:
+        return bool(await self._join(keys=self._keys(key), args=[subscriber]))
+
+    async def renew(self, key: str, token: str) -> bool:
+        return bool(await self._renew(keys=self._keys(key), args=self._renew_args(key, token)))
+
+    async def release(self, key: str, token: str) -> List[int]:
+        return [int(s) for s in await self._release(keys=self._keys(key), args=[token, key])]
@@ -0,0 +1,130 @@
+import logging
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from storage import codec
+from storage.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class InputStore:
+    """Job input files shared between worker nodes through Redis, keyed by content hash."""
+
+    def __init__(self, conn=None, ttl: int = 6 * 3600):
+        self.conn = conn if conn is not None else get_redis()
+        self.ttl = ttl
+
+    def _key(self, file_hash: str) -> str:
+        return f"tgocr:input:{file_hash}"
+
+    def put_file(self, file_hash: str, file_path: str):
+        with open(file_path, "rb") as fh:
+            self.conn.set(self._key(file_hash), fh.read(), ex=self.ttl)
+
+    def get(self, file_hash: str) -> Optional[bytes]:
+        return self.conn.get(self._key(file_hash))
+
+    def delete(self, file_hash: str):
+        self.conn.delete(self._key(file_hash))
+
+
+class PageCheckpoints:
+    """Per-page results of a partially processed document, so retried work can resume."""
+
+    def __init__(self, conn=None, ttl: int = 6 * 3600):
+        self.conn = conn if conn is not None else get_redis()
+        self.ttl = ttl
+
+    def _key(self, key: str) -> str:
+        return f"tgocr:pages:{key}"
+
+    def put(self, key: str, page_num: int, text: str):
+        self.put_many(key, {page_num: text})
+
+    def put_many(self, key: str, pages: Dict[int, str]):
+        if not pages:
+            return
+        mapping = {str(n): codec.compress(t.encode("utf-8")) for n, t in pages.items()}
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.hset(self._key(key), mapping=mapping)
+        pipe.expire(self._key(key), self.ttl)
+        pipe.execute()
+
+    def done(self, key: str) -> Set[int]:
+        """1-based numbers of the pages already checkpointed."""
+        return {int(n) for n in self.conn.hkeys(self._key(key))}
+
+    def count(self, key: str) -> int:
+        return self.conn.hlen(self._key(key))
+
+    def iter_pages(self, key: str, total_pages: int, batch: int = 50) -> Iterator[Tuple[int, Optional[str]]]:
+        """Yield (page number, text or None) for pages 1..total_pages, fetching `batch` at a time."""
+        for first in range(1, total_pages + 1, batch):
+            numbers = list(range(first, min(first + batch, total_pages + 1)))
+            for n, blob in zip(numbers, self.conn.hmget(self._key(key), [str(n) for n in numbers])):
+                yield n, codec.decompress(blob).decode("utf-8") if blob is not None else None
+
+    def get_all(self, key: str) -> Dict[int, str]:
+        raw = self.conn.hgetall(self._key(key)) or {}
+        return {int(n): codec.decompress(t).decode("utf-8") for n, t in raw.items()}
+
+    def delete(self, key: str):
+        self.conn.delete(self._key(key))
+
+
+class ChunkedJobs:
+    """Bookkeeping for documents split into chunk jobs, from fan-out until their finalizer runs.
+
+    Each document records the parent job (user, options, leases) and a
+    deadline, and counts down its outstanding chunks; the chunk that brings
+    the count to zero, or whoever finds the document past its deadline,
+    claims the right to enqueue the finalizer exactly once.
+    """
+
+    INDEX_KEY = "tgocr:chunked"
+
+    def __init__(self, conn=None, ttl: int = 6 * 3600):
+        self.conn = conn if conn is not None else get_redis()
+        self.ttl = ttl
+
+    def _key(self, key: str, part: str) -> str:
+        return f"tgocr:chunked:{key}:{part}"
+
+    def start(self, key: str, job: dict, chunks: int, deadline: float):
+        pipe = self.conn.pipeline(transaction=True)
+        pipe.hset(self.INDEX_KEY, key, codec.dumps(job))
+        pipe.set(self._key(key, "left"), chunks, ex=self.ttl)
+        pipe.set(self._key(key, "deadline"), deadline, ex=self.ttl)
+        pipe.delete(self._key(key, "final"))
+        pipe.execute()
+
+    def extend(self, key: str, deadline: float):
+        """Move the document's deadline to `deadline` (epoch seconds)."""
+        self.conn.set(self._key(key, "deadline"), deadline, ex=self.ttl)
+
+    def deadline(self, key: str) -> float:
+        """The document's deadline; 0 once its bookkeeping has expired."""
+        raw = self.conn.get(self._key(key, "deadline"))
+        return float(raw) if raw else 0.0
+
+    def chunk_done(self, key: str) -> bool:
+        """Count one chunk as finished; True for the last one."""
+        return self.conn.decr(self._key(key, "left")) == 0
+
+    def claim_finalize(self, key: str) -> bool:
+        """True for exactly one caller, which enqueues the finalizer."""
+        return bool(self.conn.set(self._key(key, "final"), 1, nx=True, ex=self.ttl))
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self.conn.hget(self.INDEX_KEY, key)
+        return codec.loads(raw) if raw else None
+
+    def active(self) -> Iterator[Tuple[str, dict]]:
+        for key, raw in (self.conn.hgetall(self.INDEX_KEY) or {}).items():
+            yield (key.decode() if isinstance(key, bytes) else key), codec.loads(raw)
+
+    def finish(self, key: str):
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.hdel(self.INDEX_KEY, key)
+        pipe.delete(self._key(key, "left"), self._key(key, "final"), self._key(key, "deadline"))
+        pipe.execute()
@@ -0,0 +1,30 @@
+"""Periodic maintenance jobs, run by RQ's cron scheduler alongside the workers:
+
+    rq cron tasks.cron
+
+`reap_job_slots` keeps the slots of promoted jobs still waiting in a queue,
+frees concurrency slots whose lease expired (a crashed work horse, or a job
+that never released its slot) and starts the parked jobs they were holding
+up, even if their user sends nothing else.
+`reap_stalled_jobs` puts fair-scheduled jobs that raised, or whose work horse
+died, back in their queue, and counts down PDF chunks it gives up on.
+`reap_flights` answers uploads that joined an
+identical job which died without releasing its single-flight lease (with the
+cached result if there is one, else a note to send the file again).
+`keep_chunked_alive` renews the leases of large PDFs whose chunks are still
+queued, and finalizes those past their deadline. The interval must stay well below JOB_SLOT_TTL.
+"""
+import os
+
+from rq import cron   # pyright: ignore[reportMissingImports]
+
+from tasks.pdf_jobs import keep_chunked_alive
+from tasks.queue_manager import reap_stalled_jobs
+from tasks.worker_rq import reap_flights, reap_job_slots
+
+REAP_INTERVAL = int(os.environ.get("JOB_SLOT_REAP_INTERVAL", "60"))
+
+cron.register(reap_job_slots, queue_name="ocr-fast", interval=REAP_INTERVAL, job_timeout=60)
+cron.register(reap_flights, queue_name="ocr-fast", interval=REAP_INTERVAL, job_timeout=60)
+cron.register(reap_stalled_jobs, queue_name="ocr-fast", interval=REAP_INTERVAL, job_timeout=60)
+cron.register(keep_chunked_alive, queue_name="ocr-fast", interval=REAP_INTERVAL, job_timeout=60)
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import Future, wait
+from typing import Dict, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_seconds(exc: RetryAfter) -> float:
+    with warnings.catch_warnings():
+        # PTB warns that retry_after will become a timedelta; both are handled
+        warnings.simplefilter("ignore")
+        ra = exc.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+
+class _Status:
+    """Coalesced progress state for one status message."""
+
+    def __init__(self):
+        self.text: Optional[str] = None
+        self.sent_text: Optional[str] = None
+        self.message_id: Optional[int] = None
+        self.queued = False
+        self.last_update = 0.0
+
+
+class TelegramDelivery:
+    """Long-lived Telegram client for worker processes.
+
+    One asyncio loop runs in a background thread and owns a single `Bot`, so
+    all sends share one pooled HTTP session. Every chat gets its own outbound
+    queue, drained in order; a chat's queue and drainer are retired after
+    `idle_timeout` seconds without sends, so long-lived processes do not keep
+    one per chat ever served. Progress updates for a status key are coalesced:
+    only the newest text is sent, as an edit of one status message, at most
+    once per `progress_interval` seconds. Telegram's 429 `retry_after` is
+    honoured before retrying, and extends how long `wait` blocks.
+
+    The public methods are thread-safe and return `concurrent.futures.Future`s
+    so synchronous RQ code can fire and forget, or wait.
+    """
+
+    def __init__(self, token: str, base_url: str = None, pool_size: int = 8, max_retries: int = 3,
+                 progress_interval: float = 1.0, idle_timeout: float = 60.0):
+        kwargs = {"request": HTTPXRequest(connection_pool_size=pool_size, media_write_timeout=60.0)}
+        if base_url:
+            kwargs["base_url"] = base_url
+        self.bot = Bot(token=token, **kwargs)
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.idle_timeout = idle_timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="tg-delivery", daemon=True)
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._drainers: Dict[int, asyncio.Task] = {}
+        self._status: Dict[Tuple[int, str], _Status] = {}
+        # monotonic time the latest flood-control wait ends
+        self._retry_until = 0.0
+        self._thread.start()
+        self._submit(self.bot.initialize()).result()
+
+    def _submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _call(self, method, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await method(**kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _retry_seconds(e)
+                self._retry_until = max(self._retry_until, time.monotonic() + delay)
+                logger.info("Telegram flood control; retrying in %.1fs", delay)
+                await asyncio.sleep(delay)
+
+    def _queue(self, chat_id: int) -> asyncio.Queue:
+        q = self._queues.get(chat_id)
+        if q is None:
+            q = self._queues[chat_id] = asyncio.Queue()
+            self._drainers[chat_id] = self._loop.create_task(self._drain(chat_id, q))
+        return q
+
+    async def _drain(self, chat_id: int, q: asyncio.Queue):
+        while True:
+            try:
+                action, future = await asyncio.wait_for(q.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if q.empty():
+                    # nothing can be put between this check and the removal: both run on the loop
+                    del self._queues[chat_id], self._drainers[chat_id]
+                    return
+                continue
+            try:
+                result = await action()
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                logger.warning("Telegram delivery failed: %s", e)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                q.task_done()
+
+    async def _enqueue(self, chat_id: int, action) -> asyncio.Future:
+        future = self._loop.create_future()
+        # failures are already logged; mark them retrieved for fire-and-forget sends
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await self._queue(chat_id).put((action, future))
+        return future
+
+    async def _enqueue_and_wait(self, chat_id: int, action):
+        return await (await self._enqueue(chat_id, action))
+
+    def send_message(self, chat_id: int, text: str) -> Future:
+        action = lambda: self._call(self.bot.send_message, chat_id=chat_id, text=text)
+        return self._submit(self._enqueue_and_wait(chat_id, action))
+
+    def send_document(self, chat_id: int, data: bytes, filename: str, caption: Optional[str] = None) -> Future:
+        action = lambda: self._call(self.bot.send_document, chat_id=chat_id, document=data,
+                                    filename=filename, caption=caption)
+        return self._submit(self._enqueue_and_wait(chat_id, action))
+
+    def send_document_file(self, chat_id: int, path: str, filename: str, caption: Optional[str] = None) -> Future:
+        """Upload a file from disk; it is opened only when its turn in the chat's queue comes."""
+        async def action():
+            with open(path, "rb") as fh:
+                return await self._call(self.bot.send_document, chat_id=chat_id, document=fh,
+                                        filename=filename, caption=caption)
+        return self._submit(self._enqueue_and_wait(chat_id, action))
+
+    def progress(self, chat_id: int, text: str, key: str = "progress"):
+        """Show `text` in the chat's status message for `key`, coalescing rapid updates."""
+        self._loop.call_soon_threadsafe(self._progress, chat_id, key, text)
+
+    def _progress(self, chat_id: int, key: str, text: str):
+        status = self._status.setdefault((chat_id, key), _Status())
+        status.text = text
+        if not status.queued:
+            status.queued = True
+            self._loop.create_task(self._enqueue(chat_id, lambda: self._send_status(chat_id, status)))
+
+    async def _send_status(self, chat_id: int, status: _Status):
+        wait = status.last_update + self.progress_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)  # let further updates coalesce
+        status.queued = False
+        text = status.text
+        if text == status.sent_text:
+            return
+        if status.message_id is None:
+            msg = await self._call(self.bot.send_message, chat_id=chat_id, text=text)
+            status.message_id = msg.message_id
+        else:
+            try:
+                await self._call(self.bot.edit_message_text, chat_id=chat_id, message_id=status.message_id,
+                                 text=text)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+        status.sent_text = text
+        status.last_update = time.monotonic()
+
+    def finish_progress(self, chat_id: int, key: str = "progress"):
+        """Forget the status message so the next job starts a fresh one."""
+        self._loop.call_soon_threadsafe(self._status.pop, (chat_id, key), None)
+
+    async def _join_all(self):
+        await asyncio.sleep(0)  # let just-scheduled progress updates reach their queues
+        await asyncio.gather(*(q.join() for q in list(self._queues.values())))
+
+    def flush(self, timeout: float = 30.0):
+        """Block until every queued send has been attempted."""
+        try:
+            self._submit(self._join_all()).result(timeout)
+        except Exception as e:
+            logger.warning("Timed out flushing Telegram deliveries: %s", e)
+
+    def wait(self, future: Future, timeout: float = 30.0) -> bool:
+        """Block until `future` settles; False if it is still pending after `timeout` seconds.
+
+        Each flood-control wait pushes the limit out to `timeout` past its end,
+        so a send queued behind a 429 still completes (within `max_retries`).
+        """
+        start = time.monotonic()
+        while not future.done():
+            remaining = max(start, self._retry_until) + timeout - time.monotonic()
+            if remaining <= 0:
+                return False
+            wait([future], timeout=min(remaining, 1.0))
+        return True
+
+    async def _shutdown(self):
+        drainers = list(self._drainers.values())
+        for task in drainers:
+            task.cancel()
+        await asyncio.gather(*drainers, return_exceptions=True)
+        await self.bot.shutdown()
+
+    def close(self):
+        self.flush()
+        self._submit(self._shutdown()).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+
+_delivery: Optional[TelegramDelivery] = None
+_delivery_lock = threading.Lock()
+
+
+def get_delivery() -> Optional[TelegramDelivery]:
+    """Process-wide delivery client, or None when BOT_TOKEN is not configured."""
+    global _delivery
+    token = os.environ.get("BOT_TOKEN")
+    if not token:
+        return None
+    with _delivery_lock:
+        if _delivery is None:
+            _delivery = TelegramDelivery(token, base_url=os.environ.get("TELEGRAM_API_BASE_URL"))
+        return _delivery
+
+
+def _reset_after_fork():
+    # The loop thread does not survive fork (RQ forks a work horse per job).
+    global _delivery, _delivery_lock
+    _delivery = None
+    _delivery_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,228 @@
+"""Map/reduce OCR for large PDFs.
+
+`start_chunked` publishes the input to the shared `InputStore`, checkpoints
+the pages that already have a text layer and fans the remaining pages out as
+`ocr_pdf_chunk` jobs of PDF_CHUNK_PAGES pages each, which any worker node can
+run. Chunks go through the fair scheduler on the parent document's cost
+queue, so a 400-page scan shares ocr-bulk fairly instead of flooding a
+queue of its own. Every chunk checkpoints each page as soon as it is
+recognised, so a retried chunk (or a resubmitted document) only OCRs the
+pages still missing. The last chunk to finish (or to be dropped by the
+scheduler after stalling too often) enqueues `finalize_pdf`, which streams
+the pages in order to the result file, and then delivers it and releases
+the parent job's leases. Until then `keep_chunked_alive` (a periodic job, see
+tasks.cron) renews those leases, and finalizes documents whose chunks never
+all reported back. A result with failed pages is delivered but not cached,
+and its checkpoints are kept so that sending the file again only retries
+the failed pages.
+"""
+import logging
+import os
+import time
+from typing import List, Optional
+
+from storage.result_store import PageStreamWriter, result_key
+from storage.semaphore import Heartbeat
+from storage.temp_store import ChunkedJobs, InputStore, PageCheckpoints
+from tasks import worker_rq
+
+logger = logging.getLogger(__name__)
+
+FAILED_PAGE_TEXT = "[OCR failed for this page]"
+# Attempts a failing chunk gets before its pages are left to the finalizer as failed.
+CHUNK_ATTEMPTS = 3
+# RQ job timeout of the finalizer, which only assembles checkpoints and uploads.
+FINALIZE_TIMEOUT = 900
+# A chunked document is finalized with what exists once no chunk has started
+# for CHUNK_ATTEMPTS runs of its queue's job timeout, and at the latest this
+# long after fan-out (its input and checkpoints expire at about the same time).
+CHUNKED_MAX_AGE = 6 * 3600
+
+
+def chunk_pages(pages: List[int], size: int) -> List[List[int]]:
+    size = max(1, size)
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+
+def _chunk_units(pages: List[int], opts: dict) -> float:
+    from tasks.scheduler import A4_MEGAPIXELS, JobCost
+    return JobCost(len(pages), len(pages) * A4_MEGAPIXELS, bool(opts.get('cloud_ocr'))).units
+
+
+def _submit_chunk(queue: str, file_hash: str, opts: dict, chat_id: int, pages: List[int], total: int,
+                  attempt: int = 1):
+    from tasks.queue_manager import enqueue_fair
+    enqueue_fair(queue, chat_id, _chunk_units(pages, opts), 'tasks.pdf_jobs.ocr_pdf_chunk',
+                 file_hash, opts, chat_id, pages, total, queue, attempt)
+
+
+def _deadline(job: dict) -> float:
+    from tasks.scheduler import JOB_TIMEOUTS
+    return min(time.time() + JOB_TIMEOUTS[job["queue"]] * CHUNK_ATTEMPTS, job["started"] + CHUNKED_MAX_AGE)
+
+
+def _enqueue_finalize(key: str, job: dict):
+    if not ChunkedJobs(worker_rq.cache.conn).claim_finalize(key):
+        return None
+    from tasks.queue_manager import queues
+    return queues[job["queue"]].enqueue('tasks.pdf_jobs.finalize_pdf', job["file_hash"], job["opts"],
+                                        job["chat_id"], job["total"], flight_token=job["flight_token"],
+                                        slot_token=job["slot_token"], job_timeout=FINALIZE_TIMEOUT)
+
+
+def start_chunked(file_path: str, file_hash: str, chat_id: int, opts: dict, layout,
+                  flight_token: Optional[str] = None, slot_token: Optional[str] = None):
+    """Fan the PDF's scanned pages out to chunk jobs on the document's cost queue."""
+    from tasks.scheduler import estimate_cost, route
+
+    conn = worker_rq.cache.conn
+    key = result_key(file_hash, opts)
+    checkpoints = PageCheckpoints(conn)
+    checkpoints.put_many(key, {i: t for i, t in enumerate(layout.page_texts, start=1) if t is not None})
+    InputStore(conn).put_file(file_hash, file_path)
+
+    done = checkpoints.done(key)
+    todo = [p for p in layout.scanned_pages if p + 1 not in done]
+    size = int(os.environ.get("PDF_CHUNK_PAGES", "20"))
+    total = len(layout.page_texts)
+    queue = route(estimate_cost(file_path, "application/pdf", opts))
+    chunks = chunk_pages(todo, size)
+    job = {"chat_id": chat_id, "file_hash": file_hash, "opts": opts, "total": total, "queue": queue,
+           "flight_token": flight_token, "slot_token": slot_token, "started": time.time()}
+    ChunkedJobs(conn).start(key, job, len(chunks), _deadline(job))
+    if not chunks:
+        return _enqueue_finalize(key, job)
+    for pages in chunks:
+        _submit_chunk(queue, file_hash, opts, chat_id, pages, total)
+    return None
+
+
+def _beat(chat_id: int, file_hash: str, opts: dict, flight_token: Optional[str], slot_token: Optional[str]):
+    if slot_token:
+        worker_rq._semaphore().heartbeat(chat_id, slot_token)
+    if flight_token:
+        worker_rq._flight().renew(worker_rq.cache_key(file_hash, opts), flight_token)
+
+
+def ocr_pdf_chunk(file_hash: str, opts: dict, chat_id: int, pages: List[int], total_pages: int,
+                  queue: str = "bulk", attempt: int = 1) -> int:
+    """OCR the given 0-based pages that are not checkpointed yet; returns how many were done.
+
+    If any page fails, the chunk is submitted again (up to CHUNK_ATTEMPTS)
+    for the failed pages only. The last chunk of the document to finish
+    enqueues the finalizer.
+    """
+    key = result_key(file_hash, opts)
+    chunked = ChunkedJobs(worker_rq.cache.conn)
+    job = chunked.get(key)
+    if job:
+        chunked.extend(key, _deadline(job))
+    done = 0
+    try:
+        done = _ocr_chunk(key, file_hash, opts, chat_id, pages, total_pages)
+    except Exception as e:
+        if attempt < CHUNK_ATTEMPTS:
+            logger.warning("Chunk of %s failed (attempt %s), retrying: %s", file_hash[:16], attempt, e)
+            _submit_chunk(queue, file_hash, opts, chat_id, pages, total_pages, attempt=attempt + 1)
+            return 0
+        logger.error("Chunk of %s failed after %s attempts: %s", file_hash[:16], attempt, e)
+    _chunk_finished(key)
+    return done
+
+
+def abandon_chunk(file_hash: str, opts: dict, chat_id: int, pages: List[int], total_pages: int,
+                  queue: str = "bulk", attempt: int = 1):
+    """Count down a chunk the scheduler dropped (its work horse kept dying); its pages are left as failed."""
+    logger.error("Chunk of %s abandoned after its worker died repeatedly", file_hash[:16])
+    _chunk_finished(result_key(file_hash, opts))
+
+
+def _chunk_finished(key: str):
+    chunked = ChunkedJobs(worker_rq.cache.conn)
+    if chunked.chunk_done(key):
+        job = chunked.get(key)
+        if job:
+            _enqueue_finalize(key, job)
+
+
+def _ocr_chunk(key: str, file_hash: str, opts: dict, chat_id: int, pages: List[int], total_pages: int) -> int:
+    conn = worker_rq.cache.conn
+    job = ChunkedJobs(conn).get(key) or {}
+    flight_token, slot_token = job.get("flight_token"), job.get("slot_token")
+    checkpoints = PageCheckpoints(conn)
+    done = checkpoints.done(key)
+    todo = [p for p in pages if p + 1 not in done]
+    if not todo:
+        return 0
+    data = InputStore(conn).get(file_hash)
+    if data is None:
+        raise RuntimeError(f"Input for {file_hash[:16]} is no longer in the shared store")
+
+    ocr = worker_rq.OCRService()
+    doc = ocr.pdf.open_bytes(data)
+    ttl = worker_rq._semaphore().lease_ms / 3000.0
+    failed = 0
+    try:
+        with Heartbeat(lambda: _beat(chat_id, file_hash, opts, flight_token, slot_token), ttl):
+            pages = ocr.pdf.render_pages(doc, todo)
+            for result in worker_rq._ocr_pages(ocr, opts, pages, doc_key=file_hash):
+                if result.error is not None:
+                    logger.warning("OCR failed for page %s of %s: %s", result.page_num, file_hash[:16],
+                                   result.error)
+                    failed += 1
+                    continue
+                checkpoints.put(key, result.page_num, result.value[0])
+                worker_rq.send_progress(chat_id, f"Processed {checkpoints.count(key)}/{total_pages} pages...")
+    finally:
+        doc.close()
+        worker_rq._finish_delivery(chat_id)
+    if failed:
+        raise RuntimeError(f"{failed} of {len(todo)} pages failed")
+    return len(todo)
+
+
+def finalize_pdf(file_hash: str, opts: dict, chat_id: int, total_pages: int, flight_token: str = None,
+                 slot_token: str = None):
+    """Assemble checkpointed pages in order, deliver the result and release the job's leases.
+
+    Only a complete result is cached; if pages failed, their checkpoints are
+    kept so a resubmission retries just those.
+    """
+    conn = worker_rq.cache.conn
+    key = result_key(file_hash, opts)
+    checkpoints = PageCheckpoints(conn)
+    writer = PageStreamWriter(total_pages)
+    sent = None
+    try:
+        missing = 0
+        for page_num, text in checkpoints.iter_pages(key, total_pages):
+            if text is None:
+                missing += 1
+            writer.add(page_num, FAILED_PAGE_TEXT if text is None else text)
+        writer.close()
+        note = f" ({missing} pages could not be recognised; send the file again to retry them)" if missing else ""
+        worker_rq.send_message(chat_id, f"Done processing PDF{note}.")
+        sent = worker_rq.deliver_result_file(chat_id, file_hash, opts, writer.path, 0.0, store=not missing)
+        if not missing:
+            checkpoints.delete(key)
+        InputStore(conn).delete(file_hash)
+    finally:
+        ChunkedJobs(conn).finish(key)
+        worker_rq._release_job(chat_id, file_hash, opts, flight_token, slot_token)
+        worker_rq._finish_delivery(chat_id)
+        worker_rq.discard_when_sent(writer, sent)
+
+
+def keep_chunked_alive():
+    """Periodic job (see tasks.cron): renew chunked documents' leases until they are finalized.
+
+    Chunks may wait in their queue longer than a lease lasts, so the parent
+    job's slot and single-flight leases are renewed here rather than only by
+    running chunks. A document past its deadline (a chunk was lost without
+    counting itself down) is finalized with the pages that exist.
+    """
+    chunked = ChunkedJobs(worker_rq.cache.conn)
+    for key, job in chunked.active():
+        _beat(job["chat_id"], job["file_hash"], job["opts"], job["flight_token"], job["slot_token"])
+        if time.time() > chunked.deadline(key) and _enqueue_finalize(key, job) is not None:
+            logger.warning("Finalizing %s past its deadline with missing chunks", job["file_hash"][:16])
@@ -1,12 +1,70 @@
+import importlib
+import logging
 import os
-import redis   # pyright: ignore[reportMissingImports]
+from typing import Any, NamedTuple
+
 from rq import Queue   # pyright: ignore[reportMissingImports]
 
+from storage.redis_pool import get_redis
+from tasks.scheduler import JOB_TIMEOUTS, QUEUES, FairScheduler, estimate_cost, route
+
 redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
-redis_conn = redis.from_url(redis_url)
+redis_conn = get_redis(redis_url)
 q = Queue("default", connection=redis_conn)
+queues = {name: Queue(f"ocr-{name}", connection=redis_conn) for name in QUEUES}
+scheduler = FairScheduler(redis_conn)
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob(NamedTuple):
+    id: str      # "<queue>:<n>", the job's id in the fair order
+    token: Any   # the RQ `run_next` job that will start a pending job of the queue
+
+
+def queue_status():
+    """(RQ tokens queued, jobs pending in the fair order) for each cost queue."""
+    return {name: (queues[name].count, scheduler.pending(name)) for name in QUEUES}
 
 
 def enqueue_job(func, *args, **kwargs):
     job = q.enqueue(func, *args, **kwargs)
     return job
+
+
+def _enqueue_token(name: str):
+    return queues[name].enqueue('tasks.scheduler.run_next', name, job_timeout=JOB_TIMEOUTS[name])
+
+
+def enqueue_fair(name: str, user_id: int, units: float, func: str, *args, **kwargs) -> ScheduledJob:
+    """Queue a call to `func` on the `name` cost queue, in fair order among its users."""
+    job_id = scheduler.submit(name, user_id, units, func, *args, **kwargs)
+    return ScheduledJob(f"{name}:{int(job_id)}", _enqueue_token(name))
+
+
+# Called with a dropped job's arguments when it has stalled too often to requeue.
+ON_DROP = {'tasks.pdf_jobs.ocr_pdf_chunk': 'tasks.pdf_jobs.abandon_chunk'}
+
+
+def _dropped(spec: dict):
+    handler = ON_DROP.get(spec["func"])
+    if handler:
+        module, _, name = handler.rpartition('.')
+        getattr(importlib.import_module(module), name)(*spec["args"], **spec["kwargs"])
+
+
+def reap_stalled_jobs():
+    """Periodic job (see tasks.cron): requeue fair-scheduled jobs that raised or whose worker died."""
+    for name in QUEUES:
+        requeued = scheduler.requeue_stalled(name, on_drop=_dropped)
+        if requeued:
+            logger.info("Requeued %d stalled job(s) on %s", requeued, name)
+        for _ in range(requeued):
+            _enqueue_token(name)
+
+
+def enqueue_ocr_job(file_path: str, mime_type: str, chat_id: int, opts: dict, **kwargs):
+    """Route an OCR job by estimated cost and queue it fairly among the queue's users."""
+    cost = estimate_cost(file_path, mime_type, opts)
+    return enqueue_fair(route(cost), chat_id, cost.units, 'tasks.worker_rq.process_file_job_rq',
+                        file_path, mime_type, chat_id, opts, **kwargs)
@@ -0,0 +1,241 @@
+"""Cost-aware routing and per-user fair scheduling for OCR jobs.
+
+Jobs are classified by estimated cost into the "fast", "default" and "bulk"
+RQ queues (`ocr-fast`, `ocr-default`, `ocr-bulk`), each meant to be served by
+its own worker pool so screenshots are never stuck behind a 400-page scan:
+
+    rq worker ocr-fast                 # small pool, low latency
+    rq worker ocr-default ocr-fast
+    rq worker ocr-bulk                 # large jobs keep progressing
+    rq cron tasks.cron                 # periodic reapers (tasks.cron)
+
+Within a queue, users are served by start-time fair queuing: each job gets a
+virtual start tag `max(V, F_user)` and advances the user's finish tag by its
+cost, where V is the tag of the job most recently started. Job specs wait in
+a Redis sorted set ordered by start tag; the RQ queue only carries `run_next`
+tokens, one per submitted job, and each token runs whichever pending job has
+the lowest tag when a worker picks it up.
+
+A started job stays claimed, with its spec kept, until it returns. The claim
+is a lease its worker renews; when the job raises or its work horse dies the
+claim lapses, and `requeue_stalled`, run periodically, puts the job back in
+the fair order (with a fresh token) for up to MAX_ATTEMPTS runs.
+"""
+import importlib
+import logging
+import os
+import time
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from storage import codec
+from storage.redis_pool import get_redis
+from storage.semaphore import Heartbeat
+
+logger = logging.getLogger(__name__)
+
+QUEUES = ("fast", "default", "bulk")
+# RQ job timeouts (seconds) per queue; a bulk token may run a 400-page scan.
+JOB_TIMEOUTS = {"fast": 300, "default": 1800, "bulk": 4 * 3600}
+
+# Megapixels of an A4 page rendered at 300 DPI, the unit a PDF page is costed at.
+A4_MEGAPIXELS = 8.7
+# Cloud OCR spends its time waiting on the network, not a worker's CPU.
+CLOUD_COST_FACTOR = 0.3
+# Runs a job gets before a stalled claim is dropped instead of requeued.
+MAX_ATTEMPTS = 3
+
+
+class JobCost(NamedTuple):
+    pages: int
+    megapixels: float
+    cloud: bool
+
+    @property
+    def units(self) -> float:
+        """Estimated work, roughly in A4 pages OCR-ed locally."""
+        units = self.megapixels / A4_MEGAPIXELS
+        return units * CLOUD_COST_FACTOR if self.cloud else units
+
+
+def estimate_cost(file_path: str, mime_type: str, opts: dict) -> JobCost:
+    """Cheap cost estimate from file headers (no rendering or decoding)."""
+    cloud = bool(opts.get('cloud_ocr'))
+    try:
+        if mime_type == "application/pdf" or file_path.lower().endswith('.pdf'):
+            import fitz  # PyMuPDF
+            with fitz.open(file_path) as doc:
+                pages = doc.page_count
+            return JobCost(pages, pages * A4_MEGAPIXELS, cloud)
+        from PIL import Image
+        with Image.open(file_path) as img:
+            width, height = img.size
+        return JobCost(1, width * height / 1e6, cloud)
+    except Exception as e:
+        logger.warning("Could not estimate cost of %s: %s", file_path, e)
+        return JobCost(1, A4_MEGAPIXELS, cloud)
+
+
+def route(cost: JobCost) -> str:
+    """Pick the queue for a job; thresholds are in `JobCost.units`."""
+    fast_max = float(os.environ.get("SCHED_FAST_MAX_UNITS", "1.5"))
+    bulk_min = float(os.environ.get("SCHED_BULK_MIN_UNITS", "25"))
+    if cost.units <= fast_max:
+        return "fast"
+    if cost.units >= bulk_min:
+        return "bulk"
+    return "default"
+
+
+# KEYS: pending zset, specs hash, virtual time, finish tags hash, sequence
+# ARGV: spec, user, cost
+# Members are zero-padded sequence numbers so equal start tags run in FIFO order.
+SUBMIT_LUA = """
+local v = tonumber(redis.call('GET', KEYS[3]) or '0')
+local f = tonumber(redis.call('HGET', KEYS[4], ARGV[2]) or '0')
+local start = math.max(v, f)
+redis.call('HSET', KEYS[4], ARGV[2], tostring(start + tonumber(ARGV[3])))
+redis.call('PEXPIRE', KEYS[4], 86400000)
+local id = string.format('%016d', redis.call('INCR', KEYS[5]))
+redis.call('HSET', KEYS[2], id, ARGV[1])
+redis.call('ZADD', KEYS[1], start, id)
+return id
+"""
+
+# Move the fairest pending job to the processing set, leased until ARGV[1].
+# KEYS: pending zset, specs hash, virtual time, processing zset, attempts hash
+CLAIM_LUA = """
+local head = redis.call('ZPOPMIN', KEYS[1])
+if not head[1] then
+  return false
+end
+redis.call('SET', KEYS[3], head[2])
+redis.call('ZADD', KEYS[4], ARGV[1], head[1])
+redis.call('HINCRBY', KEYS[5], head[1], 1)
+return {head[1], redis.call('HGET', KEYS[2], head[1])}
+"""
+
+# Put claims that lapsed before ARGV[1] back at the current virtual time, or
+# drop them after ARGV[2] attempts. Returns {requeued count, dropped spec, ...}.
+# KEYS: pending zset, specs hash, virtual time, processing zset, attempts hash
+REQUEUE_LUA = """
+local v = redis.call('GET', KEYS[3]) or '0'
+local out = {0}
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[1])) do
+  redis.call('ZREM', KEYS[4], id)
+  if tonumber(redis.call('HGET', KEYS[5], id) or '0') >= tonumber(ARGV[2]) then
+    table.insert(out, redis.call('HGET', KEYS[2], id))
+    redis.call('HDEL', KEYS[2], id)
+    redis.call('HDEL', KEYS[5], id)
+  else
+    redis.call('ZADD', KEYS[1], v, id)
+    out[1] = out[1] + 1
+  end
+end
+return out
+"""
+
+
+class FairScheduler:
+    """Per-queue start-time fair queuing of job specs in Redis.
+
+    `claim` hands out the fairest pending job under a lease of `claim_ttl`
+    seconds (env SCHED_CLAIM_TTL, default 120) that its worker keeps renewing;
+    `ack` forgets a finished job and `requeue_stalled` recovers lapsed claims.
+    """
+
+    def __init__(self, conn=None, claim_ttl: float = None):
+        self.conn = conn if conn is not None else get_redis()
+        self.claim_ms = int((claim_ttl or float(os.environ.get("SCHED_CLAIM_TTL", "120"))) * 1000)
+        self._submit = self.conn.register_script(SUBMIT_LUA)
+        self._claim = self.conn.register_script(CLAIM_LUA)
+        self._requeue = self.conn.register_script(REQUEUE_LUA)
+
+    def _keys(self, queue: str):
+        base = f"tgocr:sched:{queue}"
+        return [f"{base}:pending", f"{base}:specs", f"{base}:vtime", f"{base}:finish", f"{base}:seq",
+                f"{base}:processing", f"{base}:attempts"]
+
+    def _claim_keys(self, queue: str):
+        keys = self._keys(queue)
+        return keys[:3] + keys[5:]
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
+
+    def submit(self, queue: str, user_id: int, cost: float, func: str, *args, **kwargs) -> str:
+        """Add a call to `func` to the queue's fair order and return its job id."""
+        spec = codec.dumps({"func": func, "args": list(args), "kwargs": kwargs})
+        job_id = self._submit(keys=self._keys(queue), args=[spec, user_id, max(cost, 0.01)])
+        return job_id.decode() if isinstance(job_id, bytes) else job_id
+
+    def claim(self, queue: str) -> Optional[Tuple[str, dict]]:
+        """Start the pending job with the lowest start tag: (job id, spec), or None if there is none."""
+        out = self._claim(keys=self._claim_keys(queue), args=[self._now_ms() + self.claim_ms])
+        if not out:
+            return None
+        job_id, spec = out
+        return (job_id.decode() if isinstance(job_id, bytes) else job_id), codec.loads(spec)
+
+    def renew(self, queue: str, job_id: str):
+        """Extend a running job's claim."""
+        self.conn.zadd(self._keys(queue)[5], {job_id: self._now_ms() + self.claim_ms}, xx=True)
+
+    def ack(self, queue: str, job_id: str):
+        """Forget a job that ran to completion."""
+        keys = self._keys(queue)
+        pipe = self.conn.pipeline(transaction=True)
+        pipe.zrem(keys[5], job_id)
+        pipe.hdel(keys[1], job_id)
+        pipe.hdel(keys[6], job_id)
+        pipe.execute()
+
+    def fail(self, queue: str, job_id: str):
+        """Let a job's claim lapse now, so the next `requeue_stalled` retries it."""
+        self.conn.zadd(self._keys(queue)[5], {job_id: 0}, xx=True)
+
+    def requeue_stalled(self, queue: str, max_attempts: int = MAX_ATTEMPTS,
+                        on_drop: Callable[[dict], None] = None) -> int:
+        """Put jobs whose claim lapsed back in the fair order; returns how many need a new token.
+
+        Jobs that already ran `max_attempts` times are dropped instead and
+        their specs passed to `on_drop`.
+        """
+        out = self._requeue(keys=self._claim_keys(queue), args=[self._now_ms(), max_attempts])
+        for spec in out[1:]:
+            spec = codec.loads(spec)
+            logger.warning("Dropping %s on %s after %d attempts (args %s)", spec["func"], queue, max_attempts,
+                           spec["args"])
+            if on_drop is not None:
+                on_drop(spec)
+        return int(out[0])
+
+    def pending(self, queue: str) -> int:
+        return self.conn.zcard(self._keys(queue)[0])
+
+
+def _import(path: str):
+    module, _, name = path.rpartition('.')
+    return getattr(importlib.import_module(module), name)
+
+
+def run_next(queue: str):
+    """RQ entrypoint for a scheduling token: run the fairest pending job of `queue`.
+
+    The job's claim is renewed while it runs and acked when it returns; a job
+    that raises is left to `requeue_stalled`, like one whose work horse died.
+    """
+    scheduler = FairScheduler()
+    claimed = scheduler.claim(queue)
+    if claimed is None:
+        logger.info("No pending job for token on %s", queue)
+        return None
+    job_id, spec = claimed
+    try:
+        with Heartbeat(lambda: scheduler.renew(queue, job_id), scheduler.claim_ms / 3000.0):
+            result = _import(spec["func"])(*spec["args"], **spec["kwargs"])
+    except BaseException:
+        scheduler.fail(queue, job_id)
+        raise
+    scheduler.ack(queue, job_id)
+    return result
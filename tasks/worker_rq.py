@@ -1,166 +1,515 @@
+import functools
 import logging
 import os
-import tempfile
-from typing import Optional
+import time
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
-from telegram import Bot
-
-from services.ocr_service import OCRService
-from storage.cache import Cache
+from services.cascade import BLANK_PAGE, CascadePolicy
+from services.ocr_service import OCRService, ocr_page_task
+from services.page_executor import PageExecutor, PageResult
+from storage.cache import Cache, cache_key, key_file_hash
+from storage.redis_pool import get_redis
+from storage.result_store import PageStreamWriter, get_result_store, result_filename, result_key
+from storage.routing_stats import RoutingStats
+from storage.semaphore import Heartbeat, UserSemaphore
+from storage.singleflight import SingleFlight
+from tasks.delivery import get_delivery
 from utils.hashing import sha256_file
+from utils.langdet import detect_languages, needs_detection, tesseract_langs
 
 logger = logging.getLogger(__name__)
 
-BOT_TOKEN = os.environ.get("8509561542:AAEOZiF2ymGxLOo2MA-roUucB_kDq-gJjw4")
 redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 
 # Use a module-level cache instance; allow overriding in tests by setting `worker_rq.cache`.
-cache = Cache(redis_url)
+cache = Cache(conn=get_redis(redis_url))
+# Results live in a content-addressed store so any node can serve cache hits.
+result_store = get_result_store(cache.conn)
 
 
 def send_message(chat_id: int, text: str):
-    if not BOT_TOKEN:
+    delivery = get_delivery()
+    if delivery is None:
         logger.warning("Bot token not set; cannot send message")
         return
-    bot = Bot(token=BOT_TOKEN)
-    bot.send_message(chat_id=chat_id, text=text)
+    delivery.send_message(chat_id, text)
+
+
+def send_progress(chat_id: int, text: str):
+    """Update the job's single status message instead of posting a new one."""
+    delivery = get_delivery()
+    if delivery is None:
+        return
+    delivery.progress(chat_id, text)
+
+
+def send_file(chat_id: int, file_path: str, caption: Optional[str] = None, filename: Optional[str] = None):
+    """Send a file from disk; it must exist until the returned future (None if not sent) is done."""
+    delivery = get_delivery()
+    if delivery is None:
+        logger.warning("Bot token not set; cannot send file")
+        return None
+    return delivery.send_document_file(chat_id, file_path, filename or os.path.basename(file_path),
+                                       caption=caption)
 
 
-def send_file(chat_id: int, file_path: str, caption: Optional[str] = None):
-    if not BOT_TOKEN:
+def send_text(chat_id: int, text: str, filename: str, caption: Optional[str] = None):
+    """Send `text` as a .txt document straight from memory."""
+    delivery = get_delivery()
+    if delivery is None:
         logger.warning("Bot token not set; cannot send file")
         return
-    bot = Bot(token=BOT_TOKEN)
-    with open(file_path, "rb") as fh:
-        bot.send_document(chat_id=chat_id, document=fh, filename=os.path.basename(file_path), caption=caption)
+    delivery.send_document(chat_id, text.encode("utf-8"), filename, caption=caption)
 
 
-def process_file_job_rq(file_path: str, mime_type: str, chat_id: int, opts: dict):
-    """RQ worker entrypoint. Handles cache and progress updates."""
-    logger.info("RQ worker started for %s (chat=%s)", file_path, chat_id)
+def _finish_delivery(chat_id: int):
+    """Flush queued sends before the job (and possibly its RQ work horse) exits."""
+    delivery = get_delivery()
+    if delivery is None:
+        return
+    delivery.finish_progress(chat_id)
+    delivery.flush()
 
-    file_hash = sha256_file(file_path)
-    if cache.exists(file_hash):
-        payload = cache.get(file_hash)
-        send_message(chat_id, "Found cached result; sending...")
-        send_file(chat_id, payload["txt_path"], "Cached OCR result")
+
+def save_result(file_hash: str, opts: dict, text: str, conf: float, ttl: int = 24 * 3600):
+    key = result_key(file_hash, opts)
+    result_store.put(key, text, ttl=ttl)
+    cache.set(cache_key(file_hash, opts), {"result_key": key, "confidence": conf}, ttl=ttl)
+
+
+def save_result_file(file_hash: str, opts: dict, text_path: str, conf: float, ttl: int = 24 * 3600):
+    """Like `save_result` for a result already streamed to a text file."""
+    key = result_key(file_hash, opts)
+    result_store.put_file(key, text_path, ttl=ttl)
+    cache.set(cache_key(file_hash, opts), {"result_key": key, "confidence": conf}, ttl=ttl)
+
+
+def deliver_result_file(chat_id: int, file_hash: str, opts: dict, text_path: str, conf: float,
+                        store: bool = True):
+    """Upload a finished result file and, if `store`, cache it; returns the upload's future, as `send_file`."""
+    sent = send_file(chat_id, text_path, caption="Full extracted text", filename=result_filename(file_hash))
+    if store:
+        save_result_file(file_hash, opts, text_path, conf)
+    return sent
+
+
+def discard_when_sent(writer: PageStreamWriter, sent=None):
+    """Wait for a streamed result file's upload to settle, then remove the file.
+
+    The RQ work horse exits as soon as the job returns, taking still-queued
+    sends with it, so this blocks, for longer while Telegram's flood control
+    holds the upload back.
+    """
+    delivery = get_delivery()
+    if sent is not None and delivery is not None and not delivery.wait(sent):
+        logger.warning("Result upload still pending as the job ends; it will be dropped")
+    writer.discard()
+
+
+def send_cached_result(chat_id: int, file_hash: str, payload: dict) -> bool:
+    """Deliver a cached result from the result store; False if the entry is gone."""
+    text = result_store.get(payload.get("result_key", "")) if payload else None
+    if text is None:
+        return False
+    send_text(chat_id, text, result_filename(file_hash), caption="Cached OCR result")
+    return True
+
+
+def _cloud_adapter(opts: dict):
+    """The worker's shared Vision adapter when cloud OCR is requested and configured."""
+    if not opts.get('cloud_ocr'):
+        return None
+    try:
+        from services.google_vision import shared_adapter
+        adapter = shared_adapter()
+    except Exception as e:
+        logger.warning("Google Vision unavailable: %s", e)
+        return None
+    return adapter if adapter.available else None
+
+
+# Pages of each document whose script is detected one by one; later pages
+# are read with the models found on any detected page of the document.
+LANGDET_SAMPLE = 3
+LANGDET_TTL = 24 * 3600
+# A page read with only the sampled models is read again with every requested
+# model when Tesseract is less confident than this (its script may be unsampled).
+LANGDET_RECHECK_CONF = 60.0
+
+
+def _langdet_key(doc_key: Optional[str], langs) -> Optional[str]:
+    return f"tgocr:langdet:{doc_key}:{'+'.join(sorted(tesseract_langs(langs)))}" if doc_key else None
+
+
+def _sampling(key: Optional[str], page_num: int) -> bool:
+    """Whether a page still belongs to its document's sample: it was detected before, or fewer
+    than `LANGDET_SAMPLE` pages were (by any job of the document)."""
+    if not key:
+        return True
+    pipe = cache.conn.pipeline(transaction=False)
+    pipe.hexists(key, page_num)
+    pipe.hlen(key)
+    recorded, sampled = pipe.execute()
+    return bool(recorded) or sampled < LANGDET_SAMPLE
+
+
+def _page_langs(ocr, key: Optional[str], page_num: int, image, langs) -> Optional[List[str]]:
+    """Tesseract models one page needs: detected on the page and recorded in the document's Redis hash."""
+    cached = cache.conn.hget(key, page_num) if key else None
+    if cached:
+        return (cached.decode() if isinstance(cached, bytes) else cached).split('+')
+
+    def recognize(img, models):
+        return ocr.tesseract.ocr(img, langs=models)[0]
+
+    detected = detect_languages(image, langs, recognize=recognize)
+    if detected and key:
+        pipe = cache.conn.pipeline(transaction=False)
+        pipe.hset(key, page_num, '+'.join(detected))
+        pipe.expire(key, LANGDET_TTL)
+        pipe.execute()
+    return detected
+
+
+def _document_langs(key: Optional[str], langs, found) -> List[str]:
+    """Requested models any detected page of the document needs (all of them if none was detected)."""
+    found = set(found)
+    for value in (cache.conn.hvals(key) if key else []):
+        found.update((value.decode() if isinstance(value, bytes) else value).split('+'))
+    candidates = tesseract_langs(langs)
+    return [lang for lang in candidates if lang in found] or candidates
+
+
+def _timed_page(ocr_fn, page) -> Tuple[str, float, float]:
+    """OCR one (image, langs, recheck langs) page with `ocr_fn`, returning (text, conf, seconds).
+
+    A low-confidence read is repeated with the recheck models, if any, and
+    the more confident result kept.
+    """
+    image, langs, recheck = page
+    start = time.perf_counter()
+    text, conf = ocr_fn(image, langs=langs)
+    if recheck and conf != BLANK_PAGE and conf < LANGDET_RECHECK_CONF:
+        again = ocr_fn(image, langs=recheck)
+        if again[1] > conf:
+            text, conf = again
+    return text, conf, time.perf_counter() - start
+
+
+def _ocr_pages(ocr, opts: dict, pages: Iterable[Tuple[int, Any]], doc_key: str = None) -> Iterator[PageResult]:
+    """OCR (page number, image) pairs and yield `PageResult`s of (text, conf) in page order.
+
+    When the requested languages span several scripts, the script of each
+    page is detected until `LANGDET_SAMPLE` pages of the document have been
+    (recorded per page under `doc_key`, so chunks and retries of one document
+    share one sample); the rest are read with the union of the models those
+    pages needed, so Tesseract only loads models the document uses. A page
+    read that way with low confidence is read again with every requested
+    model, so a script the sample missed is not lost.
+
+    Pages go to the `PageExecutor` as picklable (image, langs, recheck langs)
+    payloads; in process mode each page process reads them with its own
+    `OCRService`.
+
+    Tesseract reads every page first. With cloud OCR, pages the
+    `CascadePolicy` escalates are encoded in memory and re-read by Vision in
+    batches, and Vision's text replaces Tesseract's where it found any.
+    Confidences are 0-100 for both engines (`BLANK_PAGE` for a page Tesseract
+    skipped as blank). Each page's route and engine time go to `RoutingStats`.
+    """
+    langs = opts.get('langs')
+    adapter = _cloud_adapter(opts)
+    policy = CascadePolicy()
+    stats = RoutingStats(cache.conn)
+    held = {}   # page number -> image, kept until the page is known not to need the cloud
+    page_models = {}   # page number -> Tesseract models it is read with
+    detect = needs_detection(langs)
+    key = _langdet_key(doc_key, langs) if detect else None
+
+    def source():
+        candidates = tesseract_langs(langs)
+        found, models = set(), None if detect else candidates
+        for i, (n, image) in enumerate(pages):
+            if models is not None:
+                page_models[n] = models
+            elif i < LANGDET_SAMPLE and _sampling(key, n):
+                detected = _page_langs(ocr, key, n, image, langs)
+                found.update(detected or [])
+                page_models[n] = detected or candidates
+            else:
+                models = page_models[n] = _document_langs(key, langs, found)
+            if adapter is not None:
+                held[n] = image
+            recheck = candidates if detect and models is not None and models != candidates else None
+            yield n, (image, page_models[n] or langs, recheck)
+
+    def settle(batch):
+        escalated = [r.page_num for r, _, escalate in batch if escalate]
+        replies, cloud_s = {}, 0.0
+        if escalated:
+            from services.google_vision import encode_image
+            start = time.perf_counter()
+            results = adapter.ocr_batch([encode_image(held.pop(n)) for n in escalated], languages=langs)
+            cloud_s = (time.perf_counter() - start) / len(escalated)
+            replies = dict(zip(escalated, results))
+        for r, local_s, escalate in batch:
+            local_conf = r.value[1] if r.error is None and r.value[1] != BLANK_PAGE else None
+            reply = replies.get(r.page_num)
+            if reply is not None and not reply.error and reply.text:
+                stats.record("cloud", local_conf, local_s, cloud_s)
+                yield PageResult(r.page_num, (reply.text, reply.confidence * 100), None)
+            else:
+                route = "cloud_failed" if escalate else "local"
+                stats.record(route, local_conf, local_s, cloud_s if escalate else 0.0)
+                yield r
+
+    executor = PageExecutor()
+    tesseract = functools.partial(_timed_page, ocr_page_task if executor.use_processes else ocr.ocr_image)
+    batch, waiting = [], 0
+    try:
+        for r in executor.map(tesseract, source()):
+            conf, local_s = None, 0.0
+            if r.error is None:
+                text, conf, local_s = r.value
+                r = PageResult(r.page_num, (text, conf), None)
+            escalate = adapter is not None and policy.escalate(conf, page_models.pop(r.page_num, None) or langs)
+            if not escalate:
+                held.pop(r.page_num, None)
+            batch.append((r, local_s, escalate))
+            waiting += escalate
+            # Confident pages pass straight through unless they are queued behind
+            # an escalated page still waiting for its Vision batch to fill.
+            if not waiting or waiting >= adapter.batch_size:
+                yield from settle(batch)
+                batch, waiting = [], 0
+        yield from settle(batch)
+    finally:
+        stats.flush()
+
+
+def _process_pdf(ocr, doc, file_path: str, file_hash: str, chat_id: int, opts: dict, progress_callback,
+                 flight_token: str = None, slot_token: str = None) -> bool:
+    """OCR an already-open PDF document and deliver the result.
+
+    Returns True when the document was split into chunk jobs, which then own
+    delivery and the job's leases.
+    """
+    pdf = ocr.pdf
+    layout = pdf.analyze(doc)
+    if layout.kind == "text":
+        text = "\n".join(f"--- Page {i} ---\n" + t for i, t in enumerate(layout.page_texts, start=1))
+        save_result(file_hash, opts, text, 100.0)
+        send_message(chat_id, "Extracted selectable text from PDF.")
+        send_text(chat_id, text, result_filename(file_hash), caption="Full extracted text")
+        return False
+
+    if len(layout.scanned_pages) > int(os.environ.get("PDF_CHUNK_PAGES", "20")):
+        from tasks.pdf_jobs import start_chunked
+        start_chunked(file_path, file_hash, chat_id, opts, layout, flight_token=flight_token,
+                      slot_token=slot_token)
+        send_message(chat_id, f"Large PDF: OCR-ing {len(layout.scanned_pages)} pages in parallel.")
+        return True
+
+    # Scanned or mixed PDF: keep the text layer where present and OCR only
+    # the pages without one, rendered lazily on a bounded page pool. Pages are
+    # streamed to a file in order as they finish instead of kept in memory.
+    total_pages = len(layout.page_texts)
+    if layout.kind == "mixed":
+        send_message(chat_id, f"PDF has a text layer on {total_pages - len(layout.scanned_pages)} of {total_pages} pages; OCR-ing the rest.")
+
+    writer = PageStreamWriter(total_pages)
+    sent = None
+    try:
+        for i, text in enumerate(layout.page_texts, start=1):
+            if text is not None:
+                writer.add(i, text)
+        partial_every = 5
+        sent_partial = 0
+        for result in _ocr_pages(ocr, opts, pdf.render_pages(doc, layout.scanned_pages), doc_key=file_hash):
+            page_idx = result.page_num
+            progress_callback(page_idx, total_pages)
+            if result.error is not None:
+                txt = f"[OCR failed for this page: {result.error}]"
+            else:
+                txt = result.value[0]
+            writer.add(page_idx, txt)
+
+            # send partial, read back from the stream
+            if writer.last_page - sent_partial >= partial_every:
+                summary = writer.read(sent_partial + 1, writer.last_page, limit=300)
+                send_message(chat_id, f"Partial result pages {sent_partial+1}-{writer.last_page}:\n{summary}")
+                sent_partial = writer.last_page
+
+        writer.close()
+        send_message(chat_id, "Done processing PDF.")
+        sent = deliver_result_file(chat_id, file_hash, opts, writer.path, 0.0)
+    finally:
+        _finish_delivery(chat_id)
+        discard_when_sent(writer, sent)
+    return False
+
+
+def _flight() -> SingleFlight:
+    return SingleFlight(conn=cache.conn)
+
+
+def _settle_flight(file_hash: str, opts: dict, flight_token: Optional[str]):
+    """Release the job's single-flight lease and send the result to uploads that subscribed to it."""
+    if not flight_token:
+        return
+    key = cache_key(file_hash, opts)
+    try:
+        subscribers = _flight().release(key, flight_token)
+    except Exception as e:
+        logger.warning("Failed to release single-flight lease for %s: %s", key, e)
+        return
+    _notify_subscribers(key, file_hash, subscribers)
+
+
+def _notify_subscribers(key: str, file_hash: str, subscribers: List[int]):
+    """Send the cached result for `key` to each subscriber, or tell them it failed."""
+    if not subscribers:
+        return
+    payload = cache.get(key)
+    for sub in subscribers:
+        if not (payload and send_cached_result(sub, file_hash, payload)):
+            send_message(sub, "Sorry, processing this file failed. Please send it again.")
+    for sub in set(subscribers):
+        _finish_delivery(sub)
+
+
+def _semaphore() -> UserSemaphore:
+    return UserSemaphore(conn=cache.conn)
+
+
+def _enqueue_promoted(promoted):
+    """Enqueue parked jobs that were handed a concurrency slot."""
+    if not promoted:
         return
+    from tasks.queue_manager import enqueue_ocr_job
+    for spec, token in promoted:
+        enqueue_ocr_job(spec["file_path"], spec["mime_type"], spec["chat_id"], spec["opts"],
+                        file_hash=spec["file_hash"], flight_token=spec["flight_token"], slot_token=token)
 
-    # Check running jobs for this user
-    running_key = f"tgocr:running:{chat_id}"
-    running = cache.conn.incr(running_key)
-    if running == 1:
-        cache.conn.expire(running_key, 3600)  # safety TTL
 
+def _release_job(chat_id: int, file_hash: str, opts: dict, flight_token: Optional[str], slot_token: str):
+    """Free the job's concurrency slot and settle its single-flight subscribers."""
     try:
-        max_concurrent = int(os.environ.get("MAX_CONCURRENT_JOBS", 3))
-        if running > max_concurrent:
-            send_message(chat_id, f"Too many concurrent jobs (>{max_concurrent}). Requeued in 60s.")
-            # requeue in 60s
-            from tasks.queue_manager import q
-            q.enqueue_in(60, 'tasks.worker_rq.process_file_job_rq', file_path, mime_type, chat_id, opts)
+        if slot_token:
+            _enqueue_promoted(_semaphore().release(chat_id, slot_token))
+    except Exception as e:
+        logger.warning("Failed to release concurrency slot for chat %s: %s", chat_id, e)
+    _settle_flight(file_hash, opts, flight_token)
+
+
+def reap_flights():
+    """Periodic job (see tasks.cron): answer uploads that subscribed to a job that died without releasing."""
+    for key, subscribers in _flight().reap():
+        logger.info("Single-flight leader for %s vanished; answering %d subscriber(s)", key, len(subscribers))
+        _notify_subscribers(key, key_file_hash(key), subscribers)
+
+
+def reap_job_slots():
+    """Periodic job (see tasks.cron): keep the slots of queued jobs, free expired slot leases and start
+    parked jobs that now fit.
+
+    No worker heartbeats a parked or queued job yet, so its single-flight lease is renewed here too.
+    """
+    semaphore = _semaphore()
+    for chat_id, promoted in semaphore.reap():
+        logger.info("Promoting %d parked job(s) for chat %s", len(promoted), chat_id)
+        _enqueue_promoted(promoted)
+    flight = _flight()
+    for spec in semaphore.waiting():
+        if spec.get("flight_token"):
+            flight.renew(cache_key(spec["file_hash"], spec["opts"]), spec["flight_token"])
+
+
+def process_file_job_rq(file_path: str, mime_type: str, chat_id: int, opts: dict, file_hash: str = None,
+                        flight_token: str = None, slot_token: str = None):
+    """RQ worker entrypoint. Handles cache and progress updates.
+
+    `file_hash` is the content hash computed by the handler while downloading;
+    it is only recomputed when missing. `flight_token` is the single-flight
+    lease taken by the handler: it is renewed while the job runs and released
+    when the job ends, delivering the result to every subscriber.
+
+    Each user may run MAX_CONCURRENT_JOBS jobs at once. A job over the limit
+    is parked in the user's pending list and re-enqueued with `slot_token`
+    (a slot already reserved for it) as soon as one of their jobs finishes.
+    """
+    logger.info("RQ worker started for %s (chat=%s)", file_path, chat_id)
+
+    file_hash = file_hash or sha256_file(file_path)
+    payload = cache.get(cache_key(file_hash, opts))
+    if payload and result_store.exists(payload.get("result_key", "")):
+        send_message(chat_id, "Found cached result; sending...")
+        if send_cached_result(chat_id, file_hash, payload):
+            # a promoted job already holds a slot; free it for the user's next parked job
+            _release_job(chat_id, file_hash, opts, flight_token, slot_token)
             return
 
-        send_message(chat_id, "Starting OCR processing...")
+    # Admission: hold one of the user's concurrency slots for the whole job
+    semaphore = _semaphore()
+    if not (slot_token and semaphore.heartbeat(chat_id, slot_token)):
+        spec = {"file_path": file_path, "mime_type": mime_type, "chat_id": chat_id, "opts": opts,
+                "file_hash": file_hash, "flight_token": flight_token}
+        slot_token, promoted = semaphore.acquire(chat_id, spec)
+        _enqueue_promoted(promoted)
+        if slot_token is None:
+            if flight_token:
+                _flight().renew(cache_key(file_hash, opts), flight_token)
+            send_message(chat_id, f"You already have {semaphore.limit} files processing; "
+                                  "this one will start as soon as one of them finishes.")
+            return
+
+    def beat():
+        semaphore.heartbeat(chat_id, slot_token)
+        if flight_token:
+            _flight().renew(cache_key(file_hash, opts), flight_token)
+
+    heartbeat = Heartbeat(beat, semaphore.lease_ms / 3000.0)
+    heartbeat.start()
+    handed_off = False
+    try:
+        send_progress(chat_id, "Starting OCR processing...")
 
         ocr = OCRService()
 
         def progress_callback(page_idx, total_pages):
             try:
-                send_message(chat_id, f"Processing page {page_idx}/{total_pages or '?'}...")
+                send_progress(chat_id, f"Processing page {page_idx}/{total_pages or '?'}...")
             except Exception:
                 pass
 
         if mime_type == "application/pdf" or file_path.lower().endswith('.pdf'):
-            # PDF flow
-            pdf = ocr.pdf
-            if pdf.has_text_layer(file_path):
-                text = pdf.extract_text_layer(file_path)
-                conf = 100.0
-                # write and send
-                out_path = os.path.join(tempfile.gettempdir(), f"ocr_result_{file_hash}.txt")
-                with open(out_path, 'w', encoding='utf-8') as fh:
-                    fh.write(text)
-                cache.set(file_hash, {"txt_path": out_path, "confidence": conf}, ttl=24 * 3600)
-                send_message(chat_id, "Extracted selectable text from PDF.")
-                send_file(chat_id, out_path, caption="Full extracted text")
-                return
-
-            # Scanned PDF: render per page and OCR
-            page_texts = []
-            partial_every = 5
-            total_pages = len(list(pdf.render_all_pages(file_path)))
-            sent_partial = 0
-            for page_idx, image in pdf.render_all_pages(file_path):
-                progress_callback(page_idx, total_pages)
-                # Try cloud OCR first if enabled
-                txt = None
-                conf = 0.0
-                if opts.get('cloud_ocr'):
-                    try:
-                        from services.google_vision import GoogleVisionAdapter
-                        gv = GoogleVisionAdapter()
-                        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tf:
-                            image.save(tf.name)
-                            with open(tf.name, 'rb') as fh:
-                                img_bytes = fh.read()
-                        txt, conf = gv.ocr(img_bytes, languages=opts.get('langs'))
-                    except Exception:
-                        txt = None
-                if not txt:
-                    t, conf = ocr.ocr_image(image, langs=opts.get('langs'))
-                    txt = t
-                page_texts.append(f"--- Page {page_idx} ---\n" + txt)
-
-                # send partial
-                if page_idx % partial_every == 0:
-                    partial_text = "\n".join(page_texts[sent_partial:page_idx])
-                    summary = partial_text[:300]
-                    send_message(chat_id, f"Partial result pages {sent_partial+1}-{page_idx}:\n{summary}")
-                    sent_partial = page_idx
-
-            full_text = "\n".join(page_texts)
-            out_path = os.path.join(tempfile.gettempdir(), f"ocr_result_{file_hash}.txt")
-            with open(out_path, 'w', encoding='utf-8') as fh:
-                fh.write(full_text)
-            cache.set(file_hash, {"txt_path": out_path, "confidence": 0.0}, ttl=24 * 3600)
-            send_message(chat_id, "Done processing PDF.")
-            send_file(chat_id, out_path, caption="Full extracted text")
+            # PDF flow: open the document once and reuse it for the whole job
+            doc = ocr.pdf.open_document(file_path)
+            try:
+                handed_off = _process_pdf(ocr, doc, file_path, file_hash, chat_id, opts, progress_callback,
+                                          flight_token=flight_token, slot_token=slot_token)
+            finally:
+                doc.close()
 
         else:
-            from PIL import Image   # pyright: ignore[reportMissingImports]
-            img = Image.open(file_path)
-            # Try cloud first
-            txt = None
-            conf = 0.0
-            if opts.get('cloud_ocr'):
-                try:
-                    from services.google_vision import GoogleVisionAdapter
-                    gv = GoogleVisionAdapter()
-                    with open(file_path, 'rb') as fh:
-                        bytes_data = fh.read()
-                    txt, conf = gv.ocr(bytes_data, languages=opts.get('langs'))
-                except Exception:
-                    txt = None
-            if not txt:
-                txt, conf = ocr.ocr_image(img, langs=opts.get('langs'))
-
-            out_path = os.path.join(tempfile.gettempdir(), f"ocr_result_{file_hash}.txt")
-            with open(out_path, 'w', encoding='utf-8') as fh:
-                fh.write(txt)
-            cache.set(file_hash, {"txt_path": out_path, "confidence": conf}, ttl=24 * 3600)
+            from services.preprocess import open_for_ocr
+            [result] = list(_ocr_pages(ocr, opts, [(1, open_for_ocr(file_path))], doc_key=file_hash))
+            if result.error is not None:
+                raise result.error
+            txt, conf = result.value
+
+            save_result(file_hash, opts, txt, conf)
             summary = txt[:400].strip()
             send_message(chat_id, f"Done. Summary:\n{summary}")
-            send_file(chat_id, out_path, caption="Full extracted text")
+            send_text(chat_id, txt, result_filename(file_hash), caption="Full extracted text")
     except Exception as e:
         logger.exception("Error in RQ job: %s", e)
         send_message(chat_id, "Error processing file: %s" % str(e))
     finally:
-        try:
-            # decrement running counter
-            cache.conn.decr(running_key)
-        except Exception:
-            pass
+        heartbeat.stop()
+        if not handed_off:
+            _release_job(chat_id, file_hash, opts, flight_token, slot_token)
+        _finish_delivery(chat_id)
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
@@ -1,23 +1,43 @@
+import multiprocessing
 import os
 import tempfile
+import time
 from pathlib import Path
 
 import fakeredis # pyright: ignore[reportMissingImports]
+import pytest
 import redis # pyright: ignore[reportMissingImports]
 
+from services import ocr_service
 from tasks import worker_rq
-from storage.cache import Cache
+from services.pdf_service import PDFLayout
+from storage.cache import Cache, cache_key
+from storage.result_store import RedisResultStore
 from utils.hashing import sha256_file
 
 
+class FakeDoc:
+    def close(self):
+        pass
+
+
+class PageProcessOCR:
+    """OCR backend page processes build through `ocr_page_task` (inherited by fork)."""
+
+    def ocr_image(self, image, langs=None):
+        return (f"page process text {os.getpid()} {'+'.join(langs)}", 90.0)
+
+
 def test_process_image_job(monkeypatch):
     # Use fake redis for cache and queue
     fake = fakeredis.FakeStrictRedis()
 
     # Use injected fake redis for Cache
     cache = Cache(conn=fake)
-    # Ensure worker uses our fake cache
+    # Ensure worker uses our fake cache and result store
     worker_rq.cache = cache
+    store = RedisResultStore(fake)
+    worker_rq.result_store = store
 
     # Monkeypatch send_message and send_file to capture calls
     messages = []
@@ -26,21 +46,24 @@ def test_process_image_job(monkeypatch):
     def fake_send_message(chat_id, text):
         messages.append((chat_id, text))
 
-    def fake_send_file(chat_id, file_path, caption=None):
-        files_sent.append((chat_id, file_path, caption))
+    def fake_send_text(chat_id, text, filename, caption=None):
+        files_sent.append((chat_id, text, caption))
 
     monkeypatch.setattr(worker_rq, 'send_message', fake_send_message)
-    monkeypatch.setattr(worker_rq, 'send_file', fake_send_file)
+    monkeypatch.setattr(worker_rq, 'send_text', fake_send_text)
 
     # Fake OCR backend to avoid requiring tesseract and external services
     class FakePDF:
-        def has_text_layer(self, path):
-            return False
+        def open_document(self, path):
+            return FakeDoc()
+
+        def page_count(self, doc):
+            return 1
 
-        def extract_text_layer(self, path):
-            return ""
+        def analyze(self, doc):
+            return PDFLayout(kind="scanned", page_kinds=["scanned"], page_texts=[None])
 
-        def render_all_pages(self, path):
+        def render_pages(self, doc, page_numbers):
             from PIL import Image    # pyright: ignore[reportMissingImports]
             img = Image.open('input.jpg')
             yield (1, img)
@@ -63,26 +86,57 @@ def test_process_image_job(monkeypatch):
         w.write(r.read())
 
     # Ensure cache empty
-    file_hash = sha256_file(tmpfile)
-    assert not cache.exists(file_hash)
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    key = cache_key(sha256_file(tmpfile), opts)
+    assert not cache.exists(key)
 
     # Run worker job (cloud_ocr disabled to avoid external calls)
-    worker_rq.process_file_job_rq(tmpfile, 'image/jpeg', 9999, {'cloud_ocr': False, 'langs': ['eng']})
-
-    # After processing, cache should exist
-    assert cache.exists(file_hash)
-    payload = cache.get(file_hash)
-    assert 'txt_path' in payload
-    txt_path = payload['txt_path']
-    assert os.path.exists(txt_path)
-    with open(txt_path, 'r', encoding='utf-8') as fh:
-        content = fh.read()
-    assert len(content) > 0
+    worker_rq.process_file_job_rq(tmpfile, 'image/jpeg', 9999, opts)
+
+    # After processing, cache should exist, but only for these options
+    assert cache.exists(key)
+    assert not cache.exists(cache_key(sha256_file(str(src)), {'cloud_ocr': False, 'langs': ['rus']}))
+    payload = cache.get(key)
+    assert 'result_key' in payload
+    content = store.get(payload['result_key'])
+    assert content == "dummy OCR text"
 
     # Messages should include a Done summary
     assert any('Done.' in m[1] for m in messages)
-    # File should have been sent
-    assert any(f[1] == txt_path for f in files_sent)
+    # Result text should have been sent
+    assert any(f[1] == content for f in files_sent)
+
+
+def test_job_delivers_result_to_single_flight_subscribers(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+    files_sent = []
+    monkeypatch.setattr(worker_rq, 'send_message', lambda chat_id, text: None)
+    monkeypatch.setattr(worker_rq, 'send_text',
+                        lambda chat_id, text, filename, caption=None: files_sent.append((chat_id, text)))
+
+    class FakeOCR:
+        def ocr_image(self, image, langs=None):
+            return ("shared OCR text", 0.9)
+
+    monkeypatch.setattr(worker_rq, 'OCRService', lambda: FakeOCR())
+
+    tmpfile = os.path.join(tempfile.mkdtemp(), 'viral.jpg')
+    with open('input.jpg', 'rb') as r, open(tmpfile, 'wb') as w:
+        w.write(r.read())
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    file_hash = sha256_file(tmpfile)
+    flight = worker_rq._flight()
+    token = flight.acquire(cache_key(file_hash, opts), 1)
+    assert flight.acquire(cache_key(file_hash, opts), 2) is None
+    assert flight.acquire(cache_key(file_hash, opts), 3) is None
+
+    worker_rq.process_file_job_rq(tmpfile, 'image/jpeg', 1, opts, file_hash=file_hash, flight_token=token)
+
+    assert sorted(chat for chat, _ in files_sent) == [1, 2, 3]
+    assert all(text == "shared OCR text" for _, text in files_sent)
+    assert flight.acquire(cache_key(file_hash, opts), 4)  # lease released
 
 
 def test_process_pdf_job(monkeypatch):
@@ -90,8 +144,10 @@ def test_process_pdf_job(monkeypatch):
     fake = fakeredis.FakeStrictRedis()
 
     cache = Cache(conn=fake)
-    # Ensure worker uses our fake cache
+    # Ensure worker uses our fake cache and result store
     worker_rq.cache = cache
+    store = RedisResultStore(fake)
+    worker_rq.result_store = store
 
     messages = []
     files_sent = []
@@ -99,21 +155,24 @@ def test_process_pdf_job(monkeypatch):
     def fake_send_message(chat_id, text):
         messages.append((chat_id, text))
 
-    def fake_send_file(chat_id, file_path, caption=None):
-        files_sent.append((chat_id, file_path, caption))
+    def fake_send_text(chat_id, text, filename, caption=None):
+        files_sent.append((chat_id, text, caption))
 
     monkeypatch.setattr(worker_rq, 'send_message', fake_send_message)
-    monkeypatch.setattr(worker_rq, 'send_file', fake_send_file)
+    monkeypatch.setattr(worker_rq, 'send_text', fake_send_text)
 
     # Fake OCR backend to avoid requiring tesseract and external services
     class FakePDF:
-        def has_text_layer(self, path):
-            return False
+        def open_document(self, path):
+            return FakeDoc()
+
+        def page_count(self, doc):
+            return 1
 
-        def extract_text_layer(self, path):
-            return ""
+        def analyze(self, doc):
+            return PDFLayout(kind="scanned", page_kinds=["scanned"], page_texts=[None])
 
-        def render_all_pages(self, path):
+        def render_pages(self, doc, page_numbers):
             from PIL import Image   # pyright: ignore[reportMissingImports]
             img = Image.open('input.jpg')
             yield (1, img)
@@ -136,16 +195,247 @@ def test_process_pdf_job(monkeypatch):
     img = Image.open(src)
     img.save(pdf_path, 'PDF')
 
-    file_hash = sha256_file(pdf_path)
-    assert not cache.exists(file_hash)
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    key = cache_key(sha256_file(pdf_path), opts)
+    assert not cache.exists(key)
 
-    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 8888, {'cloud_ocr': False, 'langs': ['eng']})
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 8888, opts)
 
-    assert cache.exists(file_hash)
-    payload = cache.get(file_hash)
-    txt_path = payload['txt_path']
-    assert os.path.exists(txt_path)
-    with open(txt_path, 'r', encoding='utf-8') as fh:
-        content = fh.read()
-    assert len(content) > 0
+    assert cache.exists(key)
+    payload = cache.get(key)
+    content = store.get(payload['result_key'])
+    assert content is not None and "dummy OCR text" in content
     assert any('Done' in m[1] or 'Extracted' in m[1] for m in messages)
+
+
+def test_job_over_user_limit_waits_for_a_free_slot(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+    monkeypatch.setenv('MAX_CONCURRENT_JOBS', '1')
+    messages = []
+    files_sent = []
+    monkeypatch.setattr(worker_rq, 'send_message', lambda chat_id, text: messages.append(text))
+    monkeypatch.setattr(worker_rq, 'send_text',
+                        lambda chat_id, text, filename, caption=None: files_sent.append(text))
+
+    class FakeOCR:
+        def ocr_image(self, image, langs=None):
+            return ("queued OCR text", 0.9)
+
+    monkeypatch.setattr(worker_rq, 'OCRService', lambda: FakeOCR())
+
+    tmpfile = os.path.join(tempfile.mkdtemp(), 'later.jpg')
+    with open('input.jpg', 'rb') as r, open(tmpfile, 'wb') as w:
+        w.write(r.read())
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    sem = worker_rq._semaphore()
+    running, _ = sem.acquire(77, {"job": "already running"})
+
+    worker_rq.process_file_job_rq(tmpfile, 'image/jpeg', 77, opts)
+    assert "start as soon as" in messages[-1]
+    assert os.path.exists(tmpfile) and not files_sent
+
+    enqueued = []
+    import tasks.queue_manager as qm
+    monkeypatch.setattr(qm, 'enqueue_ocr_job', lambda *a, **kw: enqueued.append((a, kw)))
+    worker_rq._enqueue_promoted(sem.release(77, running))
+    (args, kwargs), = enqueued
+    assert kwargs['slot_token']
+
+    worker_rq.process_file_job_rq(*args, **kwargs)
+    assert files_sent == ["queued OCR text"]
+    # the slot was released when the job finished
+    assert sem.acquire(77, {"job": "next"})[0]
+
+
+
+def test_promoted_job_served_from_cache_releases_its_slot(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+    monkeypatch.setenv('MAX_CONCURRENT_JOBS', '1')
+    files_sent = []
+    monkeypatch.setattr(worker_rq, 'send_message', lambda chat_id, text: None)
+    monkeypatch.setattr(worker_rq, 'send_text',
+                        lambda chat_id, text, filename, caption=None: files_sent.append(text))
+    enqueued = []
+    import tasks.queue_manager as qm
+    monkeypatch.setattr(qm, 'enqueue_ocr_job', lambda *a, **kw: enqueued.append((a, kw)))
+
+    tmpfile = os.path.join(tempfile.mkdtemp(), 'cached.jpg')
+    with open('input.jpg', 'rb') as r, open(tmpfile, 'wb') as w:
+        w.write(r.read())
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    file_hash = sha256_file(tmpfile)
+    worker_rq.save_result(file_hash, opts, "cached OCR text", 90.0)
+
+    sem = worker_rq._semaphore()
+    token, _ = sem.acquire(78, {"job": "promoted"})
+    parked = {"file_path": "/tmp/parked.jpg", "mime_type": "image/jpeg", "chat_id": 78, "opts": opts,
+              "file_hash": "h", "flight_token": None}
+    assert sem.acquire(78, parked)[0] is None
+
+    worker_rq.process_file_job_rq(tmpfile, 'image/jpeg', 78, opts, file_hash=file_hash, slot_token=token)
+
+    assert files_sent == ["cached OCR text"]
+    # the cache hit freed the slot, which went to the parked job
+    [(args, kwargs)] = enqueued
+    assert args[0] == "/tmp/parked.jpg"
+    assert not sem.heartbeat(78, token) and sem.heartbeat(78, kwargs['slot_token'])
+
+
+def test_reaper_starts_parked_jobs_after_a_crashed_job(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setenv('MAX_CONCURRENT_JOBS', '1')
+    monkeypatch.setenv('JOB_SLOT_TTL', '0.1')
+    enqueued = []
+    import tasks.queue_manager as qm
+    monkeypatch.setattr(qm, 'enqueue_ocr_job', lambda *a, **kw: enqueued.append((a, kw)))
+    sem = worker_rq._semaphore()
+    sem.acquire(79, {"job": "crashed"})
+    spec = {"file_path": "/tmp/x.jpg", "mime_type": "image/jpeg", "chat_id": 79, "opts": {},
+            "file_hash": "h", "flight_token": None}
+    assert sem.acquire(79, spec)[0] is None
+
+    worker_rq.reap_job_slots()
+    assert not enqueued
+    time.sleep(0.15)
+    worker_rq.reap_job_slots()
+    [(args, kwargs)] = enqueued
+    assert args[0] == "/tmp/x.jpg" and kwargs['slot_token']
+
+
+def test_reaper_renews_flight_leases_of_waiting_jobs(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setenv('MAX_CONCURRENT_JOBS', '1')
+    monkeypatch.setenv('FLIGHT_LEASE_TTL', '0.2')
+    sem = worker_rq._semaphore()
+    flight = worker_rq._flight()
+    sem.acquire(80, {"job": "running"})
+    key = cache_key("h", {})
+    token = flight.acquire(key, 80)
+    spec = {"file_path": "/tmp/x.jpg", "mime_type": "image/jpeg", "chat_id": 80, "opts": {},
+            "file_hash": "h", "flight_token": token}
+    assert sem.acquire(80, spec)[0] is None
+
+    for _ in range(3):
+        time.sleep(0.1)
+        worker_rq.reap_job_slots()
+    # the parked job still leads its flight, so the flight reaper leaves it alone
+    assert worker_rq._flight().reap() == []
+    assert flight.renew(key, token)
+
+
+def test_job_waits_for_its_result_upload_past_a_flush_timeout(monkeypatch):
+    from concurrent.futures import Future
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+
+    class StuckDelivery:
+        """The upload is still queued (e.g. behind a 429) when the job's flush times out."""
+        def __init__(self):
+            self.sends = []
+
+        def send_message(self, chat_id, text):
+            pass
+
+        def progress(self, chat_id, text):
+            pass
+
+        def send_document_file(self, chat_id, path, filename, caption=None):
+            future = Future()
+            self.sends.append((path, future))
+            return future
+
+        def finish_progress(self, chat_id):
+            pass
+
+        def flush(self, timeout=30.0):
+            pass
+
+        def wait(self, future, timeout=30.0):
+            # the upload goes through after the 429 while the job waits for it
+            [(path, sent)] = self.sends
+            assert sent is future and os.path.exists(path)
+            with open(path, encoding='utf-8') as fh:
+                self.uploaded = fh.read()
+            future.set_result(None)
+            return True
+
+    delivery = StuckDelivery()
+    monkeypatch.setattr(worker_rq, 'get_delivery', lambda: delivery)
+
+    class FakeOCR:
+        def __init__(self):
+            from services.pdf_service import PDFService
+            self.pdf = PDFService(render_dpi=20)
+
+        def ocr_image(self, image, langs=None):
+            return ("queued upload text", 90.0)
+
+    monkeypatch.setattr(worker_rq, 'OCRService', FakeOCR)
+    from PIL import Image    # pyright: ignore[reportMissingImports]
+    pdf_path = os.path.join(tempfile.mkdtemp(), 'slow.pdf')
+    Image.new('RGB', (120, 160), 'white').save(pdf_path, 'PDF')
+
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 6, {'cloud_ocr': False, 'langs': ['eng']})
+
+    [(path, future)] = delivery.sends
+    assert future.done() and "queued upload text" in delivery.uploaded
+    assert not os.path.exists(path)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="page processes must inherit the fake OCR")
+def test_image_job_with_process_page_executor(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+    files_sent = []
+    monkeypatch.setattr(worker_rq, 'send_message', lambda chat_id, text: None)
+    monkeypatch.setattr(worker_rq, 'send_text',
+                        lambda chat_id, text, filename, caption=None: files_sent.append(text))
+    monkeypatch.setenv('OCR_PAGE_EXECUTOR', 'process')
+    monkeypatch.setattr(worker_rq, 'OCRService', lambda: object())
+    monkeypatch.setattr(ocr_service, 'OCRService', PageProcessOCR)
+    monkeypatch.setattr(ocr_service, '_process_service', None)
+
+    tmpfile = os.path.join(tempfile.mkdtemp(), 'process.jpg')
+    with open('input.jpg', 'rb') as r, open(tmpfile, 'wb') as w:
+        w.write(r.read())
+
+    worker_rq.process_file_job_rq(tmpfile, 'image/jpeg', 5, {'cloud_ocr': False, 'langs': ['en']})
+
+    [text] = files_sent
+    assert text.startswith("page process text") and text.endswith(" eng")
+    assert f" {os.getpid()} " not in text
+
+
+def test_reaper_answers_subscribers_of_a_crashed_leader(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+    monkeypatch.setenv('FLIGHT_LEASE_TTL', '0.1')
+    messages, files_sent = [], []
+    monkeypatch.setattr(worker_rq, 'send_message', lambda chat_id, text: messages.append((chat_id, text)))
+    monkeypatch.setattr(worker_rq, 'send_text',
+                        lambda chat_id, text, filename, caption=None: files_sent.append((chat_id, text)))
+
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    flight = worker_rq._flight()
+    # one leader dies before producing anything, another after caching its result
+    for file_hash, subscriber in (('a' * 64, 2), ('b' * 64, 3)):
+        assert flight.acquire(cache_key(file_hash, opts), 1)
+        assert flight.acquire(cache_key(file_hash, opts), subscriber) is None
+    worker_rq.save_result('b' * 64, opts, "finished before the crash", 90.0)
+    time.sleep(0.15)
+
+    worker_rq.reap_flights()
+
+    assert messages == [(2, "Sorry, processing this file failed. Please send it again.")]
+    assert files_sent == [(3, "finished before the crash")]
+    worker_rq.reap_flights()
+    assert len(messages) == 1 and len(files_sent) == 1
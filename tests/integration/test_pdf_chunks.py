@@ -0,0 +1,217 @@
+import os
+import shutil
+import tempfile
+import time
+
+import fakeredis
+import pytest
+from PIL import Image
+from rq import Queue
+
+from services.pdf_service import PDFService
+from storage.cache import Cache
+from storage.result_store import RedisResultStore, result_key
+from storage.temp_store import PageCheckpoints
+from tasks import pdf_jobs, scheduler, worker_rq
+from tasks.pdf_jobs import chunk_pages
+from tasks.scheduler import FairScheduler
+from utils.hashing import sha256_file
+
+
+def _setup(monkeypatch):
+    fake = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fake))
+    monkeypatch.setattr(worker_rq, 'result_store', RedisResultStore(fake))
+    import tasks.queue_manager as qm
+    monkeypatch.setattr(qm, 'queues', {name: Queue(f"ocr-{name}", connection=fake, is_async=False)
+                                       for name in ("fast", "default", "bulk")})
+    monkeypatch.setattr(qm, 'scheduler', FairScheduler(fake))
+    monkeypatch.setattr(scheduler, 'get_redis', lambda url=None: fake)
+    monkeypatch.setenv('PDF_CHUNK_PAGES', '2')
+    sent = []
+    monkeypatch.setattr(worker_rq, 'send_message', lambda chat_id, text: None)
+
+
+    def send_file(chat_id, path, caption=None, filename=None):
+        with open(path, encoding='utf-8') as fh:
+            sent.append(fh.read())
+
+    monkeypatch.setattr(worker_rq, 'send_file', send_file)
+
+    recognised = []
+
+    class FakeOCR:
+        failures = 0
+
+        def __init__(self):
+            self.pdf = PDFService(render_dpi=20)
+
+        def ocr_image(self, image, langs=None):
+            if FakeOCR.failures:
+                FakeOCR.failures -= 1
+                raise RuntimeError("engine crashed")
+            recognised.append(image.size)
+            return ("page text", 90.0)
+
+
+    pdf_path = os.path.join(tempfile.mkdtemp(), 'scan.pdf')
+    page = Image.new('RGB', (120, 160), 'white')
+    page.save(pdf_path, 'PDF', save_all=True, append_images=[page] * 4)
+    monkeypatch.setattr(worker_rq, 'OCRService', FakeOCR)
+    return fake, pdf_path, sent, recognised
+
+
+def test_chunk_pages():
+    assert chunk_pages([0, 1, 2, 3, 4], 2) == [[0, 1], [2, 3], [4]]
+
+
+def test_large_pdf_is_split_into_chunks_and_reassembled(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 5, opts)
+
+    assert len(recognised) == 5
+    assert len(sent) == 1
+    assert [line for line in sent[0].splitlines() if line.startswith("---")] == \
+        [f"--- Page {i} ---" for i in range(1, 6)]
+    assert fake.keys("tgocr:pages:*") == [] and fake.keys("tgocr:input:*") == []
+
+
+def test_resubmitted_pdf_resumes_from_checkpointed_pages(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    key = result_key(sha256_file(pdf_path), opts)
+    # a previous attempt finished pages 1-3 before its worker died
+    PageCheckpoints(fake).put_many(key, {1: "done 1", 2: "done 2", 3: "done 3"})
+
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 5, opts)
+
+    assert len(recognised) == 2
+    assert "done 2" in sent[0] and sent[0].count("page text") == 2
+
+
+def test_chunks_run_through_the_fair_scheduler_on_the_documents_queue(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    monkeypatch.setenv('SCHED_BULK_MIN_UNITS', '3')
+    submitted = []
+    real_submit = FairScheduler.submit
+
+    def submit(self, queue, user_id, cost, func, *args, **kwargs):
+        submitted.append((queue, func))
+        return real_submit(self, queue, user_id, cost, func, *args, **kwargs)
+
+    monkeypatch.setattr(FairScheduler, 'submit', submit)
+    finalizers = []
+    real_enqueue = Queue.enqueue
+
+    def enqueue(self, func, *args, **kwargs):
+        if func == 'tasks.pdf_jobs.finalize_pdf':
+            finalizers.append((self.name, kwargs.get('job_timeout')))
+        return real_enqueue(self, func, *args, **kwargs)
+
+    monkeypatch.setattr(Queue, 'enqueue', enqueue)
+
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 5, {'cloud_ocr': False, 'langs': ['eng']})
+
+    assert submitted == [("bulk", 'tasks.pdf_jobs.ocr_pdf_chunk')] * 3
+    assert finalizers == [("ocr-bulk", pdf_jobs.FINALIZE_TIMEOUT)]
+    assert len(recognised) == 5 and len(sent) == 1
+    assert fake.hgetall("tgocr:chunked") == {}
+
+
+def test_failed_chunk_is_retried_for_its_missing_pages(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    worker_rq.OCRService.failures = 1
+
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 5, {'cloud_ocr': False, 'langs': ['eng']})
+
+    assert len(recognised) == 5
+    assert sent[0].count("page text") == 5
+
+
+def test_queued_chunks_keep_the_parent_leases_alive(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    monkeypatch.setenv('JOB_SLOT_TTL', '0.3')
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    file_hash = sha256_file(pdf_path)
+    sem = worker_rq._semaphore()
+    slot, _ = sem.acquire(5, {"job": "parent"})
+    # chunks wait in their queue instead of running straight away
+    monkeypatch.setattr(pdf_jobs, '_submit_chunk', lambda *a, **kw: None)
+    layout = PDFService().analyze(pdf_path)
+    pdf_jobs.start_chunked(pdf_path, file_hash, 5, opts, layout, slot_token=slot)
+
+    for _ in range(3):
+        time.sleep(0.15)
+        pdf_jobs.keep_chunked_alive()
+    assert sem.heartbeat(5, slot)
+
+    # a document whose chunks never report back is finalized at its deadline
+    key = result_key(file_hash, opts)
+    pdf_jobs.ChunkedJobs(fake).extend(key, 0)
+    pdf_jobs.keep_chunked_alive()
+    assert sent[0].count(pdf_jobs.FAILED_PAGE_TEXT) == 5
+    assert not sem.heartbeat(5, slot)
+    assert fake.hgetall("tgocr:chunked") == {}
+
+
+def test_deadline_follows_the_chunk_job_timeout(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    file_hash = sha256_file(pdf_path)
+    monkeypatch.setattr(pdf_jobs, '_submit_chunk', lambda *a, **kw: None)
+    monkeypatch.setattr(scheduler, 'JOB_TIMEOUTS', dict.fromkeys(scheduler.QUEUES, 60))
+    pdf_jobs.start_chunked(pdf_path, file_hash, 5, opts, PDFService().analyze(pdf_path))
+    key = result_key(file_hash, opts)
+    chunked = pdf_jobs.ChunkedJobs(fake)
+    assert chunked.deadline(key) == pytest.approx(time.time() + 60 * pdf_jobs.CHUNK_ATTEMPTS, abs=5)
+
+    # a starting chunk pushes the deadline out again
+    chunked.extend(key, 0)
+    pdf_jobs.ocr_pdf_chunk(file_hash, opts, 5, [0], 5)
+    assert chunked.deadline(key) == pytest.approx(time.time() + 60 * pdf_jobs.CHUNK_ATTEMPTS, abs=5)
+
+
+def test_partial_result_is_not_cached_and_failed_pages_are_retried(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    key = result_key(sha256_file(pdf_path), opts)
+    PageCheckpoints(fake).put_many(key, {1: "done 1", 2: "done 2", 3: "done 3"})
+    # the OCR engine fails on every attempt at the remaining pages
+    worker_rq.OCRService.failures = 2 * pdf_jobs.CHUNK_ATTEMPTS
+    resent = shutil.copy(pdf_path, pdf_path + '.again')
+
+    worker_rq.process_file_job_rq(pdf_path, 'application/pdf', 5, opts)
+
+    assert sent[0].count(pdf_jobs.FAILED_PAGE_TEXT) == 2
+    assert not worker_rq.cache.exists(key)
+    assert PageCheckpoints(fake).count(key) == 3
+
+    worker_rq.process_file_job_rq(resent, 'application/pdf', 5, opts)
+
+    assert len(recognised) == 2
+    assert "done 2" in sent[1] and sent[1].count("page text") == 2
+    assert worker_rq.cache.exists(key) and fake.keys("tgocr:pages:*") == []
+
+
+def test_chunk_dropped_by_the_scheduler_is_counted_down(monkeypatch):
+    fake, pdf_path, sent, recognised = _setup(monkeypatch)
+    import tasks.queue_manager as qm
+    opts = {'cloud_ocr': False, 'langs': ['eng']}
+    file_hash = sha256_file(pdf_path)
+    # chunks are submitted to the scheduler, but no token runs them
+    monkeypatch.setattr(qm, '_enqueue_token', lambda name: None)
+    pdf_jobs.start_chunked(pdf_path, file_hash, 5, opts, PDFService().analyze(pdf_path))
+    queue = pdf_jobs.ChunkedJobs(fake).get(result_key(file_hash, opts))["queue"]
+    sched = FairScheduler(fake, claim_ttl=0.1)
+    # every chunk's work horse dies mid-run, on each of its attempts
+    for _ in range(scheduler.MAX_ATTEMPTS):
+        assert not sent
+        for _ in range(3):
+            assert sched.claim(queue)
+        time.sleep(0.15)
+        qm.reap_stalled_jobs()
+
+    assert sent[0].count(pdf_jobs.FAILED_PAGE_TEXT) == 5
+    assert fake.hgetall("tgocr:chunked") == {}
@@ -17,18 +17,23 @@ class FakeMessage:
     async def reply_text(self, text):
         print("REPLY:", text)
 
+    async def reply_document(self, document, filename, caption=None):
+        print("DOCUMENT:", filename)
+
+def _empty_file():
+    import tempfile
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    return path
+
 class FakePhoto:
     def __init__(self, file_id="abc123"):
         self.file_id = file_id
 
     async def get_file(self):
-        class FakeFile:
-            async def download_to_drive(self, custom_path):
-                print(f"Downloading to: {custom_path}")
-                # create an empty file to simulate download
-                with open(custom_path, 'wb') as f:
-                    f.write(b'')
-        return FakeFile()
+        print("Downloading photo")
+        # an empty local file stands in for the download
+        return SimpleNamespace(file_path=_empty_file())
 
 class FakeDocument:
     def __init__(self, file_name="doc.pdf", mime_type="application/pdf"):
@@ -36,38 +41,60 @@ class FakeDocument:
         self.mime_type = mime_type
 
     async def get_file(self):
-        class FakeFile:
-            async def download_to_drive(self, custom_path):
-                print(f"Downloading doc to: {custom_path}")
-                with open(custom_path, 'wb') as f:
-                    f.write(b'')
-        return FakeFile()
+        print("Downloading doc")
+        return SimpleNamespace(file_path=_empty_file())
 
 # Monkeypatch modules that handlers import (simple stubs)
 # Create parent packages first so submodules can be imported
 sys.modules.setdefault('tasks', types.ModuleType('tasks'))
 sys.modules.setdefault('tasks.queue_manager', types.ModuleType('tasks.queue_manager'))
 import tasks.queue_manager as qmod
-qmod.enqueue_job = lambda *args, **kwargs: SimpleNamespace(id='fakejob')
+qmod.enqueue_ocr_job = lambda *args, **kwargs: SimpleNamespace(id='fakejob')
 
 sys.modules.setdefault('storage', types.ModuleType('storage'))
 sys.modules.setdefault('storage.rate_limiter', types.ModuleType('storage.rate_limiter'))
 import storage.rate_limiter as rmod
-class RateLimiter:
-    def allow(self, chat_id):
+class AsyncRateLimiter:
+    async def check(self, chat_id):
+        return SimpleNamespace(allowed=True, remaining=1, retry_after=0.0)
+    async def allow(self, chat_id):
         return True
-    def remaining(self, chat_id):
+    async def remaining(self, chat_id):
         return 1
-rmod.RateLimiter = RateLimiter
+rmod.AsyncRateLimiter = AsyncRateLimiter
 
 sys.modules.setdefault('storage.cache', types.ModuleType('storage.cache'))
 import storage.cache as cmod
-class Cache:
-    def exists(self, h):
+class AsyncCache:
+    conn = None
+    async def exists(self, h):
         return False
-    def get(self, h):
+    async def get(self, h):
+        return None
+cmod.AsyncCache = AsyncCache
+cmod.cache_key = lambda file_hash, opts=None: file_hash
+
+sys.modules.setdefault('storage.dedupe', types.ModuleType('storage.dedupe'))
+import storage.dedupe as dmod
+class AsyncUploadIndex:
+    def __init__(self, conn=None):
+        pass
+    async def lookup(self, file_unique_id, size):
         return None
-cmod.Cache = Cache
+    async def remember(self, file_unique_id, size, file_hash):
+        pass
+dmod.AsyncUploadIndex = AsyncUploadIndex
+
+sys.modules.setdefault('storage.singleflight', types.ModuleType('storage.singleflight'))
+import storage.singleflight as fmod
+class AsyncSingleFlight:
+    def __init__(self, conn=None):
+        pass
+    async def join(self, key, subscriber):
+        return False
+    async def acquire(self, key, subscriber):
+        return 'token'
+fmod.AsyncSingleFlight = AsyncSingleFlight
 
 # Now import handlers
 from handlers import commands, files
@@ -0,0 +1,32 @@
+import pickle
+
+import fakeredis
+
+from storage.cache import Cache, cache_key
+
+
+def test_cache_key_covers_engine_langs_and_version():
+    h = "ab" * 32
+    base = cache_key(h, {'langs': ['eng'], 'cloud_ocr': False})
+    assert base.startswith("v1:" + h)
+    assert cache_key(h, {'langs': ['rus'], 'cloud_ocr': False}) != base
+    assert cache_key(h, {'langs': ['eng'], 'cloud_ocr': True}) != base
+    assert cache_key(h, {'langs': ['rus', 'eng']}) == cache_key(h, {'langs': ['eng', 'rus']})
+
+
+def test_cache_roundtrip_stats_and_legacy_values():
+    fake = fakeredis.FakeRedis()
+    cache = Cache(conn=fake)
+
+    assert cache.get("k") is None
+    cache.set("k", {"result_key": "r", "confidence": 87.5})
+    assert cache.get("k") == {"result_key": "r", "confidence": 87.5}
+
+    # pickled values from the old format are never unpickled
+    fake.set("tgocr:cache:old", pickle.dumps({"txt_path": "/tmp/x"}))
+    assert cache.get("old") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["bytes_written"] == stats["bytes_read"] > 0
@@ -0,0 +1,28 @@
+from services.cascade import BLANK_PAGE, CascadePolicy, parse_thresholds
+
+
+def test_policy_uses_strictest_language_threshold():
+    policy = CascadePolicy(threshold=65, per_language=parse_thresholds("rus=75, uzb=60"))
+    assert policy.threshold_for(None) == 65
+    assert policy.threshold_for(['eng']) == 65
+    assert policy.threshold_for(['uzb']) == 60
+    assert policy.threshold_for(['uzb', 'rus']) == 75
+
+    assert policy.escalate(None)
+    assert policy.escalate(62.0, ['eng']) and not policy.escalate(62.0, ['uzb'])
+    assert not policy.escalate(100.0, ['rus'])
+
+
+def test_blank_pages_are_escalated_unless_disabled(monkeypatch):
+    assert CascadePolicy(threshold=65).escalate(BLANK_PAGE)
+    assert not CascadePolicy(threshold=0, escalate_blank=False).escalate(BLANK_PAGE)
+    monkeypatch.setenv('OCR_CLOUD_BLANK_PAGES', '0')
+    assert not CascadePolicy().escalate(BLANK_PAGE)
+
+
+def test_policy_reads_environment(monkeypatch):
+    monkeypatch.setenv('OCR_CLOUD_THRESHOLD', '50')
+    monkeypatch.setenv('OCR_CLOUD_THRESHOLDS', 'rus=70')
+    policy = CascadePolicy()
+    assert policy.threshold_for(['eng']) == 50
+    assert policy.threshold_for(['rus']) == 70
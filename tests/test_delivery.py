@@ -0,0 +1,128 @@
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from tasks.delivery import TelegramDelivery
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Minimal local Bot API: records calls and rate-limits the first sendMessage."""
+
+    calls = []
+    throttle_first = True
+    next_id = 100
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        ctype = self.headers.get('Content-Type', '')
+        if 'json' in ctype:
+            params = json.loads(raw or b'{}')
+        elif 'urlencoded' in ctype:
+            params = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        else:
+            params = {}
+        cls = type(self)
+        if method == 'getMe':
+            return self._reply(200, {'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'fake', 'username': 'fake_bot'}})
+        if method == 'sendMessage' and cls.throttle_first:
+            cls.throttle_first = False
+            return self._reply(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                                     'parameters': {'retry_after': 1}})
+        cls.calls.append((method, params))
+        cls.next_id += 1
+        return self._reply(200, {'ok': True, 'result': {
+            'message_id': cls.next_id, 'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'},
+            'text': params.get('text', '')}})
+
+
+def test_delivery_against_fake_bot_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/bot"
+    delivery = TelegramDelivery("123:abc", base_url=base_url, progress_interval=0.2)
+    try:
+        # first send hits a 429 and is retried after retry_after
+        msg = delivery.send_message(5, "hello").result(10)
+        assert msg.text == "hello"
+
+        for i in range(1, 21):
+            delivery.progress(5, f"Processing page {i}/20")
+        delivery.send_document(5, b"result text", "out.txt", caption="Full extracted text")
+        with tempfile.NamedTemporaryFile(suffix=".txt") as tf:
+            tf.write(b"streamed result")
+            tf.flush()
+            delivery.send_document_file(5, tf.name, "streamed.txt").result(10)
+        delivery.flush()
+        time.sleep(0.3)
+        delivery.progress(5, "Processing page 20/20 - done")
+        delivery.flush()
+    finally:
+        delivery.close()
+        server.shutdown()
+
+    methods = [m for m, _ in FakeBotAPI.calls]
+    assert methods[0] == 'sendMessage'
+    assert methods.count('sendDocument') == 2
+    # twenty-one progress updates collapse into one status message plus at most two edits
+    status_sends = [p for m, p in FakeBotAPI.calls[1:] if m == 'sendMessage']
+    edits = [p for m, p in FakeBotAPI.calls if m == 'editMessageText']
+    assert len(status_sends) == 1
+    assert 1 <= len(edits) <= 2
+    assert edits[-1]['text'] == "Processing page 20/20 - done"
+
+
+def test_idle_chat_queues_are_retired(monkeypatch):
+    monkeypatch.setattr(FakeBotAPI, 'throttle_first', False)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/bot"
+    delivery = TelegramDelivery("123:abc", base_url=base_url, idle_timeout=0.2)
+    try:
+        for chat_id in range(10, 20):
+            delivery.send_message(chat_id, "hello")
+        delivery.flush()
+        assert len(delivery._queues) == 10
+        time.sleep(0.5)
+        assert delivery._queues == {} and delivery._drainers == {}
+
+        # a retired chat gets a fresh queue on its next send
+        assert delivery.send_message(10, "again").result(10).text == "again"
+    finally:
+        delivery.close()
+        server.shutdown()
+
+
+def test_wait_outlasts_flood_control(monkeypatch):
+    monkeypatch.setattr(FakeBotAPI, 'throttle_first', True)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/bot"
+    delivery = TelegramDelivery("123:abc", base_url=base_url)
+    try:
+        # the send is held back by a 1s retry_after, well past the timeout
+        sent = delivery.send_message(5, "hello")
+        assert delivery.wait(sent, timeout=0.3)
+        assert sent.result().text == "hello"
+        # without flood control the timeout holds
+        assert not delivery.wait(Future(), timeout=0.1)
+    finally:
+        delivery.close()
+        server.shutdown()
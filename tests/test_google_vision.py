@@ -0,0 +1,117 @@
+import base64
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from services import google_vision
+from services.google_vision import GoogleVisionAdapter, encode_image
+
+
+class FakeVisionAPI(BaseHTTPRequestHandler):
+    """Local images:annotate: text is the image width; red images get a per-image error."""
+
+    batches = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        type(self).batches.append(len(body['requests']))
+        if any(r['imageContext']['languageHints'] == ['fail'] for r in body['requests']):
+            self.send_response(500)
+            self.end_headers()
+            return
+        responses = []
+        for req in body['requests']:
+            img = Image.open(io.BytesIO(base64.b64decode(req['image']['content'])))
+            r, g, b = img.convert('RGB').getpixel((0, 0))
+            if r > 200 and g < 50:
+                responses.append({'error': {'code': 3, 'message': 'Bad image'}})
+            else:
+                responses.append({'fullTextAnnotation': {'text': f"page {img.width}", 'pages': [
+                    {'blocks': [{'paragraphs': [{'words': [{'confidence': 0.9}, {'confidence': 0.7}]}]}]}]}})
+        payload = json.dumps({'responses': responses}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def endpoint():
+    FakeVisionAPI.batches = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeVisionAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+
+
+def _pages():
+    colours = ['white', 'white', 'red', 'white', 'white']
+    return [Image.new('RGB', (100 + i, 50), c) for i, c in enumerate(colours)]
+
+
+def test_batches_keep_order_and_map_errors_to_pages(endpoint):
+    adapter = GoogleVisionAdapter(endpoint=endpoint, batch_size=2)
+    results = adapter.ocr_batch([encode_image(p) for p in _pages()], languages=['en'])
+    adapter.close()
+
+    assert FakeVisionAPI.batches == [2, 2, 1]
+    assert [r.text for r in results] == ["page 100", "page 101", "", "page 103", "page 104"]
+    assert results[2].error == "Bad image"
+    assert results[0].confidence == pytest.approx(0.8)
+
+
+def test_failed_request_marks_only_its_batch(endpoint):
+    adapter = GoogleVisionAdapter(endpoint=endpoint, batch_size=16)
+    results = adapter.ocr_batch([encode_image(p) for p in _pages()[:2]], languages=['fail'])
+    assert all(r.error for r in results)
+    with pytest.raises(RuntimeError):
+        adapter.ocr(encode_image(_pages()[0]), languages=['fail'])
+
+
+def test_worker_falls_back_to_tesseract_for_failed_pages(endpoint, monkeypatch):
+    from tasks import worker_rq
+
+    monkeypatch.setattr(google_vision, '_shared', GoogleVisionAdapter(endpoint=endpoint, batch_size=2))
+
+    class FakeOCR:
+        def ocr_image(self, image, langs=None):
+            return ("tesseract", 55.0)
+
+    pages = list(enumerate(_pages(), start=1))
+    results = list(worker_rq._ocr_pages(FakeOCR(), {'cloud_ocr': True}, iter(pages)))
+    assert [r.page_num for r in results] == [1, 2, 3, 4, 5]
+    assert [r.value[0] for r in results] == ["page 100", "page 101", "tesseract", "page 103", "page 104"]
+
+
+def test_cascade_sends_only_low_confidence_pages_to_vision(endpoint, monkeypatch):
+    import fakeredis
+    from storage.cache import Cache
+    from storage.routing_stats import RoutingStats
+    from tasks import worker_rq
+
+    monkeypatch.setattr(google_vision, '_shared', GoogleVisionAdapter(endpoint=endpoint, batch_size=2))
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fakeredis.FakeStrictRedis()))
+    monkeypatch.setenv('OCR_CLOUD_THRESHOLD', '65')
+
+    class FakeOCR:
+        def ocr_image(self, image, langs=None):
+            return ("tesseract", 40.0 if image.width in (101, 102) else 92.0)
+
+    pages = list(enumerate(_pages(), start=1))
+    results = list(worker_rq._ocr_pages(FakeOCR(), {'cloud_ocr': True}, iter(pages)))
+    # pages 2 and 3 escalate in one batch; Vision fails on page 3, which keeps Tesseract's text
+    assert FakeVisionAPI.batches == [2]
+    assert [r.value for r in results] == [("tesseract", 92.0), ("page 101", pytest.approx(80.0)),
+                                          ("tesseract", 40.0), ("tesseract", 92.0), ("tesseract", 92.0)]
+
+    stats = RoutingStats(worker_rq.cache.conn).stats()
+    assert (stats['pages_local'], stats['pages_cloud'], stats['pages_cloud_failed']) == (3, 1, 1)
+    assert (stats['conf_4'], stats['conf_9']) == (2, 3)
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+
+import fakeredis
+
+from handlers import files
+from storage.cache import AsyncCache, Cache, cache_key
+from storage.dedupe import AsyncUploadIndex
+from storage.rate_limiter import AsyncRateLimiter
+from storage.result_store import RedisResultStore
+from storage.singleflight import AsyncSingleFlight
+
+
+class FakeMessage:
+    chat_id = 4242
+
+    def __init__(self):
+        self.replies = []
+        self.documents = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+    async def reply_document(self, document, filename, caption=None):
+        self.documents.append((filename, document))
+
+
+class FakeUpload:
+    file_id = "f1"
+    file_size = 11
+    file_name = "scan.pdf"
+    mime_type = "application/pdf"
+
+    def __init__(self, file_unique_id="uniq1"):
+        self.file_unique_id = file_unique_id
+        self.downloads = 0
+
+    async def get_file(self):
+        # as with a local Bot API server, the File's path is a file on disk
+        self.downloads += 1
+        path = os.path.join(tempfile.mkdtemp(), "upload")
+        with open(path, "wb") as fh:
+            fh.write(b"hello world")
+        return SimpleNamespace(file_path=path)
+
+
+def _setup(monkeypatch, max_per_minute=5):
+    server = fakeredis.FakeServer()
+    aconn = fakeredis.FakeAsyncRedis(server=server)
+    monkeypatch.setattr(files, '_rate_limiter', AsyncRateLimiter(max_per_minute=max_per_minute, conn=aconn))
+    monkeypatch.setattr(files, '_cache', AsyncCache(conn=aconn))
+    monkeypatch.setattr(files, '_upload_index', AsyncUploadIndex(conn=aconn))
+    monkeypatch.setattr(files, '_flight', AsyncSingleFlight(conn=aconn))
+    # the worker side uses sync clients against the same server
+    sync_conn = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(files, '_result_store', RedisResultStore(sync_conn))
+    queued = []
+    import tasks.queue_manager as qm
+    monkeypatch.setattr(qm, 'enqueue_ocr_job', lambda *a, **kw: queued.append((a, kw)) or SimpleNamespace(id='j1'))
+    return queued, sync_conn
+
+
+def _run(upload, message, user_data=None, bot=None):
+    update = SimpleNamespace(message=SimpleNamespace(document=upload, chat_id=message.chat_id,
+                                                     reply_text=message.reply_text,
+                                                     reply_document=message.reply_document))
+    asyncio.run(files.handle_document(update, SimpleNamespace(user_data=user_data or {}, bot=bot)))
+
+
+def test_rate_limited_upload_is_not_downloaded(monkeypatch):
+    queued, _ = _setup(monkeypatch, max_per_minute=1)
+    upload = FakeUpload()
+    _run(upload, FakeMessage())
+    msg = FakeMessage()
+    _run(upload, msg)
+
+    assert upload.downloads == 1
+    assert len(queued) == 1
+    assert "Rate limit exceeded" in msg.replies[-1]
+
+
+def test_known_upload_is_served_from_cache_without_download(monkeypatch):
+    queued, sync_conn = _setup(monkeypatch)
+    upload = FakeUpload()
+    _run(upload, FakeMessage())
+    args, kwargs = queued[0]
+    file_hash = kwargs['file_hash']
+    opts = args[3]
+
+    # the worker finishes and caches the result
+    files._result_store.put("r", "recognised text")
+    Cache(conn=sync_conn).set(cache_key(file_hash, opts), {"result_key": "r", "confidence": 90.0})
+
+    msg = FakeMessage()
+    _run(upload, msg)
+    assert upload.downloads == 1
+    assert len(queued) == 1
+    assert msg.documents == [(f"ocr_result_{file_hash[:16]}.txt", b"recognised text")]
+
+
+def test_identical_uploads_in_flight_share_one_job(monkeypatch):
+    queued, _ = _setup(monkeypatch)
+    _run(FakeUpload("a"), FakeMessage())
+    assert queued[0][1]['flight_token']
+
+    # same bytes under another file_unique_id: downloaded, but not queued again
+    other = FakeUpload("b")
+    msg = FakeMessage()
+    _run(other, msg)
+    assert other.downloads == 1
+    assert "already being processed" in msg.replies[-1]
+
+    # a re-sent known upload joins without downloading
+    again = FakeUpload("a")
+    _run(again, FakeMessage())
+    assert again.downloads == 0
+    assert len(queued) == 1
+
+
+def test_only_queued_uploads_keep_a_temp_dir(monkeypatch):
+    queued, _ = _setup(monkeypatch, max_per_minute=3)
+    made = []
+
+    def mkdtemp():
+        made.append(tempfile.mkdtemp())
+        return made[-1]
+
+    monkeypatch.setattr(files, 'tempfile', SimpleNamespace(mkdtemp=mkdtemp))
+    _run(FakeUpload("a"), FakeMessage())   # queued: the worker owns its directory
+    _run(FakeUpload("b"), FakeMessage())   # same bytes: downloaded, then joins the flight
+    _run(FakeUpload("a"), FakeMessage())   # known upload: joins without a download
+    _run(FakeUpload("c"), FakeMessage())   # rate limited
+
+    assert len(queued) == 1 and len(made) == 2
+    assert os.path.isdir(made[0]) and not os.path.exists(made[1])
+
+
+def test_remote_upload_is_fetched_through_the_bots_request(monkeypatch):
+    import hashlib
+    from telegram import File
+
+    queued, _ = _setup(monkeypatch)
+    fetched = []
+
+    class FakeRequest:
+        async def retrieve(self, url, **kwargs):
+            fetched.append(url)
+            return b"hello world"
+
+    class RemoteUpload(FakeUpload):
+        async def get_file(self):
+            self.downloads += 1
+            tg_file = File("f1", self.file_unique_id, file_size=11,
+                           file_path="https://api.telegram.org/file/bot1:x/documents/my scan.pdf")
+            tg_file.set_bot(SimpleNamespace(request=FakeRequest()))
+            return tg_file
+
+    _run(RemoteUpload(), FakeMessage())
+
+    # encoded once, by PTB
+    assert fetched == ["https://api.telegram.org/file/bot1%3Ax/documents/my%20scan.pdf"]
+    [(args, kwargs)] = queued
+    assert kwargs['file_hash'] == hashlib.sha256(b"hello world").hexdigest()
+    with open(args[0], 'rb') as fh:
+        assert fh.read() == b"hello world"
+
+
+def test_failed_enqueue_releases_the_flight(monkeypatch):
+    import hashlib
+    import tasks.queue_manager as qm
+    from storage.singleflight import SingleFlight
+
+    _, sync_conn = _setup(monkeypatch)
+    key = cache_key(hashlib.sha256(b"hello world").hexdigest(), {'langs': None, 'cloud_ocr': True})
+
+    def broken_enqueue(*args, **kwargs):
+        # an identical upload joins the flight while the enqueue is failing
+        assert SingleFlight(conn=sync_conn).acquire(key, 77) is None
+        raise ConnectionError("redis went away")
+
+    monkeypatch.setattr(qm, 'enqueue_ocr_job', broken_enqueue)
+    sent = []
+
+    async def send_message(chat_id, text):
+        sent.append((chat_id, text))
+
+    msg = FakeMessage()
+    _run(FakeUpload(), msg, bot=SimpleNamespace(send_message=send_message))
+
+    assert msg.replies[-1] == files.FAILED_TEXT
+    assert sent == [(77, files.FAILED_TEXT)]
+    # the next identical upload leads a new flight instead of waiting on a dead one
+    assert SingleFlight(conn=sync_conn).acquire(key, 5)
@@ -0,0 +1,154 @@
+import numpy as np
+
+from utils import langdet
+from utils.langdet import detect_languages, script_of_text, tesseract_langs
+
+RUSSIAN = "Съешь же ещё этих мягких французских булок, да выпей чаю."
+UZBEK = "Oʻzbekiston Respublikasi poytaxti Toshkent shahri hisoblanadi."
+
+
+def test_user_codes_map_to_tesseract_models():
+    assert tesseract_langs(['en', ' RU', 'uz', 'rus', 'uzb_cyrl']) == ['eng', 'rus', 'uzb', 'uzb_cyrl']
+    assert tesseract_langs(None) == []
+
+
+def test_script_of_text():
+    assert script_of_text(RUSSIAN) == 'Cyrillic'
+    assert script_of_text(UZBEK) == 'Latin'
+    assert script_of_text(RUSSIAN + UZBEK) is None
+    assert script_of_text("12 34") is None
+
+
+def test_detect_keeps_models_of_the_page_script(monkeypatch):
+    monkeypatch.setattr(langdet, '_osd_script', lambda image: None)
+    page = np.full((3000, 2000), 255, dtype=np.uint8)
+    seen = []
+
+    def recognize(image, models):
+        seen.append((image.size, models))
+        return RUSSIAN
+
+    assert detect_languages(page, ['en', 'ru', 'uz'], recognize=recognize) == ['rus']
+    # detection runs once, on a downscaled page, with every requested model
+    assert seen == [((1066, 1600), ['eng', 'rus', 'uzb'])]
+
+    assert detect_languages(page, ['en', 'ru', 'uz'], recognize=lambda i, m: UZBEK) == ['eng', 'uzb']
+    assert detect_languages(page, ['en', 'ru'], recognize=lambda i, m: "") is None
+    # a single script needs no detection at all
+    assert detect_languages(page, ['en', 'uz'], recognize=None) == ['eng', 'uzb']
+
+
+def test_worker_detects_sampled_pages_once_per_document(monkeypatch):
+    import fakeredis
+    from PIL import Image
+    from storage.cache import Cache
+    from tasks import worker_rq
+
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fakeredis.FakeStrictRedis()))
+    monkeypatch.setattr(langdet, '_osd_script', lambda image: None)
+    detections = []
+
+    class FakeTesseract:
+        def ocr(self, image, langs=None):
+            detections.append(langs)
+            return RUSSIAN, 90.0
+
+    class FakeOCR:
+        tesseract = FakeTesseract()
+        used = []
+
+        def ocr_image(self, image, langs=None):
+            self.used.append(langs)
+            return "text", 90.0
+
+    opts = {'cloud_ocr': False, 'langs': ['en', 'ru']}
+    pages = [(n, Image.new('L', (200, 300), 255)) for n in range(1, 6)]
+    list(worker_rq._ocr_pages(FakeOCR(), opts, iter(pages), doc_key='abc'))
+    # a second job on the same document (e.g. a retried chunk) reuses the recorded pages
+    list(worker_rq._ocr_pages(FakeOCR(), opts, iter(pages), doc_key='abc'))
+
+    assert detections == [['eng', 'rus']] * worker_rq.LANGDET_SAMPLE
+    assert FakeOCR.used == [['rus']] * 10
+
+
+def test_worker_keeps_every_script_of_a_mixed_document(monkeypatch):
+    import fakeredis
+    from PIL import Image
+    from storage.cache import Cache
+    from tasks import worker_rq
+
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fakeredis.FakeStrictRedis()))
+    monkeypatch.setattr(langdet, '_osd_script', lambda image: None)
+
+    class FakeTesseract:
+        def ocr(self, image, langs=None):
+            return image.info['text'], 90.0
+
+    class FakeOCR:
+        tesseract = FakeTesseract()
+        used = {}
+
+        def ocr_image(self, image, langs=None):
+            self.used[image.info['page']] = langs
+            return "text", 90.0
+
+    def page(n, text):
+        img = Image.new('L', (200, 300), 255)
+        img.info.update(page=n, text=text)
+        return n, img
+
+    # an Uzbek Latin document with a Russian page among the sampled ones and a blank one
+    pages = [page(1, UZBEK), page(2, RUSSIAN), page(3, ""), page(4, UZBEK), page(5, UZBEK)]
+    opts = {'cloud_ocr': False, 'langs': ['en', 'ru', 'uz']}
+    list(worker_rq._ocr_pages(FakeOCR(), opts, iter(pages), doc_key='mixed'))
+
+    assert FakeOCR.used[1] == ['eng', 'uzb'] and FakeOCR.used[2] == ['rus']
+    assert FakeOCR.used[3] == ['eng', 'rus', 'uzb']
+    assert FakeOCR.used[4] == FakeOCR.used[5] == ['eng', 'rus', 'uzb']
+
+    # a later chunk of the same document starts from the scripts its earlier chunks found
+    FakeOCR.used.clear()
+    list(worker_rq._ocr_pages(FakeOCR(), opts, iter([page(n, UZBEK) for n in range(6, 10)]), doc_key='mixed'))
+    assert FakeOCR.used[6] == ['eng', 'uzb'] and FakeOCR.used[9] == ['eng', 'rus', 'uzb']
+
+
+def test_worker_samples_each_document_once_and_rechecks_unsampled_scripts(monkeypatch):
+    import fakeredis
+    from PIL import Image
+    from storage.cache import Cache
+    from tasks import worker_rq
+
+    monkeypatch.setattr(worker_rq, 'cache', Cache(conn=fakeredis.FakeStrictRedis()))
+    monkeypatch.setattr(langdet, '_osd_script', lambda image: None)
+    detected = []
+
+    class FakeTesseract:
+        def ocr(self, image, langs=None):
+            detected.append(image.info['page'])
+            return image.info['text'], 90.0
+
+    class FakeOCR:
+        tesseract = FakeTesseract()
+        used = {}
+
+        def ocr_image(self, image, langs=None):
+            self.used.setdefault(image.info['page'], []).append(langs)
+            # Latin text read with Cyrillic models only is garbage
+            latin = image.info['text'] == UZBEK
+            return "text", 30.0 if latin and 'uzb' not in langs else 90.0
+
+    def page(n, text):
+        img = Image.new('L', (200, 300), 255)
+        img.info.update(page=n, text=text)
+        return n, img
+
+    opts = {'cloud_ocr': False, 'langs': ['en', 'ru', 'uz']}
+    list(worker_rq._ocr_pages(FakeOCR(), opts, iter([page(n, RUSSIAN) for n in range(1, 4)]), doc_key='doc'))
+    # the next chunk of the document is past the sample: nothing is detected
+    chunk = [page(4, RUSSIAN), page(5, UZBEK), page(6, RUSSIAN)]
+    list(worker_rq._ocr_pages(FakeOCR(), opts, iter(chunk), doc_key='doc'))
+
+    assert detected == [1, 2, 3]
+    assert FakeOCR.used[4] == FakeOCR.used[6] == [['rus']]
+    # the Latin page the sample missed is read again with every requested model
+    assert FakeOCR.used[5] == [['rus'], ['eng', 'rus', 'uzb']]
@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+
+from services.cascade import BLANK_PAGE
+from services.ocr_service import OCRService, merge_regions
+
+
+class FakeTesseract:
+    def __init__(self):
+        self.calls = []
+
+    def ocr(self, image, langs=None):
+        self.calls.append(image.shape)
+        return "block %d" % len(self.calls), 90.0 - 10 * len(self.calls)
+
+
+def _service():
+    service = OCRService.__new__(OCRService)
+    service.tesseract = FakeTesseract()
+    return service
+
+
+def test_blank_page_skips_recognition():
+    service = _service()
+    assert service.ocr_image(np.full((1754, 1240), 255, dtype=np.uint8)) == ("", BLANK_PAGE)
+    assert service.tesseract.calls == []
+
+
+def test_large_lettering_is_recognised_as_a_whole():
+    page = np.full((500, 1000), 255, dtype=np.uint8)
+    cv2.putText(page, "STOP HERE", (40, 330), cv2.FONT_HERSHEY_SIMPLEX, 5.5, 0, 16)
+
+    service = _service()
+    assert service.ocr_image(page) == ("block 1", 80.0)
+    assert service.tesseract.calls == [(500, 1000)]
+
+
+def test_small_text_blocks_are_cropped_and_merged_in_order():
+    page = np.full((1754, 1240), 255, dtype=np.uint8)
+    cv2.putText(page, "Total due: 42", (100, 1600), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+    cv2.putText(page, "Invoice 7", (100, 150), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+
+    service = _service()
+    text, conf = service.ocr_image(page)
+    assert text == "block 1\n\nblock 2"
+    assert all(h < 200 and w < 400 for h, w in service.tesseract.calls)
+    assert conf == 75.0
+
+
+def test_merge_regions_weights_confidence_by_words():
+    assert merge_regions([("one two three", 90.0), ("  ", 0.0), ("four", 50.0)]) == ("one two three\n\nfour", 80.0)
+    assert merge_regions([]) == ("", 0.0)
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from services.page_executor import PageExecutor
+
+
+def test_results_in_page_order_with_failure_isolation():
+    def work(n):
+        time.sleep(0.01 * (5 - n))  # later pages finish first
+        if n == 3:
+            raise ValueError("bad page")
+        return n * 10
+
+    executor = PageExecutor(max_workers=4, max_in_flight=4, use_processes=False)
+    results = list(executor.map(work, ((i, i) for i in range(1, 6))))
+
+    assert [r.page_num for r in results] == [1, 2, 3, 4, 5]
+    assert [r.value for r in results] == [10, 20, None, 40, 50]
+    assert isinstance(results[2].error, ValueError)
+
+
+def test_in_flight_pages_are_bounded():
+    lock = threading.Lock()
+    produced = []
+    consumed = []
+    peak = [0]
+
+    def pages():
+        for i in range(1, 21):
+            with lock:
+                produced.append(i)
+                peak[0] = max(peak[0], len(produced) - len(consumed))
+            yield i, i
+
+    executor = PageExecutor(max_workers=2, max_in_flight=3, use_processes=False)
+    for r in executor.map(lambda n: n, pages()):
+        with lock:
+            consumed.append(r.page_num)
+
+    assert consumed == list(range(1, 21))
+    assert peak[0] <= 3
@@ -15,3 +15,100 @@ def test_pdf_render_and_textlayer(tmp_path):
     # rendering should produce at least one page image
     page_img = pdf.render_page(str(pdf_path), 0)
     assert isinstance(page_img, Image.Image)
+
+
+def test_pdf_reuses_open_document(tmp_path):
+    img = Image.open('input.jpg')
+    pdf_path = tmp_path / 'sample.pdf'
+    img.save(str(pdf_path), 'PDF', save_all=True, append_images=[img.copy()])
+
+    pdf = PDFService(render_dpi=72)
+    doc = pdf.open_document(str(pdf_path))
+    try:
+        assert pdf.page_count(doc) == 2
+        pages = pdf.render_all_pages(doc)
+        first = next(pages)
+        assert first[0] == 1 and isinstance(first[1], Image.Image)
+        assert [n for n, _ in pages] == [2]
+        # the caller-owned document stays open after rendering
+        assert not doc.is_closed
+    finally:
+        doc.close()
+
+
+def test_analyze_mixed_pdf_in_one_pass(tmp_path):
+    import fitz
+
+    img = Image.open('input.jpg')
+    scanned_path = tmp_path / 'scanned.pdf'
+    img.save(str(scanned_path), 'PDF')
+
+    doc = fitz.open(str(scanned_path))
+    page = doc.new_page()
+    page.insert_text((72, 72), "Selectable text")
+    mixed_path = tmp_path / 'mixed.pdf'
+    doc.save(str(mixed_path))
+    doc.close()
+
+    pdf = PDFService()
+    assert pdf.analyze(str(scanned_path)).kind == "scanned"
+
+    layout = pdf.analyze(str(mixed_path))
+    assert layout.kind == "mixed"
+    assert layout.page_kinds == ["scanned", "text"]
+    assert layout.scanned_pages == [0]
+    assert "Selectable text" in layout.page_texts[1]
+
+
+def test_scanned_page_image_is_extracted_at_native_resolution(tmp_path):
+    import fitz
+
+    scan = Image.new('RGB', (850, 1100), 'white')
+    scan.paste((0, 0, 0), (0, 0, 100, 50))
+    pdf_path = tmp_path / 'scan.pdf'
+    scan.save(str(pdf_path), 'PDF', resolution=100)
+
+    # a 100 DPI scan is not upscaled to the 300 DPI render size
+    assert PDFService(render_dpi=300).render_page(str(pdf_path), 0).size == (850, 1100)
+    assert PDFService(render_dpi=50).render_page(str(pdf_path), 0).size == (425, 550)
+    assert PDFService(extract_images=False).render_page(str(pdf_path), 0).size == (2550, 3300)
+
+    doc = fitz.open(str(pdf_path))
+    doc[0].set_rotation(90)
+    rotated = PDFService().render_page(doc, 0)
+    assert rotated.size == (1100, 850)
+    assert rotated.convert('L').getpixel((1095, 5)) == 0
+
+    # vector content on the page means it has to be rendered
+    doc[0].set_rotation(0)
+    doc[0].draw_rect(fitz.Rect(10, 10, 50, 50))
+    assert PDFService(render_dpi=72).render_page(doc, 0).size == (612, 792)
+    doc.close()
+
+
+def test_bilevel_scan_is_decoded_as_grayscale(tmp_path):
+    pdf_path = tmp_path / 'fax.pdf'
+    Image.new('1', (400, 500), 1).save(str(pdf_path), 'PDF', resolution=100)
+
+    page = PDFService().render_page(str(pdf_path), 0)
+    assert page.mode == 'L' and page.size == (400, 500)
+    assert page.getpixel((10, 10)) == 255
+
+
+def test_render_dpi_adapts_to_text_size():
+    import fitz
+
+    doc = fitz.open()
+    for size, repeat in ((10, 40), (30, 5)):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 560, 780), "The quick brown fox jumps over the lazy dog. " * repeat,
+                            fontsize=size)
+    doc.new_page()
+
+    pdf = PDFService()
+    body, heading, blank = (pdf.page_dpi(doc[i]) for i in range(3))
+    assert 250 <= body <= 350
+    assert 100 <= heading < 150
+    assert blank == 300
+    assert PDFService(render_dpi=150).page_dpi(doc[1]) == 150
+    doc.close()
@@ -10,3 +10,116 @@ def test_preprocess_pipeline():
     assert isinstance(r2, Image.Image)
     r3 = binarize(r2)
     assert isinstance(r3, Image.Image)
+
+
+def test_fused_preprocess_returns_binary_gray_array():
+    import numpy as np
+    from services.preprocess import preprocess_for_ocr
+
+    img = Image.open('input.jpg')
+    out = preprocess_for_ocr(img)
+    assert isinstance(out, np.ndarray)
+    assert out.ndim == 2 and out.dtype == np.uint8
+    assert set(np.unique(out)) <= {0, 255}
+
+
+def _rotated_text_page(angle, size=(1240, 1754)):
+    import cv2
+    import numpy as np
+
+    w, h = size
+    page = np.full((h, w), 255, dtype=np.uint8)
+    for i, y in enumerate(range(150, h - 150, 40)):
+        cv2.putText(page, "lorem ipsum dolor sit amet %d consectetur" % i, (120, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(page, M, (w, h), flags=cv2.INTER_CUBIC, borderValue=255)
+
+
+def test_estimate_skew_on_rotated_pages():
+    import cv2
+    from services.preprocess import estimate_skew
+
+    for angle in (-15.0, -3.0, -0.7, 0.0, 1.2, 8.0, 30.0):
+        gray = _rotated_text_page(angle)
+        ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+        assert abs(estimate_skew(ink) + angle) <= 0.2, angle
+
+
+def test_open_for_ocr_scales_text_to_target_height(tmp_path):
+    import cv2
+    from services.preprocess import TARGET_TEXT_HEIGHT, estimate_text_height, open_for_ocr
+
+    page = _rotated_text_page(0)
+    assert 12 <= estimate_text_height(page) <= 20
+    # a photo with text 4x larger than needed, stored with a 90-degree EXIF rotation
+    photo = Image.fromarray(cv2.resize(page, None, fx=4, fy=4, interpolation=cv2.INTER_CUBIC))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    path = tmp_path / 'photo.jpg'
+    photo.save(str(path), quality=90, exif=exif.tobytes())
+
+    img = open_for_ocr(str(path))
+    assert img.mode == 'L'
+    assert img.width > img.height and img.width * img.height < photo.width * photo.height / 4
+    assert abs(estimate_text_height(img) - TARGET_TEXT_HEIGHT) <= 3
+
+
+def test_text_regions_blank_sparse_and_reading_order():
+    import cv2
+    import numpy as np
+    from services.preprocess import detect_text_regions, preprocess_for_ocr, recognition_regions
+
+    rng = np.random.default_rng(0)
+    paper = (np.full((1754, 1240), 235) + rng.normal(0, 6, (1754, 1240))).clip(0, 255).astype(np.uint8)
+    assert recognition_regions(preprocess_for_ocr(paper)) == []
+
+    footer = paper.copy()
+    cv2.putText(footer, "Page 7", (570, 1680), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 20, 2)
+    [(x, y, w, h)] = recognition_regions(preprocess_for_ocr(footer))
+    assert 540 <= x <= 570 and 1640 <= y <= 1665 and w < 200 and h < 80
+
+    # a heading across the top, then two columns; the right column starts higher than the left one ends
+    page = np.full((1754, 1240), 255, dtype=np.uint8)
+    cv2.putText(page, "HEADING", (420, 120), cv2.FONT_HERSHEY_SIMPLEX, 1.6, 0, 3)
+    for x, y0 in ((100, 300), (680, 200)):
+        for y in range(y0, y0 + 600, 30):
+            cv2.putText(page, "lorem ipsum dolor", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.7, 0, 2)
+    regions = detect_text_regions(page)
+    assert len(regions) == 3
+    heading, left, right = regions
+    assert heading[1] < 120 and left[0] < 200 and right[0] > 600
+
+
+def test_low_contrast_text_is_not_taken_for_blank_paper():
+    import cv2
+    import numpy as np
+    from services.preprocess import preprocess_for_ocr, recognition_regions
+
+    rng = np.random.default_rng(0)
+    for ink, paper in ((170, 205), (120, 160)):
+        page = np.full((1754, 1240), paper, dtype=np.uint8)
+        for y in range(200, 800, 40):
+            cv2.putText(page, "faint pencil notes", (100, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, ink, 2)
+        noisy = (page + rng.normal(0, 3, page.shape)).clip(0, 255).astype(np.uint8)
+        regions = recognition_regions(preprocess_for_ocr(noisy))
+        assert regions, (ink, paper)
+        assert min(y for _, y, _, _ in regions) < 200 and max(y + h for _, y, _, h in regions) > 760
+
+
+def test_large_lettering_is_one_full_page_region(tmp_path):
+    import cv2
+    import numpy as np
+    from services.preprocess import open_for_ocr, preprocess_for_ocr, recognition_regions
+
+    # glyphs this tall are no longer glyph-sized, but the page is not blank
+    page = np.full((500, 1000), 255, dtype=np.uint8)
+    cv2.putText(page, "STOP HERE", (40, 330), cv2.FONT_HERSHEY_SIMPLEX, 5.5, 0, 16)
+    assert recognition_regions(preprocess_for_ocr(page)) == [(0, 0, 1000, 500)]
+
+    photo = np.full((3000, 4000, 3), (40, 120, 40), dtype=np.uint8)
+    cv2.putText(photo, "EXIT", (500, 2100), cv2.FONT_HERSHEY_SIMPLEX, 30, (255, 255, 255), 80)
+    path = tmp_path / "exit.jpg"
+    Image.fromarray(photo).save(str(path))
+    img = open_for_ocr(str(path))
+    assert recognition_regions(preprocess_for_ocr(img)) == [(0, 0, img.width, img.height)]
@@ -1,16 +1,11 @@
 import fakeredis
-import os
-import redis
 from storage.rate_limiter import RateLimiter
 
 
-def test_rate_limiter_allow_and_remaining(monkeypatch):
+def test_rate_limiter_allow_and_remaining():
     fake = fakeredis.FakeRedis()
-    monkeypatch.setenv('REDIS_URL', 'redis://localhost:6379/0')
-    # monkeypatch the redis.from_url used in RateLimiter
-    monkeypatch.setattr(redis, 'from_url', lambda url: fake)
-
-    rl = RateLimiter(max_per_minute=3)
+    # inject the fake connection instead of the shared pool
+    rl = RateLimiter(max_per_minute=3, conn=fake)
 
     user_id = 123
     assert rl.allow(user_id)
@@ -20,3 +15,35 @@ def test_rate_limiter_allow_and_remaining(monkeypatch):
     assert not rl.allow(user_id)
     rem = rl.remaining(user_id)
     assert rem == 0
+
+
+def test_sliding_window_reports_retry_after_and_prechecks_locally():
+    fake = fakeredis.FakeRedis()
+    rl = RateLimiter(max_per_minute=2, conn=fake, mode='sliding', window=60)
+
+    first = rl.check(7)
+    assert first.allowed and first.remaining == 1
+    assert rl.check(7).allowed
+    denied = rl.check(7)
+    assert not denied.allowed
+    assert 0 < denied.retry_after <= 60
+
+    # while blocked, the limiter answers without touching Redis
+    fake.delete('tgocr:rate:sliding:7')
+    assert not rl.check(7).allowed
+
+
+def test_token_bucket_refills_over_time():
+    fake = fakeredis.FakeRedis()
+    rl = RateLimiter(max_per_minute=2, conn=fake, mode='token_bucket', window=0.2)
+
+    assert rl.allow(9)
+    assert rl.allow(9)
+    denied = rl.check(9)
+    assert not denied.allowed
+    assert 0 < denied.retry_after <= 0.2
+
+    import time
+    time.sleep(denied.retry_after + 0.05)
+    assert rl.allow(9)
+    assert rl.remaining(9) == 0
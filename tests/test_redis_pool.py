@@ -0,0 +1,76 @@
+from storage import redis_pool
+
+
+def test_clients_share_one_configured_pool(monkeypatch):
+    monkeypatch.setenv('REDIS_POOL_SIZE', '7')
+    monkeypatch.setenv('REDIS_SOCKET_TIMEOUT', '2.5')
+    redis_pool.reset_pools()
+    try:
+        a = redis_pool.get_redis('redis://localhost:6379/3')
+        b = redis_pool.get_redis('redis://localhost:6379/3')
+        assert a.connection_pool is b.connection_pool
+        assert a.connection_pool.max_connections == 7
+        assert a.connection_pool.connection_kwargs['socket_timeout'] == 2.5
+        assert redis_pool.get_redis('redis://localhost:6379/4').connection_pool is not a.connection_pool
+    finally:
+        redis_pool.reset_pools()
+
+
+class _PongServer:
+    """Just enough of a Redis server for PING; counts open client connections."""
+
+    def __init__(self):
+        import socket
+        import threading
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.open = 0
+        self.url = f"redis://127.0.0.1:{self.sock.getsockname()[1]}/0"
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        import threading
+        while True:
+            conn, _ = self.sock.accept()
+            self.open += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                self.open -= 1
+                return
+            conn.sendall(b'+PONG\r\n' * max(1, data.count(b'*')))
+
+
+def _wait_closed(server):
+    import time
+    deadline = time.monotonic() + 2
+    while server.open and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return server.open == 0
+
+
+def test_reset_disconnects_async_pools():
+    import asyncio
+    server = _PongServer()
+    redis_pool.reset_pools()
+
+    async def use_then_reset():
+        assert await redis_pool.get_async_redis(server.url).ping()
+        assert server.open == 1
+        redis_pool.reset_pools()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(use_then_reset())
+    assert _wait_closed(server)
+
+    async def use_then_close():
+        assert await redis_pool.get_async_redis(server.url).ping()
+        await redis_pool.close_async_pools()
+
+    asyncio.run(use_then_close())
+    assert _wait_closed(server)
+    redis_pool.reset_pools()
@@ -0,0 +1,44 @@
+import fakeredis
+
+from storage.result_store import LocalResultStore, PageStreamWriter, RedisResultStore, result_key
+
+
+def test_result_key_depends_on_options():
+    h = "ab" * 32
+    assert result_key(h, {'langs': ['eng', 'rus']}) == result_key(h, {'langs': ['rus', 'eng']})
+    assert result_key(h, {'langs': ['eng']}) != result_key(h, {'langs': ['rus']})
+    assert result_key(h, {'cloud_ocr': True}) != result_key(h, {'cloud_ocr': False})
+
+
+def test_local_and_redis_backends_roundtrip(tmp_path):
+    text = "Привет, world\n" * 100
+    for store in (LocalResultStore(str(tmp_path)), RedisResultStore(fakeredis.FakeRedis())):
+        key = result_key("cd" * 32, {'langs': ['eng']})
+        assert store.get(key) is None
+        assert not store.exists(key)
+        store.put(key, text)
+        assert store.exists(key)
+        assert store.get(key) == text
+        store.delete(key)
+        assert store.get(key) is None
+
+
+def test_page_stream_writer_orders_pages_and_stores_from_file(tmp_path):
+    writer = PageStreamWriter(4, dir=str(tmp_path))
+    writer.add(2, "двa")
+    assert writer.pages_written == 0
+    writer.add(1, "one")
+    writer.add(4, "four")
+    assert writer.last_page == 2
+    assert writer.read(1, 2) == "--- Page 1 ---\none\n--- Page 2 ---\nдвa"
+    assert writer.read(2, 2, limit=14) == "--- Page 2 ---"
+    writer.add(3, None)  # pages may be skipped
+    writer.close()
+
+    expected = "--- Page 1 ---\none\n--- Page 2 ---\nдвa\n--- Page 4 ---\nfour"
+    with open(writer.path, encoding="utf-8") as fh:
+        assert fh.read() == expected
+    for store in (LocalResultStore(str(tmp_path / "store")), RedisResultStore(fakeredis.FakeRedis())):
+        store.put_file("k", writer.path)
+        assert store.get("k") == expected
+    writer.discard()
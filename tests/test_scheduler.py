@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+
+import fakeredis
+import pytest
+from PIL import Image
+
+from tasks import scheduler
+from tasks.scheduler import FairScheduler, JobCost, estimate_cost, route
+
+
+def test_estimate_cost_and_route():
+    tmp = tempfile.mkdtemp()
+    shot = os.path.join(tmp, 'shot.png')
+    Image.new('RGB', (1920, 1080), 'white').save(shot)
+    pdf = os.path.join(tmp, 'scan.pdf')
+    page = Image.new('RGB', (200, 280), 'white')
+    page.save(pdf, 'PDF', save_all=True, append_images=[page] * 39)
+
+    assert route(estimate_cost(shot, 'image/png', {'cloud_ocr': False})) == "fast"
+    cost = estimate_cost(pdf, 'application/pdf', {'cloud_ocr': False})
+    assert cost.pages == 40
+    assert route(cost) == "bulk"
+    assert route(JobCost(4, 4 * scheduler.A4_MEGAPIXELS, False)) == "default"
+    # the same document via cloud OCR is cheaper for the worker
+    assert estimate_cost(pdf, 'application/pdf', {'cloud_ocr': True}).units < cost.units
+
+
+def test_users_are_interleaved_fairly():
+    sched = FairScheduler(conn=fakeredis.FakeRedis())
+    for i in range(5):
+        sched.submit("default", 1, 1.0, "jobs.ocr", f"heavy{i}")
+    sched.submit("default", 2, 1.0, "jobs.ocr", "light0")
+    order = [sched.claim("default")[1]["args"][0] for _ in range(2)]
+    sched.submit("default", 2, 1.0, "jobs.ocr", "light1")
+    while sched.pending("default"):
+        order.append(sched.claim("default")[1]["args"][0])
+
+    assert sched.claim("default") is None
+    assert order[:4] == ["heavy0", "light0", "heavy1", "light1"]
+    assert sorted(order) == sorted([f"heavy{i}" for i in range(5)] + ["light0", "light1"])
+
+
+def test_run_next_calls_the_scheduled_function(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(scheduler, 'get_redis', lambda url=None: fake)
+    FairScheduler().submit("fast", 7, 0.2, "os.path.join", "a", "b")
+    assert scheduler.run_next("fast") == os.path.join("a", "b")
+    assert scheduler.run_next("fast") is None
+    # acked: nothing is left to recover
+    assert FairScheduler().requeue_stalled("fast") == 0
+    assert fake.hlen("tgocr:sched:fast:specs") == 0
+
+
+def test_failed_and_abandoned_jobs_are_requeued(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(scheduler, 'get_redis', lambda url=None: fake)
+    sched = FairScheduler(claim_ttl=0.1)
+    sched.submit("default", 1, 1.0, "os.path.join", "a", "b")
+    sched.submit("default", 2, 1.0, "json.loads", "{not json")
+
+    # user 1's work horse is killed mid-job: its claim is never renewed or acked
+    job_id, spec = sched.claim("default")
+    assert spec["args"] == ["a", "b"]
+    # user 2's job raises
+    with pytest.raises(ValueError):
+        scheduler.run_next("default")
+    assert sched.requeue_stalled("default") == 1
+    time.sleep(0.15)
+    assert sched.requeue_stalled("default") == 1
+    assert sched.pending("default") == 2
+
+    # both specs survived and run again
+    assert scheduler.run_next("default") == os.path.join("a", "b")
+    with pytest.raises(ValueError):
+        scheduler.run_next("default")
+
+    # a job that keeps failing is dropped after MAX_ATTEMPTS runs
+    for _ in range(scheduler.MAX_ATTEMPTS - 2):
+        assert sched.requeue_stalled("default") == 1
+        with pytest.raises(ValueError):
+            scheduler.run_next("default")
+    assert sched.requeue_stalled("default") == 0
+    assert sched.pending("default") == 0 and fake.hlen("tgocr:sched:default:specs") == 0
+
+
+def test_enqueue_fair_reports_the_scheduled_job_id(monkeypatch):
+    from rq import Queue
+    from tasks import queue_manager as qm
+
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(qm, 'scheduler', FairScheduler(fake))
+    monkeypatch.setattr(qm, 'queues', {name: Queue(f"ocr-{name}", connection=fake) for name in scheduler.QUEUES})
+    first = qm.enqueue_fair("fast", 1, 0.2, "os.path.join", "a")
+    second = qm.enqueue_fair("fast", 2, 0.2, "os.path.join", "b")
+
+    assert (first.id, second.id) == ("fast:1", "fast:2")
+    assert first.token.func_name == "tasks.scheduler.run_next" and first.token.id != first.id
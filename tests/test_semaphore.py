@@ -0,0 +1,95 @@
+import time
+
+import fakeredis
+
+from storage.semaphore import Heartbeat, UserSemaphore
+
+
+def test_over_limit_jobs_are_parked_and_promoted_on_release():
+    sem = UserSemaphore(conn=fakeredis.FakeRedis(), limit=2, lease_ttl=60)
+    a, promoted = sem.acquire(1, {"job": "a"})
+    b, _ = sem.acquire(1, {"job": "b"})
+    assert a and b and not promoted
+    parked, _ = sem.acquire(1, {"job": "c"})
+    assert parked is None
+    assert sem.pending(1) == 1
+    # other users are not affected
+    assert sem.acquire(2, {"job": "x"})[0]
+
+    promoted = sem.release(1, a)
+    assert [spec for spec, _ in promoted] == [{"job": "c"}]
+    c = promoted[0][1]
+    assert sem.heartbeat(1, c)
+    assert not sem.heartbeat(1, a)
+    assert sem.release(1, b) == []
+    assert sem.pending(1) == 0
+
+
+def test_crashed_holder_lease_expires_and_frees_its_slot():
+    sem = UserSemaphore(conn=fakeredis.FakeRedis(), limit=1, lease_ttl=0.2)
+    crashed, _ = sem.acquire(1, {"job": "a"})
+    assert sem.acquire(1, {"job": "b"})[0] is None
+    time.sleep(0.25)
+
+    token, promoted = sem.acquire(1, {"job": "c"})
+    # the parked job gets the freed slot first; the newcomer waits behind it
+    assert token is None
+    assert [spec for spec, _ in promoted] == [{"job": "b"}]
+    assert not sem.heartbeat(1, crashed)
+
+
+def test_reap_promotes_parked_jobs_of_idle_users():
+    conn = fakeredis.FakeRedis()
+    sem = UserSemaphore(conn=conn, limit=1, lease_ttl=0.2)
+    sem.acquire(1, {"job": "leaked"})
+    sem.acquire(1, {"job": "parked"})
+    sem.acquire(2, {"job": "running"})
+    assert sem.reap() == []
+
+    time.sleep(0.25)
+    # only user 1 has parked jobs to reap
+    [(user, promoted)] = sem.reap()
+    assert user == 1 and [spec for spec, _ in promoted] == [{"job": "parked"}]
+    assert sem.heartbeat(1, promoted[0][1])
+    assert sem.reap() == [] and not conn.smembers("tgocr:sem:waiting")
+
+
+def test_heartbeat_keeps_a_lease_alive():
+    sem = UserSemaphore(conn=fakeredis.FakeRedis(), limit=1, lease_ttl=0.2)
+    token, _ = sem.acquire(1, {"job": "a"})
+    with Heartbeat(lambda: sem.heartbeat(1, token), 0.05):
+        time.sleep(0.4)
+    assert sem.heartbeat(1, token)
+    assert sem.acquire(1, {"job": "b"})[0] is None
+
+
+def test_reap_keeps_promoted_slots_while_their_job_is_queued():
+    conn = fakeredis.FakeRedis()
+    sem = UserSemaphore(conn=conn, limit=1, lease_ttl=0.2, max_queued=0.6)
+    running, _ = sem.acquire(1, {"job": "a"})
+    sem.acquire(1, {"job": "b"})
+    assert sem.waiting() == [{"job": "b"}]
+    [(spec, queued)] = sem.release(1, running)
+    assert sem.waiting() == [{"job": "b"}]
+
+    # the promoted job sits in a queue backlog well past its lease ttl
+    for _ in range(3):
+        time.sleep(0.15)
+        assert sem.reap() == []
+    assert sem.acquire(1, {"job": "c"})[0] is None
+    assert sem.heartbeat(1, queued)
+    # once started, the worker's own heartbeat keeps the slot
+    assert sem.waiting() == [{"job": "c"}]
+
+
+def test_queued_slots_are_only_kept_for_max_queued():
+    sem = UserSemaphore(conn=fakeredis.FakeRedis(), limit=1, lease_ttl=0.2, max_queued=0.3)
+    running, _ = sem.acquire(1, {"job": "a"})
+    sem.acquire(1, {"job": "b"})
+    [(_, queued)] = sem.release(1, running)
+    for _ in range(4):
+        time.sleep(0.15)
+        sem.reap()
+    assert not sem.heartbeat(1, queued)
+    assert sem.waiting() == []
+    assert sem.acquire(1, {"job": "c"})[0]
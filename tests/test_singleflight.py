@@ -0,0 +1,53 @@
+import time
+
+import fakeredis
+
+from storage.singleflight import SingleFlight
+
+
+def test_first_caller_leads_and_later_callers_subscribe():
+    flight = SingleFlight(conn=fakeredis.FakeRedis(), lease_ttl=60)
+    token = flight.acquire("k", 1)
+    assert token
+    assert flight.acquire("k", 2) is None
+    assert flight.join("k", 3)
+    assert flight.renew("k", token)
+
+    assert flight.release("k", "not-the-token") == []
+    assert flight.release("k", token) == [2, 3]
+    # the flight is over: nothing to join, and the next caller leads again
+    assert not flight.join("k", 4)
+    assert flight.acquire("k", 4)
+
+
+def test_expired_lease_passes_subscribers_to_the_next_leader():
+    flight = SingleFlight(conn=fakeredis.FakeRedis(), lease_ttl=0.2)
+    crashed = flight.acquire("k", 1)
+    assert flight.acquire("k", 2) is None
+    time.sleep(0.25)
+
+    token = flight.acquire("k", 3)
+    assert token
+    assert not flight.renew("k", crashed)
+    assert flight.release("k", crashed) == []
+    assert flight.release("k", token) == [2]
+
+
+def test_reap_hands_back_subscribers_of_a_vanished_leader():
+    flight = SingleFlight(conn=fakeredis.FakeRedis(), lease_ttl=0.2)
+    flight.acquire("crashed", 1)
+    assert flight.acquire("crashed", 2) is None
+    assert flight.join("crashed", 3)
+    done = flight.acquire("done", 4)
+    running = flight.acquire("running", 5)
+    assert flight.acquire("running", 6) is None
+    flight.release("done", done)
+    assert flight.reap() == []
+
+    time.sleep(0.1)
+    flight.renew("running", running)
+    time.sleep(0.15)
+    assert flight.reap() == [("crashed", [2, 3])]
+    # reaped once; the renewed flight keeps its subscriber for its leader
+    assert flight.reap() == []
+    assert flight.release("running", running) == [6]
@@ -0,0 +1,35 @@
+from services.tesseract_adapter import text_from_data, words_from_data
+
+
+def _data(rows):
+    keys = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+            'left', 'top', 'width', 'height', 'conf', 'text']
+    data = {k: [] for k in keys}
+    for row in rows:
+        for k, v in zip(keys, row):
+            data[k].append(v)
+    return data
+
+
+def test_text_and_words_from_single_pass_data():
+    data = _data([
+        (1, 1, 0, 0, 0, 0, 0, 0, 100, 100, -1, ''),
+        (5, 1, 1, 1, 1, 1, 10, 10, 20, 10, 96, 'Hello'),
+        (5, 1, 1, 1, 1, 2, 35, 10, 20, 10, '91.5', 'world'),
+        (5, 1, 1, 1, 2, 1, 10, 25, 20, 10, 80, 'second'),
+        (5, 1, 2, 1, 1, 1, 10, 60, 20, 10, 70, 'block'),
+        (5, 1, 2, 1, 1, 2, 35, 60, 20, 10, -1, ' '),
+    ])
+    assert text_from_data(data) == "Hello world\nsecond\n\nblock"
+
+    words = words_from_data(data)
+    assert [w['text'] for w in words] == ['Hello', 'world', 'second', 'block']
+    assert words[1]['conf'] == 91.5
+    assert words[0]['box'] == (10, 10, 20, 10)
+
+
+def test_config_maps_user_language_codes():
+    from services.tesseract_adapter import TesseractAdapter
+
+    assert TesseractAdapter()._config(['en', 'ru', 'uz'])[0] == 'eng+rus+uzb'
+    assert TesseractAdapter()._config(None)[0] == 'eng'
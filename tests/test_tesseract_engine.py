@@ -0,0 +1,68 @@
+import sys
+import threading
+import types
+
+from services.tesseract_engine import TesseractEngine
+
+
+class FakeAPI:
+    created = []
+
+    def __init__(self, lang, psm, oem):
+        self.key = (lang, psm, oem)
+        self.ended = False
+        FakeAPI.created.append(self)
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return "hello"
+
+    def AllWordConfidences(self):
+        return [90, 80, -1]
+
+    def Clear(self):
+        self.image = None
+
+    def End(self):
+        self.ended = True
+
+
+def test_engine_pool_reuses_api_across_threads(monkeypatch):
+    FakeAPI.created = []
+    monkeypatch.setitem(sys.modules, 'tesserocr', types.SimpleNamespace(PyTessBaseAPI=FakeAPI))
+    engine = TesseractEngine(max_idle=2)
+
+    assert engine.ocr(object(), langs=['eng']) == ("hello", 85.0)
+    engine.ocr(object(), langs=['eng'])
+    assert len(FakeAPI.created) == 1
+
+    # a fresh page thread (e.g. the next document's pool) checks out the same API
+    t = threading.Thread(target=engine.ocr, args=(object(),), kwargs={'langs': ['eng']})
+    t.start()
+    t.join()
+    assert len(FakeAPI.created) == 1
+
+    engine.ocr(object(), langs=['eng', 'rus'])
+    engine.ocr(object(), langs=['eng'], psm=6)
+    assert len(FakeAPI.created) == 3
+    # only `max_idle` APIs are kept; the least recently used one is ended
+    assert engine.idle_count() == 2
+    assert FakeAPI.created[0].ended
+    engine.close()
+    assert engine.idle_count() == 0
+
+
+def test_engine_pool_hands_concurrent_calls_separate_apis(monkeypatch):
+    FakeAPI.created = []
+    monkeypatch.setitem(sys.modules, 'tesserocr', types.SimpleNamespace(PyTessBaseAPI=FakeAPI))
+    engine = TesseractEngine(max_idle=4)
+
+    first = engine._checkout(('eng', 3, 1))
+    second = engine._checkout(('eng', 3, 1))
+    assert first is not second
+    engine._return(('eng', 3, 1), first)
+    engine._return(('eng', 3, 1), second)
+    assert engine._checkout(('eng', 3, 1)) in (first, second)
+    assert len(FakeAPI.created) == 2
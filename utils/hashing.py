@@ -7,3 +7,21 @@ def sha256_file(path: str) -> str:
         for chunk in iter(lambda: fh.read(8192), b""):
             h.update(chunk)
     return h.hexdigest()
+
+
+class HashingWriter:
+    """Write-through sink that hashes bytes as they are written, so a download
+    is hashed in the same pass instead of being re-read from disk."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        return self.fh.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
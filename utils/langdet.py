@@ -0,0 +1,122 @@
+"""Language code mapping and cheap script detection for picking Tesseract models.
+
+Users set languages as ISO 639-1 codes (`/language en,ru,uz`); Tesseract
+wants traineddata names (`eng+rus+uzb`), and every model in `-l` slows
+recognition down. `detect_languages` looks at one downscaled page, decides
+its script (Tesseract OSD, or the letters a quick recognition pass produced
+when OSD data is not installed) and keeps only the requested models for that
+script, so a Russian scan is read with `rus` alone.
+"""
+import logging
+import re
+from typing import Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# ISO 639-1 codes -> Tesseract traineddata names; Tesseract names pass through unchanged.
+TESSERACT_CODES = {
+    "en": "eng", "ru": "rus", "uz": "uzb", "uk": "ukr", "kk": "kaz", "be": "bel", "tr": "tur",
+    "de": "deu", "fr": "fra", "es": "spa", "it": "ita", "pt": "por", "pl": "pol",
+}
+# Script of each Tesseract language, as named by Tesseract's OSD.
+SCRIPTS = {
+    "eng": "Latin", "uzb": "Latin", "tur": "Latin", "deu": "Latin", "fra": "Latin", "spa": "Latin",
+    "ita": "Latin", "por": "Latin", "pol": "Latin",
+    "rus": "Cyrillic", "ukr": "Cyrillic", "kaz": "Cyrillic", "bel": "Cyrillic", "uzb_cyrl": "Cyrillic",
+}
+# OSD script confidence below which the answer is ignored.
+MIN_SCRIPT_CONF = 1.0
+# Share of letters one script needs in the quick pass for the page to count as that script.
+MIN_SCRIPT_SHARE = 0.8
+# Pages are downscaled to at most this many pixels per side for detection.
+DETECT_SIDE = 1600
+
+_LETTERS = {
+    "Latin": re.compile(r"[A-Za-z\u00C0-\u024F\u02BB\u02BC]"),
+    "Cyrillic": re.compile(r"[\u0400-\u04FF]"),
+}
+
+_osd_available = True
+
+
+def tesseract_langs(langs: Optional[Sequence[str]]) -> List[str]:
+    """Map user language codes to Tesseract model names, dropping duplicates."""
+    out = []
+    for lang in langs or []:
+        code = TESSERACT_CODES.get(lang.strip().lower(), lang.strip())
+        if code and code not in out:
+            out.append(code)
+    return out
+
+
+def script_of_text(text: str) -> Optional[str]:
+    """The script most letters of `text` are written in, if clearly dominant."""
+    counts = {script: len(pattern.findall(text or "")) for script, pattern in _LETTERS.items()}
+    total = sum(counts.values())
+    if total < 20:
+        return None
+    script = max(counts, key=counts.get)
+    return script if counts[script] >= MIN_SCRIPT_SHARE * total else None
+
+
+def _osd_script(image) -> Optional[str]:
+    global _osd_available
+    if not _osd_available:
+        return None
+    import pytesseract
+    try:
+        osd = pytesseract.image_to_osd(image, config="--psm 0", output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError as e:
+        if "osd" in str(e).lower() and "too few characters" not in str(e).lower():
+            logger.info("Tesseract OSD unavailable, detecting scripts from a quick pass: %s", e)
+            _osd_available = False
+        return None
+    except Exception as e:
+        logger.debug("OSD failed: %s", e)
+        return None
+    if float(osd.get("script_conf", 0)) < MIN_SCRIPT_CONF:
+        return None
+    return osd.get("script")
+
+
+def _thumbnail(image):
+    from PIL import Image
+    import numpy as np
+
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    scale = DETECT_SIDE / float(max(image.size))
+    if scale < 1:
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                             Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return image
+
+
+def needs_detection(langs: Optional[Sequence[str]]) -> bool:
+    """True if the requested models span several scripts, so detection can drop some."""
+    return len({SCRIPTS[lang] for lang in tesseract_langs(langs) if lang in SCRIPTS}) > 1
+
+
+def detect_languages(image, langs: Optional[Sequence[str]],
+                     recognize: Callable[[object, List[str]], str] = None) -> Optional[List[str]]:
+    """Tesseract models from `langs` needed for the page `image`, or None if undecided.
+
+    Only runs detection when the requested models span several scripts;
+    models of unknown script are always kept. `recognize(image, langs) -> text`
+    is the fallback when OSD is unavailable or unsure. None (e.g. for a blank
+    page) means "use all requested models and try again on another page".
+    """
+    candidates = tesseract_langs(langs)
+    if not needs_detection(candidates):
+        return candidates
+    thumb = _thumbnail(image)
+    script = _osd_script(thumb)
+    if script is None and recognize is not None:
+        try:
+            script = script_of_text(recognize(thumb, candidates))
+        except Exception as e:
+            logger.debug("Script detection pass failed: %s", e)
+    if script is None:
+        return None
+    keep = [lang for lang in candidates if SCRIPTS.get(lang, script) == script]
+    return keep or candidates